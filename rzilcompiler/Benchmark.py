@@ -0,0 +1,433 @@
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+from pathlib import Path
+
+import lark
+
+from rzilcompiler.ArchEnum import ArchEnum
+from rzilcompiler.Compiler import Compiler
+from rzilcompiler.Configuration import Conf, InputFile
+from rzilcompiler.Helper import log, LogLevel
+from rzilcompiler.Parser import ParsedInsn, Parser, ParserMode, lark_parsers
+
+BENCHMARK_VERSION = 1
+
+# The benchmarked stages in the order they run.
+STAGES = ["compiler", "preprocess", "load_behaviors", "parse", "transform"]
+
+# The files written by the preprocessor. They are restored after its benchmark.
+PREPROCESSOR_OUTPUTS = [
+    InputFile.HEXAGON_PP_MACROS_PATCHED_H,
+    InputFile.HEXAGON_PP_COMBINED_H,
+    InputFile.HEXAGON_PP_SHORTCODE_RESOLVED_TMP_H,
+    InputFile.HEXAGON_PP_SHORTCODE_RESOLVED_H,
+]
+
+
+def get_percentile(values: list[float], percent: float) -> float:
+    """Returns the percentile of the values (nearest rank). 0.0 if there are none."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = math.ceil(percent / 100 * len(values))
+    return values[max(rank, 1) - 1]
+
+
+class StageResult:
+    """
+    The timings of a benchmarked stage.
+    The items are single instructions or, for stages which process
+    all instructions at once, repetitions of the stage.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        total: float,
+        p50: float,
+        p95: float,
+        insns: int,
+        failed: int = 0,
+    ):
+        self.count = count
+        # Seconds of all items.
+        self.total = total
+        # Latencies of the items.
+        self.p50 = p50
+        self.p95 = p95
+        # Instructions processed by all items. 0 if the stage doesn't process any.
+        self.insns = insns
+        # Items which raised an exception (e.g. instructions which fail to parse).
+        self.failed = failed
+
+    @classmethod
+    def from_latencies(
+        cls, latencies: list[float], insns: int, failed: int = 0
+    ) -> "StageResult":
+        return cls(
+            len(latencies),
+            sum(latencies),
+            get_percentile(latencies, 50),
+            get_percentile(latencies, 95),
+            insns,
+            failed,
+        )
+
+    def get_throughput(self) -> float:
+        """Instructions per second."""
+        return self.insns / self.total if self.total > 0 else 0.0
+
+    def get_mean(self) -> float:
+        """Mean seconds per item."""
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "insns": self.insns,
+            "throughput": self.get_throughput(),
+            "p50": self.p50,
+            "p95": self.p95,
+            "failed": self.failed,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "StageResult":
+        return cls(d["count"], d["total"], d["p50"], d["p95"], d["insns"], d["failed"])
+
+
+class Benchmark:
+    """
+    Times the stages of the compiler over the real resources:
+    compiler:       Construction of the Compiler (repetitions).
+    preprocess:     PreprocessorHexagon.run_preprocess_steps(force=True) (repetitions).
+    load_behaviors: PreprocessorHexagon.load_insn_behavior() (repetitions).
+    parse:          Parsing each instruction.
+    transform:      Transforming the parse trees of each instruction to RZIL.
+
+    No cache is used, so every item is actually computed.
+    The parsers are built from the grammar for every compiler, except the tables
+    of the LALR parser, which are loaded from the parser cache.
+    """
+
+    def __init__(
+        self,
+        arch: ArchEnum,
+        parser_mode: ParserMode,
+        repeat: int = 3,
+        limit: int = 0,
+    ):
+        """
+        :param repeat: Repetitions of the stages which process all instructions at once.
+        :param limit: Only parse and transform the first <limit> instructions. All if 0.
+        """
+        self.arch = arch
+        self.parser_mode = parser_mode
+        self.repeat = repeat
+        self.limit = limit
+        self.compiler: Compiler | None = None
+        self.parsed: dict[str, ParsedInsn] = dict()
+
+    def get_config(self) -> dict:
+        """The settings and environment the results are only comparable with."""
+        return {
+            "arch": self.arch.name,
+            "parser_mode": str(self.parser_mode),
+            "repeat": self.repeat,
+            "limit": self.limit,
+            "python": platform.python_version(),
+            "lark": lark.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        }
+
+    def get_compiler(self) -> Compiler:
+        if not self.compiler:
+            self.compiler = Compiler(
+                self.arch, parser_mode=self.parser_mode, use_cache=False
+            )
+        return self.compiler
+
+    def get_behaviors(self) -> dict[str, list[str]]:
+        behaviors = self.get_compiler().preprocessor.behaviors
+        if not behaviors:
+            self.get_compiler().preprocessor.load_insn_behavior()
+        names = list(behaviors.keys())
+        if self.limit > 0:
+            names = names[: self.limit]
+        return {n: behaviors[n] for n in names}
+
+    def run(self, stages: list[str]) -> dict[str, StageResult]:
+        results = dict()
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            log(f"Benchmark: {stage}")
+            results[stage] = getattr(self, f"bench_{stage}")()
+        return results
+
+    def bench_compiler(self) -> StageResult:
+        latencies = list()
+        for _ in range(self.repeat):
+            # Shared by all compilers of the process. So every construction starts from scratch.
+            Compiler.sub_routines.clear()
+            lark_parsers.clear()
+            start = time.perf_counter()
+            self.compiler = Compiler(
+                self.arch, parser_mode=self.parser_mode, use_cache=False
+            )
+            latencies.append(time.perf_counter() - start)
+        return StageResult.from_latencies(latencies, 0)
+
+    def bench_preprocess(self) -> StageResult:
+        preprocessor = self.get_compiler().preprocessor
+        outputs = {f: Conf.get_path(f) for f in PREPROCESSOR_OUTPUTS}
+        backup = {f: p.read_bytes() for f, p in outputs.items() if p.exists()}
+        latencies = list()
+        try:
+            for _ in range(self.repeat):
+                start = time.perf_counter()
+                preprocessor.run_preprocess_steps(force=True)
+                latencies.append(time.perf_counter() - start)
+            # The behaviors may not be loaded yet. Count the preprocessed ones.
+            insns = sum(1 for _ in preprocessor.iter_insn_behavior()) * len(latencies)
+        finally:
+            for f, content in backup.items():
+                outputs[f].write_bytes(content)
+        return StageResult.from_latencies(latencies, insns)
+
+    def bench_load_behaviors(self) -> StageResult:
+        preprocessor = self.get_compiler().preprocessor
+        latencies = list()
+        for _ in range(self.repeat):
+            preprocessor.behaviors.clear()
+            start = time.perf_counter()
+            preprocessor.load_insn_behavior()
+            latencies.append(time.perf_counter() - start)
+        insns = len(preprocessor.behaviors) * len(latencies)
+        return StageResult.from_latencies(latencies, insns)
+
+    def bench_parse(self) -> StageResult:
+        parser = Parser(self.parser_mode, use_cache=False)
+        latencies = list()
+        failed = 0
+        self.parsed = dict()
+        for name, behavior in self.get_behaviors().items():
+            start = time.perf_counter()
+            parsed = parser.parse_insn(name, behavior)
+            latencies.append(time.perf_counter() - start)
+            failed += 1 if parsed.exception else 0
+            self.parsed[name] = parsed
+        return StageResult.from_latencies(latencies, len(latencies), failed)
+
+    def bench_transform(self) -> StageResult:
+        if not self.parsed:
+            log("Parse the instructions for the transform benchmark...")
+            parser = Parser(self.parser_mode, use_cache=False)
+            for name, behavior in self.get_behaviors().items():
+                self.parsed[name] = parser.parse_insn(name, behavior)
+        compiler = self.get_compiler()
+        latencies = list()
+        failed = 0
+        for name, parsed in self.parsed.items():
+            if parsed.exception:
+                continue
+            start = time.perf_counter()
+            try:
+                compiler.transform_insn(name, parsed, keep=False)
+            except Exception:
+                failed += 1
+            latencies.append(time.perf_counter() - start)
+        return StageResult.from_latencies(latencies, len(latencies), failed)
+
+
+def save_results(path: Path, config: dict, results: dict[str, StageResult]) -> None:
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "version": BENCHMARK_VERSION,
+                "config": config,
+                "stages": {s: r.to_dict() for s, r in results.items()},
+            },
+            f,
+            indent=2,
+        )
+
+
+def load_results(path: Path) -> tuple[dict, dict[str, StageResult]]:
+    """Returns the config and the stage results of a saved benchmark."""
+    with open(path) as f:
+        saved = json.load(f)
+    if saved.get("version") != BENCHMARK_VERSION:
+        raise ValueError(f"{path} has an unsupported benchmark version.")
+    stages = {s: StageResult.from_dict(r) for s, r in saved["stages"].items()}
+    return saved["config"], stages
+
+
+def format_results(results: dict[str, StageResult]) -> str:
+    lines = [
+        f"{'Stage':<15} {'Items':>7} {'Total (s)':>10} {'Insns/s':>10} "
+        f"{'p50 (ms)':>10} {'p95 (ms)':>10} {'Failed':>7}"
+    ]
+    for stage, r in results.items():
+        throughput = f"{r.get_throughput():.1f}" if r.insns else "-"
+        lines.append(
+            f"{stage:<15} {r.count:>7} {r.total:>10.3f} {throughput:>10} "
+            f"{r.p50 * 1000:>10.3f} {r.p95 * 1000:>10.3f} {r.failed:>7}"
+        )
+    return "\n".join(lines)
+
+
+def get_change(base: float, value: float) -> float:
+    return value / base - 1 if base > 0 else 0.0
+
+
+def compare_results(
+    baseline: dict[str, StageResult],
+    results: dict[str, StageResult],
+    threshold: float,
+) -> tuple[str, list[str]]:
+    """
+    Compares the results with a baseline.
+    A stage regressed if its median latency (p50) or its mean time per item
+    grew by more than threshold (e.g. 0.1 for 10%).
+    Returns the comparison table and the regressed stages.
+    """
+    lines = [
+        f"{'Stage':<15} {'Base p50 (ms)':>14} {'p50 (ms)':>10} {'Change':>8} "
+        f"{'Base mean (ms)':>15} {'Mean (ms)':>10} {'Change':>8}"
+    ]
+    regressed = list()
+    for stage, r in results.items():
+        base = baseline.get(stage)
+        if base is None:
+            lines.append(f"{stage:<15} (not in baseline)")
+            continue
+        p50_change = get_change(base.p50, r.p50)
+        mean_change = get_change(base.get_mean(), r.get_mean())
+        is_regression = p50_change > threshold or mean_change > threshold
+        if is_regression:
+            regressed.append(stage)
+        lines.append(
+            f"{stage:<15} {base.p50 * 1000:>14.3f} {r.p50 * 1000:>10.3f} {p50_change:>+8.1%} "
+            f"{base.get_mean() * 1000:>15.3f} {r.get_mean() * 1000:>10.3f} {mean_change:>+8.1%}"
+            + ("  REGRESSION" if is_regression else "")
+        )
+    return "\n".join(lines), regressed
+
+
+def parse_args() -> argparse.Namespace:
+    argp = argparse.ArgumentParser(
+        prog="RZIL Compiler Benchmark",
+        description="Times the stages of the compiler over the resources of an architecture.",
+    )
+    argp.add_argument(
+        "-a",
+        dest="arch",
+        choices=["Hexagon"],
+        required=True,
+        help="Architecture to benchmark.",
+    )
+    argp.add_argument(
+        "--parser",
+        dest="parser_mode",
+        choices=[m.value for m in ParserMode],
+        default=ParserMode.EARLEY.value,
+        help="The parser to benchmark. Default: earley",
+    )
+    argp.add_argument(
+        "--stages",
+        dest="stages",
+        nargs="+",
+        choices=STAGES,
+        default=STAGES,
+        help="The stages to benchmark. Default: all",
+    )
+    argp.add_argument(
+        "--repeat",
+        dest="repeat",
+        type=int,
+        default=3,
+        help="Repetitions of the compiler, preprocess and load_behaviors stages. Default: 3",
+    )
+    argp.add_argument(
+        "--limit",
+        dest="limit",
+        type=int,
+        default=0,
+        help="Only parse and transform the first N instructions. Default: all",
+    )
+    argp.add_argument(
+        "-o",
+        dest="output",
+        metavar="FILE",
+        type=Path,
+        help="Save the results as JSON. They can be used as baseline later.",
+    )
+    argp.add_argument(
+        "--baseline",
+        dest="baseline",
+        metavar="FILE",
+        type=Path,
+        help="Compare the results with the saved results in FILE. "
+        "Exits with 1 if a stage regressed.",
+    )
+    argp.add_argument(
+        "--threshold",
+        dest="threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown of a stage which counts as regression. Default: 0.1 (10%%)",
+    )
+    return argp.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    benchmark = Benchmark(
+        ArchEnum[args.arch.upper()],
+        ParserMode(args.parser_mode),
+        args.repeat,
+        args.limit,
+    )
+    config = benchmark.get_config()
+    baseline = None
+    if args.baseline:
+        baseline_config, baseline = load_results(args.baseline)
+        if baseline_config != config:
+            log(
+                f"The baseline was recorded with other settings: {baseline_config}",
+                LogLevel.WARNING,
+            )
+
+    results = benchmark.run(args.stages)
+    print(format_results(results))
+    if args.output:
+        save_results(args.output, config, results)
+        log(f"Saved results to {args.output}")
+    if baseline is None:
+        return 0
+    table, regressed = compare_results(baseline, results, args.threshold)
+    print(table)
+    if regressed:
+        log(
+            f"Regressed stages (> {args.threshold:.0%} slower): {', '.join(regressed)}",
+            LogLevel.ERROR,
+        )
+        return 1
+    log("No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import hashlib
+import os
+import pickle
+import shutil
+
+from pathlib import Path
+
+from rzilcompiler.Configuration import Conf, InputFile
+
+# Overwrites the cache directory (default: InputFile.CACHE_DIR).
+CACHE_DIR_ENV = "RZIL_COMPILER_CACHE_DIR"
+
+
+def get_cache_dir(sub_dir: str = "") -> Path:
+    """
+    Returns the cache directory (or a sub-directory of it) and creates it if needed.
+    """
+    if CACHE_DIR_ENV in os.environ:
+        cache_dir = Path(os.environ[CACHE_DIR_ENV])
+    else:
+        cache_dir = Conf.get_path(InputFile.CACHE_DIR)
+    if sub_dir:
+        cache_dir = cache_dir.joinpath(sub_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def get_digest(*parts: str | bytes) -> str:
+    """Returns the sha256 hex digest over all given parts."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf8")
+        # Length prefix, so ("ab", "c") and ("a", "bc") differ.
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+class FileCache:
+    """
+    A key-value store on disk. Every value is pickled into its own file,
+    so concurrent writers never corrupt other entries.
+    Keys are expected to be hex digests (see: get_digest()).
+    """
+
+    def __init__(self, name: str):
+        self.dir = get_cache_dir(name)
+
+    def get_path(self, key: str) -> Path:
+        return self.dir.joinpath(key[:2], key)
+
+    def get(self, key: str, default=None, touch: bool = False):
+        """
+        Returns the value of the key or default on a miss.
+        :param touch: Update the modification time of the entry,
+                      so evict() removes it after the less recently used ones.
+        """
+        path = self.get_path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            if touch:
+                os.utime(path)
+            return value
+        except FileNotFoundError:
+            return default
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            # Broken or outdated entry. Treat it as miss.
+            return default
+
+    def put(self, key: str, value) -> None:
+        path = self.get_path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def evict(self, max_bytes: int) -> int:
+        """
+        Removes the least recently modified entries until the cache holds
+        at most max_bytes. Returns the number of removed entries.
+        """
+        entries = list()
+        total = 0
+        for path in self.dir.glob("*/*"):
+            try:
+                st = path.stat()
+            except OSError:
+                # Removed by a concurrent writer.
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.dir.mkdir(parents=True, exist_ok=True)
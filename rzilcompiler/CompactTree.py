@@ -0,0 +1,173 @@
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+from array import array
+
+from lark import Discard, Token, Transformer, Tree
+from lark.exceptions import GrammarError, VisitError
+from lark.tree import Meta
+
+# Marks an entry as token (in the child count field) or as None child.
+NO_ID = -1
+
+
+class CompactTree:
+    """
+    A parse tree encoded as flat array. It is a lot smaller and faster to pickle
+    than Lark trees. Only the rule names, token types and token values are kept
+    (no meta data or token positions).
+
+    The nodes are stored in post-order (children before their parent, left to right)
+    as (rule/type id, token value id, child count) entries:
+
+    Tree:  (rule id, NO_ID, number of children)
+    Token: (type id, value id, NO_ID)
+    None:  (NO_ID, NO_ID, NO_ID)
+
+    The ids are indices into the string table.
+    """
+
+    def __init__(self, nodes: array, strings: list[str]):
+        self.nodes = nodes
+        self.strings = strings
+
+    def __len__(self) -> int:
+        """Returns the number of nodes."""
+        return len(self.nodes) // 3
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CompactTree):
+            return NotImplemented
+        return self.to_tree() == other.to_tree()
+
+    def __getstate__(self):
+        return self.nodes.tobytes(), "\0".join(self.strings)
+
+    def __setstate__(self, state):
+        nodes, strings = state
+        self.nodes = array("i")
+        self.nodes.frombytes(nodes)
+        self.strings = strings.split("\0")
+
+    @staticmethod
+    def from_tree(tree: Tree) -> "CompactTree":
+        nodes = array("i")
+        strings: list[str] = list()
+        string_ids: dict[str, int] = dict()
+
+        def intern(s: str) -> int:
+            s = str(s)
+            if s not in string_ids:
+                if "\0" in s:
+                    raise ValueError(f"Can not encode string with null byte: {repr(s)}")
+                string_ids[s] = len(strings)
+                strings.append(s)
+            return string_ids[s]
+
+        # Iterative post-order traversal. Keeps the encoding independent of the recursion limit.
+        stack = [(tree, False)]
+        while stack:
+            node, visited = stack.pop()
+            if isinstance(node, Tree):
+                if visited:
+                    nodes.extend((intern(node.data), NO_ID, len(node.children)))
+                    continue
+                stack.append((node, True))
+                stack.extend((c, False) for c in reversed(node.children))
+            elif isinstance(node, Token):
+                nodes.extend((intern(node.type), intern(node.value), NO_ID))
+            elif node is None:
+                nodes.extend((NO_ID, NO_ID, NO_ID))
+            else:
+                raise ValueError(f"Can not encode parse tree node: {repr(node)}")
+        return CompactTree(nodes, strings)
+
+    def to_tree(self, start: int = 0, end: int = -1) -> Tree | Token | None:
+        """
+        Returns the Lark tree of the nodes[start:end] (node indices).
+        The nodes of the range must form a single sub-tree. By default the whole tree.
+        """
+        nodes = self.nodes
+        strings = self.strings
+        end = len(self) if end < 0 else end
+        stack = list()
+        for i in range(start * 3, end * 3, 3):
+            a, b, n = nodes[i], nodes[i + 1], nodes[i + 2]
+            if n != NO_ID:
+                children = stack[len(stack) - n :]
+                del stack[len(stack) - n :]
+                stack.append(Tree(strings[a], children))
+            elif a == NO_ID:
+                stack.append(None)
+            else:
+                stack.append(Token(strings[a], strings[b]))
+        assert len(stack) == 1
+        return stack[0]
+
+    def pretty(self) -> str:
+        return self.to_tree().pretty()
+
+    def transform(self, transformer: Transformer):
+        """
+        Applies the Lark transformer to the encoded tree.
+        Callbacks are invoked in the same order as Transformer.transform() would.
+        """
+        nodes = self.nodes
+        strings = self.strings
+        visit_tokens = transformer.__visit_tokens__
+        values = list()
+        # Index of the first node of the sub-tree of each value. Needed for errors.
+        starts = list()
+        for k, i in enumerate(range(0, len(nodes), 3)):
+            a, b, n = nodes[i], nodes[i + 1], nodes[i + 2]
+            if n == NO_ID:
+                if a == NO_ID:
+                    value = None
+                else:
+                    value = Token(strings[a], strings[b])
+                    if visit_tokens:
+                        value = self.call_token_callback(transformer, value)
+                values.append(value)
+                starts.append(k)
+                continue
+
+            start = starts[len(starts) - n] if n else k
+            children = [c for c in values[len(values) - n :] if c is not Discard]
+            del values[len(values) - n :]
+            del starts[len(starts) - n :]
+            values.append(
+                self.call_rule_callback(transformer, strings[a], children, start, k)
+            )
+            starts.append(start)
+        assert len(values) == 1
+        return None if values[0] is Discard else values[0]
+
+    def call_rule_callback(
+        self, transformer: Transformer, rule: str, children: list, start: int, end: int
+    ):
+        try:
+            f = getattr(transformer, rule)
+        except AttributeError:
+            return transformer.__default__(rule, children, Meta())
+        try:
+            wrapper = getattr(f, "visit_wrapper", None)
+            if wrapper is not None:
+                return f.visit_wrapper(f, rule, children, Meta())
+            return f(children)
+        except GrammarError:
+            raise
+        except Exception as e:
+            raise VisitError(rule, self.to_tree(start, end + 1), e)
+
+    @staticmethod
+    def call_token_callback(transformer: Transformer, token: Token):
+        try:
+            f = getattr(transformer, token.type)
+        except AttributeError:
+            return transformer.__default_token__(token)
+        try:
+            return f(token)
+        except GrammarError:
+            raise
+        except Exception as e:
+            raise VisitError(token.type, token, e)
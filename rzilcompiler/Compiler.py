@@ -3,24 +3,67 @@
 # SPDX-License-Identifier: LGPL-3.0-only
 
 import argparse
+import importlib.metadata
 import json
+import multiprocessing
+import os
+import pickle
 import re
+import time
 
-from lark import Lark, Tree
+from collections import deque
+from collections.abc import Iterable, Iterator
+from functools import partial
+from multiprocessing import Pool
+from multiprocessing.pool import AsyncResult
+from pathlib import Path
+
+from lark import Tree
 from lark.exceptions import VisitError
 from tqdm import tqdm
 
-from rzilcompiler.Helper import log
+import rzilcompiler.Helper as Helper
+from rzilcompiler.Exceptions import RepeatedTransformException, WorkerException
+from rzilcompiler.Helper import log, LogLevel
 from rzilcompiler.Transformer.Pures.Macro import Macro
-from rzilcompiler.Transformer.ValueType import get_value_type_by_c_type, split_var_decl
+from rzilcompiler.Transformer.ValueType import (
+    ValueType,
+    get_value_type_by_c_type,
+    split_var_decl,
+)
 from rzilcompiler.Transformer.Pures.Parameter import Parameter
 from rzilcompiler.Transformer.Hybrids.SubRoutine import SubRoutine
-from rzilcompiler.Parser import Parser, ParsedInsn
+from rzilcompiler.Parser import (
+    InsnParsingBundle,
+    Parser,
+    ParsedInsn,
+    ParserException,
+    ParserMode,
+    get_behavior_key,
+    get_grammar,
+    get_lark_parser,
+    load_lark_parser,
+    save_lark_parser,
+    write_parse_report,
+)
 from rzilcompiler.ArchEnum import ArchEnum
+from rzilcompiler.Cache import FileCache, get_cache_dir, get_digest
+from rzilcompiler.CompactTree import CompactTree
 from rzilcompiler.Configuration import Conf, InputFile
 from rzilcompiler.HexagonExtensions import HexagonCompilerExtension
 from rzilcompiler.Preprocessor.Hexagon.PreprocessorHexagon import PreprocessorHexagon
+from rzilcompiler.MemProfile import MemoryProfile, profile_memory
+from rzilcompiler.RuleProfile import RuleProfile, profile_rules
+from rzilcompiler.StageProfile import (
+    TaskStats,
+    add_task_stats,
+    profile_stage,
+    profile_task,
+    profiling,
+)
+from rzilcompiler.Trace import add_events, collect_events, span, tracing
 from rzilcompiler.Transformer.RZILTransformer import RZILTransformer, CodeFormat
+from rzilcompiler.Watch import watch
 
 
 class RZILInstruction:
@@ -104,6 +147,22 @@ class RZILInstruction:
         setattr(self, key, value)
 
 
+# Upper bound of the size of the compiled output cache. See: Compiler.evict_result_cache()
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+# Version of the snapshot format. See: Compiler.save_snapshot()
+SNAPSHOT_VERSION = 1
+
+
+def get_package_version() -> str:
+    try:
+        return importlib.metadata.version("rzilcompiler")
+    except importlib.metadata.PackageNotFoundError:
+        # Run from the source tree.
+        return "unknown"
+
+
 class Compiler:
     preprocessor = None
     parser = None  # Parser only used for single statement compilations. Instructions are compiled in Parser.py
@@ -117,11 +176,21 @@ class Compiler:
     ext = None
 
     def __init__(
-        self, arch: ArchEnum, code_format: CodeFormat = CodeFormat.READ_STATEMENTS
+        self,
+        arch: ArchEnum,
+        code_format: CodeFormat = CodeFormat.READ_STATEMENTS,
+        parser_mode: ParserMode = ParserMode.EARLEY,
+        use_cache: bool = True,
+        rebuild_cache: bool = False,
     ):
-        self.arch: ArchEnum = arch
-        self.code_format = code_format
-
+        """
+        :param use_cache: Look up compiled instructions in the on-disk cache of compiled output
+                          and add new ones to it (see: get_cached_result()).
+                          The parse trees are cached as well.
+        :param rebuild_cache: Don't look up compiled instructions in the cache,
+                              but replace their entries with the newly compiled output.
+        """
+        self.init_state(arch, code_format, parser_mode, use_cache, rebuild_cache)
         self.set_lark_parser()
         self.set_extension()
         self.set_il_op_transformer()
@@ -130,10 +199,110 @@ class Compiler:
         self.add_macros()
         self.add_sub_routines()
 
+    def init_state(
+        self,
+        arch: ArchEnum,
+        code_format: CodeFormat,
+        parser_mode: ParserMode,
+        use_cache: bool,
+        rebuild_cache: bool,
+    ) -> None:
+        """Sets the settings and the empty state of the compiler."""
+        self.arch: ArchEnum = arch
+        self.code_format = code_format
+        self.parser_mode = parser_mode
+        # Transformed behaviors: behavior key -> (rzil, meta, trees)
+        # or the type and message of the raised exception.
+        # Cleared after each test_compile_all(). compiled_insns holds the results.
+        self.transformed_behaviors: dict[tuple, tuple] = dict()
+        self.dedup_hits = 0
+        # If set, the parses of compile_c_stmt() and parse_shortcode() are profiled per grammar rule.
+        self.rule_profile: RuleProfile | None = None
+        # Use the parse tree cache.
+        self.use_cache = use_cache
+        self.result_cache: FileCache | None = None
+        self.rebuild_cache = rebuild_cache
+        # Digest of the compiler config the cache keys are derived from. Set on first use.
+        self.result_cache_digest = ""
+        if use_cache:
+            try:
+                self.result_cache = FileCache("results")
+            except OSError as e:
+                log(f"Compiled output cache not available: {e}", LogLevel.WARNING)
+
+    def save_snapshot(self, path: Path) -> None:
+        """
+        Saves the set up compiler to a file: the (LALR) parser, the macros,
+        the compiled sub-routines and the noped instructions.
+        See: from_snapshot()
+        """
+        self.compile_sub_routines()
+        header = {
+            "version": SNAPSHOT_VERSION,
+            "config": self.get_config_digest(),
+        }
+        state = {
+            "parser": save_lark_parser(self.parser_mode),
+            "macros": self.transformer.macros,
+            "sub_routines": self.sub_routines,
+            "noped_insns": self.noped_insns,
+        }
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        log(f"Saved compiler snapshot to {path}")
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        path: Path,
+        arch: ArchEnum,
+        code_format: CodeFormat = CodeFormat.READ_STATEMENTS,
+        parser_mode: ParserMode = ParserMode.EARLEY,
+        use_cache: bool = True,
+        rebuild_cache: bool = False,
+    ) -> "Compiler":
+        """
+        Returns a compiler set up from a snapshot (see: save_snapshot())
+        instead of the grammar and JSON resources.
+        The snapshot is only valid for the same settings, grammar, resources and
+        compiler sources (see: get_config_digest()). Otherwise, a ValueError is raised.
+        """
+        compiler = cls.__new__(cls)
+        compiler.init_state(arch, code_format, parser_mode, use_cache, rebuild_cache)
+        with open(path, "rb") as f:
+            try:
+                header = pickle.load(f)
+                if not isinstance(header, dict):
+                    raise ValueError(f"{path} is not a compiler snapshot.")
+                if header.get("version") != SNAPSHOT_VERSION:
+                    raise ValueError(f"{path} has an unsupported snapshot version.")
+                if header.get("config") != compiler.get_config_digest():
+                    raise ValueError(
+                        f"{path} is outdated. The settings or inputs of the compiler changed."
+                    )
+                state = pickle.load(f)
+            except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+                raise ValueError(f"{path} is broken: {e}")
+
+        log(f"Set up compiler from snapshot {path}")
+        if state["parser"]:
+            load_lark_parser(parser_mode, state["parser"])
+        compiler.set_lark_parser()
+        compiler.set_extension()
+        compiler.noped_insns = state["noped_insns"]
+        compiler.sub_routines.update(state["sub_routines"])
+        compiler.set_il_op_transformer()
+        compiler.transformer.update_macros(state["macros"])
+        compiler.set_preprocessor()
+        return compiler
+
     def set_lark_parser(self):
-        with open(Conf.get_path(InputFile.GRAMMAR, "Hexagon")) as f:
-            grammar = "".join(f.readlines())
-        self.parser = Lark(grammar, start="fbody", parser="earley")
+        self.parser = get_lark_parser(self.parser_mode)
 
     def set_extension(self):
         if self.arch == ArchEnum.HEXAGON:
@@ -170,7 +339,8 @@ class Compiler:
 
     def run_preprocessor(self):
         log("Run preprocessor...")
-        self.preprocessor.run_preprocess_steps()
+        with span("run_preprocessor", "preprocessor"):
+            self.preprocessor.run_preprocess_steps()
 
     def add_noped_insns(self):
         log("Add noped instructions...")
@@ -188,6 +358,10 @@ class Compiler:
             )
 
     def add_sub_routines(self):
+        """
+        Adds the signatures of all sub-routines.
+        Their bodies are compiled on first use (see: compile_sub_routines()).
+        """
         log("Add sub-routines...")
         with open(Conf.get_path(InputFile.HEXAGON_SUB_ROUTINES_JSON)) as f:
             routines = json.load(f)
@@ -208,13 +382,13 @@ class Compiler:
         self, name: str, ret_type: str, params: list[str], body: str
     ) -> None:
         """
-        Compiles a sub-routine and buffers it for later usage.
+        Buffers a sub-routine for later usage. Its body is compiled on first use.
         :param name: The name of the sub_routine.
         :param ret_type: The return type in c syntax
         :param params: A list of parameters of this sub-routine in the form of "<type> <id>"
         :param body: The code of the sub-routines body.
         """
-        sub_routine = self.compile_sub_routine(name, ret_type, params, body)
+        sub_routine = self.compile_sub_routine(name, ret_type, params, body, lazy=True)
         self.sub_routines[name] = sub_routine
         self.transformer.update_sub_routines(self.sub_routines)
         log(f"Added sub-routine: {name}")
@@ -222,9 +396,36 @@ class Compiler:
     def get_sub_routine(self, name: str) -> SubRoutine:
         return self.sub_routines[name]
 
-    def test_compile_all(self):
-        self.parse_shortcode()
+    def compile_sub_routines(self) -> None:
+        """
+        Compiles the bodies of all sub-routines which were not used yet.
+        Needed before their definitions are emitted.
+        """
+        for sub_routine in self.sub_routines.values():
+            if not sub_routine.is_compiled():
+                log(f"Compile sub-routine: {sub_routine.routine_name}", LogLevel.DEBUG)
+                sub_routine.body
 
+    def test_compile_all(
+        self,
+        jobs: int = 0,
+        incremental: bool = False,
+        manifest: Path | None = None,
+        top: int = 10,
+        timings: Path | None = None,
+    ):
+        """
+        Compiles all instructions and prints a statistic about the results
+        and the slowest and largest instructions.
+        :param jobs: Number of worker processes which parse and transform the instructions.
+                     If 0, the instructions are transformed in this process.
+        :param incremental: Only compile instructions which changed since the last
+                            incremental build. See: compile_incremental()
+        :param manifest: The manifest of the incremental build.
+        :param top: Number of the slowest and largest instructions to print. None if 0.
+        :param timings: If given, the parse and transform time and the code size
+                        of every instruction are written to it (JSON). See: write_timings()
+        """
         keys = [
             "Successful",
             "UnexpectedToken",
@@ -235,31 +436,35 @@ class Compiler:
         ]
         stats = {k: {"count": 0} for k in keys}
 
-        log("Transform ASTs...")
-        for insn_name, parsed_insn in tqdm(self.parsed_insns.items()):
-            if parsed_insn.exception:
-                match parsed_insn.exception.name:
-                    case "UnexpectedToken":
-                        # Parser got unexpected token
-                        exc_name = "UnexpectedToken"
-                    case "UnexpectedCharacters":
-                        # Lexer can not match character to token.
-                        exc_name = "UnexpectedCharacters"
-                    case "UnexpectedEOF":
-                        exc_name = "UnexpectedEOF"
-                    case "Exception" | _:
-                        exc_name = "Exception"
-            else:
-                try:
-                    self.transform_insn(insn_name, parsed_insn)
-                    exc_name = "Successful"
-                except VisitError:
-                    # Something went wrong in the transformer
-                    exc_name = "VisitError"
-                except Exception:
-                    exc_name = "Exception"
+        if incremental:
+            results = self.compile_incremental(manifest, jobs)
+        elif jobs:
+            results = self.compile_all_parallel(jobs)
+        else:
+            behaviors = self.preprocessor.behaviors
+            results = self.get_cached_results(behaviors)
+            self.parse_shortcode(
+                insn_behavior={n: b for n, b in behaviors.items() if n not in results}
+            )
+            for insn_name, result in self.transform_parsed_insns().items():
+                self.put_cached_result(insn_name, behaviors[insn_name], result)
+                results[insn_name] = result
+            results = {n: results[n] for n in behaviors.keys()}
+            log(
+                f"Deduplicated behaviors: {len(self.transformed_behaviors)} transformed "
+                f"for {len(self.parsed_insns)} instructions ({self.dedup_hits} transformations saved)."
+            )
+        # The memo would hold all results a second time.
+        self.transformed_behaviors.clear()
+        self.evict_result_cache()
 
-            stats[exc_name]["count"] += 1
+        for result in results.values():
+            stats[result.exception or "Successful"]["count"] += 1
+        if top > 0:
+            print_leaderboards(results, top)
+        if timings:
+            write_timings(results, timings, self.get_timings_config())
+            log(f"Wrote instruction timings to {timings}")
 
         if sum([stats[k]["count"] for k in stats.keys() if k != "Successful"]) == 0:
             log("All instructions compiled successfully!")
@@ -269,8 +474,399 @@ class Compiler:
         for k, v in stats.items():
             print(f'\t{k} = {v["count"]}')
 
+    def transform_parsed_insns(self) -> dict[str, "CompiledInsnResult"]:
+        """
+        Transforms all parsed instructions. The successful ones are added to compiled_insns.
+        :return: The timed results of the parsed instructions.
+        """
+        results: dict[str, CompiledInsnResult] = dict()
+        log("Transform ASTs...")
+        with span("transform_parsed_insns", "transformer"), profile_stage("transform"):
+            for insn_name, parsed_insn in tqdm(self.parsed_insns.items()):
+                start = time.perf_counter()
+                if parsed_insn.exception:
+                    exc_name = get_parser_exception_bucket(parsed_insn.exception)
+                    result = CompiledInsnResult(insn_name, exception=exc_name)
+                else:
+                    try:
+                        insn = self.transform_insn(insn_name, parsed_insn)
+                        result = CompiledInsnResult(
+                            insn_name, insn.name, insn.rzil, insn.meta, insn.parse_trees
+                        )
+                    except Exception as e:
+                        exc_name = get_transform_exception_bucket(e)
+                        result = CompiledInsnResult(insn_name, exception=exc_name)
+                    result.transform_time = time.perf_counter() - start
+                result.parse_time = parsed_insn.parse_time
+                results[insn_name] = result
+        return results
+
+    def profile_memory(self, profile: MemoryProfile) -> None:
+        """
+        Parses and transforms all instructions, bypassing the parse tree cache and the
+        compiled output cache. Records the memory of both stages and the bytes retained
+        per instruction in the profile.
+        """
+        with profile.stage("parse_shortcode"):
+            self.parse_shortcode(use_cache=False)
+        with profile.stage("transform"):
+            self.transform_parsed_insns()
+        profile.add_insn_sizes("parsed_insns", self.parsed_insns)
+        profile.add_insn_sizes("compiled_insns", self.compiled_insns)
+
+    def get_timings_config(self) -> dict:
+        """The settings the instruction timings were recorded with."""
+        return {
+            "arch": self.arch.name,
+            "parser_mode": str(self.parser_mode),
+            "code_format": self.code_format.name,
+            "version": get_package_version(),
+        }
+
+    def compile_all_parallel(
+        self, jobs: int | None = None, insn_behavior: dict[str, list] | None = None
+    ) -> dict[str, "CompiledInsnResult"]:
+        """
+        Parses and transforms all instructions in worker processes.
+        Each worker holds its own fully initialized compiler. Only the compiled code
+        is sent back, not the parse trees. So self.parsed_insns is not filled.
+        Instructions with identical behaviors are compiled only once.
+        Instructions in the compiled output cache are not compiled at all.
+
+        :param jobs: Number of worker processes. None for one per CPU.
+        :param insn_behavior: The instructions to compile. Default: All preprocessor behaviors.
+        :return: The results of all instructions in the order of the behaviors.
+        """
+        behaviors = (
+            insn_behavior if insn_behavior is not None else self.preprocessor.behaviors
+        )
+        groups: dict[tuple, list[str]] = dict()
+        for name, behavior in behaviors.items():
+            noped = self.ext.transform_insn_name(name) in self.noped_insns
+            groups.setdefault((get_behavior_key(behavior), noped), list()).append(name)
+        results: dict[str, CompiledInsnResult] = self.get_cached_results(
+            {names[0]: behaviors[names[0]] for names in groups.values()}
+        )
+        args = [
+            InsnParsingBundle(names[0], behaviors[names[0]])
+            for names in groups.values()
+            if names[0] not in results
+        ]
+
+        log("Compile instructions...")
+        if args:
+            with profile_stage("compile"), self.get_compile_pool(jobs) as pool:
+                for res in tqdm(
+                    pool.imap(compile_single, args, chunksize=8),
+                    total=len(args),
+                    desc="Compile instructions",
+                ):
+                    add_events(res.trace_events)
+                    add_task_stats(res.task_stats)
+                    res.trace_events = None
+                    res.task_stats = None
+                    results[res.name] = res
+
+        # Fan out the results to the instructions with the same behavior.
+        for names in groups.values():
+            first = results[names[0]]
+            for name in names[1:]:
+                results[name] = first.copy_for(name, self.ext.transform_insn_name(name))
+        for res in results.values():
+            if not res.exception:
+                self.compiled_insns[res.insn_name] = res.to_rzil_instruction()
+        log(
+            f"Deduplicated behaviors: {len(args)} compiled "
+            f"for {len(behaviors)} instructions ({len(behaviors) - len(args)} compilations saved)."
+        )
+        return {name: results[name] for name in behaviors.keys()}
+
+    def get_config_digest(self) -> str:
+        """
+        Returns a digest over everything which determines the compiled code
+        besides the behaviors: the settings, grammar, resources and compiler sources.
+        """
+        parts = [
+            self.arch.name,
+            self.code_format.name,
+            self.parser_mode,
+            get_grammar(self.parser_mode),
+        ]
+        for resource in [
+            InputFile.HEXAGON_SUB_ROUTINES_JSON,
+            InputFile.HEXAGON_QEMU_RZIL_MACROS_JSON,
+            InputFile.HEXAGON_NOPED_INSNS_JSON,
+        ]:
+            parts.append(Conf.get_path(resource).read_bytes())
+        parts.append(get_package_version())
+        src_dir = Path(__file__).parent
+        for src in sorted(src_dir.rglob("*.py")):
+            if "Tests" not in src.relative_to(src_dir).parts:
+                parts.append(src.read_bytes())
+        return get_digest(*parts)
+
+    def get_result_cache_key(self, name: str, behavior: list[str]) -> str:
+        """
+        Returns the key of an instruction in the compiled output cache.
+        It is a digest over the (normalized) behavior, whether the instruction is noped
+        and the compiler config (see: get_config_digest()).
+        """
+        if not self.result_cache_digest:
+            self.result_cache_digest = self.get_config_digest()
+        noped = self.ext.transform_insn_name(name) in self.noped_insns
+        return get_digest(
+            self.result_cache_digest, str(noped), *get_behavior_key(behavior)
+        )
+
+    def get_cached_result(
+        self, name: str, behavior: list[str]
+    ) -> "CompiledInsnResult | None":
+        """
+        Returns the compiled output of the instruction from the compiled output cache.
+        Failed compilations are cached as well, so they are not retried.
+        None on a cache miss or if the cache is not used.
+        """
+        if not self.result_cache or self.rebuild_cache:
+            return None
+        result = self.result_cache.get(
+            self.get_result_cache_key(name, behavior), touch=True
+        )
+        if not isinstance(result, CompiledInsnResult):
+            return None
+        result = result.copy_for(name, self.ext.transform_insn_name(name))
+        result.cached = True
+        return result
+
+    def get_cached_results(
+        self, insn_behavior: dict[str, list]
+    ) -> dict[str, "CompiledInsnResult"]:
+        """
+        Returns the cached results of the given instructions (only the cache hits).
+        Successfully compiled instructions are added to compiled_insns.
+        """
+        if not self.result_cache or self.rebuild_cache:
+            return dict()
+        results = dict()
+        for name, behavior in insn_behavior.items():
+            result = self.get_cached_result(name, behavior)
+            if result is None:
+                continue
+            results[name] = result
+            if not result.exception:
+                self.compiled_insns[result.insn_name] = result.to_rzil_instruction()
+        log(
+            f"Compiled output cache: {len(results)} hits, "
+            f"{len(insn_behavior) - len(results)} misses."
+        )
+        return results
+
+    def put_cached_result(
+        self, name: str, behavior: list[str], result: "CompiledInsnResult"
+    ) -> None:
+        if self.result_cache:
+            self.result_cache.put(self.get_result_cache_key(name, behavior), result)
+
+    def evict_result_cache(self, max_bytes: int = RESULT_CACHE_MAX_BYTES) -> None:
+        """Removes the least recently used entries until the cache holds at most max_bytes."""
+        if not self.result_cache:
+            return
+        removed = self.result_cache.evict(max_bytes)
+        if removed:
+            log(f"Compiled output cache: Evicted {removed} entries.")
+
+    def get_manifest_path(self) -> Path:
+        """Returns the default manifest path of incremental builds."""
+        name = f"{self.arch.name.lower()}_{self.parser_mode}_{self.code_format.name.lower()}.json"
+        return get_cache_dir("incremental").joinpath(name)
+
+    def compile_incremental(
+        self, manifest: Path | None = None, jobs: int = 0
+    ) -> dict[str, "CompiledInsnResult"]:
+        """
+        Compiles only the instructions which were added or changed since the last
+        incremental build. The outputs of unchanged instructions are reused,
+        removed instructions are dropped.
+
+        The manifest maps each instruction to the hash of its (normalized) behavior
+        and the hash of its compiled output. The outputs are kept in the cache
+        directory, addressed by their hash. Like the compiled output cache, they are
+        evicted beyond RESULT_CACHE_MAX_BYTES. Unchanged instructions whose output
+        was evicted are compiled again and reported as evicted.
+        If the grammar, the resources, the compiler sources or settings changed,
+        everything is rebuilt.
+        Incremental builds need the cache. A ValueError is raised if the compiler
+        doesn't use it.
+
+        :param manifest: The manifest file. Default: See get_manifest_path()
+        :param jobs: Number of worker processes. If 0, the instructions are compiled
+                     in this process.
+        :return: The results of all instructions in the order of the behaviors.
+        """
+        if not self.use_cache:
+            raise ValueError("Incremental builds need the cache (use_cache=False).")
+        manifest = Path(manifest) if manifest else self.get_manifest_path()
+        config = self.get_config_digest()
+        previous = load_manifest(manifest, config)
+        outputs = FileCache("outputs")
+
+        behaviors = self.preprocessor.behaviors
+        behavior_hashes = {
+            name: get_digest(*get_behavior_key(b)) for name, b in behaviors.items()
+        }
+        results: dict[str, CompiledInsnResult] = dict()
+        to_compile: dict[str, list[str]] = dict()
+        changed = 0
+        evicted = 0
+        for name, behavior in behaviors.items():
+            entry = previous.get(name)
+            if entry and entry["behavior"] == behavior_hashes[name]:
+                output = outputs.get(entry["output"], touch=True)
+                if output is not None:
+                    results[name] = output.copy_for(
+                        name, self.ext.transform_insn_name(name)
+                    )
+                    results[name].cached = True
+                    continue
+                evicted += 1
+            elif entry:
+                changed += 1
+            to_compile[name] = behavior
+        removed = previous.keys() - behaviors.keys()
+        log(
+            f"Incremental build: {len(to_compile) - changed - evicted} added, "
+            f"{changed} changed, {len(removed)} removed, {len(results)} unchanged, "
+            f"{evicted} evicted instructions."
+        )
+        for name in removed:
+            self.compiled_insns.pop(self.ext.transform_insn_name(name), None)
+
+        if to_compile:
+            results.update(self.compile_insns(to_compile, jobs))
+
+        entries = dict()
+        for name in behaviors.keys():
+            result = results[name]
+            if name not in to_compile:
+                if not result.exception:
+                    self.compiled_insns[result.insn_name] = result.to_rzil_instruction()
+                output_hash = previous[name]["output"]
+            else:
+                output_hash = result.get_output_digest()
+                outputs.put(output_hash, result)
+            entries[name] = {"behavior": behavior_hashes[name], "output": output_hash}
+        save_manifest(manifest, config, entries)
+        removed_outputs = outputs.evict(RESULT_CACHE_MAX_BYTES)
+        if removed_outputs:
+            log(f"Incremental build outputs: Evicted {removed_outputs} entries.")
+        return {name: results[name] for name in behaviors.keys()}
+
+    def compile_insns(
+        self, insn_behavior: dict[str, list], jobs: int = 0
+    ) -> dict[str, "CompiledInsnResult"]:
+        """
+        Compiles the given instructions and returns their results.
+        :param jobs: Number of worker processes. If 0, the instructions are compiled
+                     in this process.
+        """
+        if jobs:
+            return self.compile_all_parallel(jobs, insn_behavior)
+        parser = Parser(self.parser_mode, self.use_cache, compact=True)
+        results = dict()
+        for name, behavior in tqdm(insn_behavior.items(), desc="Compile instructions"):
+            results[name] = compile_insn_with(self, parser, name, behavior, True)
+        return results
+
+    def get_compile_pool(
+        self, jobs: int | None, keep: bool = True, start_method: str = "fork"
+    ) -> Pool:
+        """
+        Returns a pool of compile workers (see: init_compile_worker()).
+        Forked workers inherit this compiler with its parsers and sub-routines.
+        So they don't set up anything and start compiling immediately.
+
+        :param start_method: The multiprocessing start method of the workers.
+                             Processes with running threads must not fork. They should use
+                             "spawn". Spawned workers set up their own compiler.
+        """
+        global inherited_compiler
+        if start_method == "fork":
+            inherited_compiler = self
+        try:
+            return multiprocessing.get_context(start_method).Pool(
+                jobs,
+                initializer=init_compile_worker,
+                initargs=(
+                    self.arch,
+                    self.code_format,
+                    self.parser_mode,
+                    keep,
+                    self.use_cache,
+                    self.rebuild_cache,
+                ),
+            )
+        finally:
+            inherited_compiler = None
+
+    def iter_compile(
+        self, names: list[str] | None = None, jobs: int = 0, window: int = 0
+    ) -> Iterator[RZILInstruction]:
+        """
+        Compiles the instructions of the resolved shortcode and yields them one by one.
+        Nothing is kept after an instruction is yielded (no ASTs, no compiled_insns).
+        So the memory usage is bounded by the number of instructions in flight,
+        not by the number of instructions of the ISA.
+        Instructions which fail to compile are yielded as not implemented instructions.
+
+        :param names: The instructions to compile. Default: All instructions.
+                      The instructions are yielded in the order of the shortcode.
+        :param jobs: Number of worker processes. If 0, the instructions are compiled
+                     in this process.
+        :param window: Maximum number of instructions in flight. Default: 4 per worker.
+        """
+        behaviors = self.preprocessor.iter_insn_behavior()
+        if names is not None:
+            names = set(names)
+            behaviors = ((n, b) for n, b in behaviors if n in names)
+
+        if not jobs:
+            parser = Parser(self.parser_mode, self.use_cache, compact=True)
+            for name, behavior in behaviors:
+                result = compile_insn_with(self, parser, name, behavior, keep=False)
+                yield self.get_streamed_rzil_insn(result)
+            self.evict_result_cache()
+            return
+
+        window = window if window > 0 else 4 * jobs
+        in_flight: deque[AsyncResult] = deque()
+        with self.get_compile_pool(jobs, keep=False) as pool:
+            for name, behavior in behaviors:
+                if len(in_flight) == window:
+                    yield self.get_streamed_rzil_insn(in_flight.popleft().get())
+                bundle = InsnParsingBundle(name, behavior)
+                in_flight.append(pool.apply_async(compile_single, (bundle,)))
+            while in_flight:
+                yield self.get_streamed_rzil_insn(in_flight.popleft().get())
+        self.evict_result_cache()
+
+    def get_streamed_rzil_insn(self, result: "CompiledInsnResult") -> RZILInstruction:
+        add_events(result.trace_events)
+        add_task_stats(result.task_stats)
+        result.trace_events = None
+        result.task_stats = None
+        if not result.exception:
+            return result.to_rzil_instruction()
+        log(f"{result.name}: {result.exception}", LogLevel.DEBUG)
+        return RZILInstruction.get_unimplemented_rzil_instr(
+            self.ext.transform_insn_name(result.name)
+        )
+
     def compile_sub_routine(
-        self, name: str, return_type: str, parameter: list[str], body: str
+        self,
+        name: str,
+        return_type: str,
+        parameter: list[str],
+        body: str,
+        lazy: bool = False,
     ) -> SubRoutine:
         """
         Returns a SubRoutine object initialized with the given arguments.
@@ -278,20 +874,28 @@ class Compiler:
         :param return_type: The return type in c syntax
         :param parameter: A list of parameters of this sub-routine in the form of "<type> <id>"
         :param body: The code of the sub-routines body.
+        :param lazy: Only check the signature. The body is compiled on first access
+                     of SubRoutine.body.
         :return: The sub-routine object to initialization.
         """
         if name in self.sub_routines:
             log(f"Return already compiled sub-routine {name}")
             return self.sub_routines[name]
 
-        params = list()
-        for param in parameter:
-            ptype, pname = split_var_decl(param)
-            p = Parameter(pname, get_value_type_by_c_type(ptype))
-            params.append(p)
+        ret_type, params = get_sub_routine_signature(return_type, parameter)
+        compile_body = partial(
+            self.compile_sub_routine_body, return_type, parameter, body
+        )
+        return SubRoutine(
+            name, ret_type, params, compile_body if lazy else compile_body()
+        )
 
-        ret_type = get_value_type_by_c_type(return_type)
-        # Compile the body
+    def compile_sub_routine_body(
+        self, return_type: str, parameter: list[str], body: str
+    ) -> str:
+        # The value types of the SubRoutine are modified by the transformers using it.
+        # So a lazily compiled body must not share them.
+        ret_type, params = get_sub_routine_signature(return_type, parameter)
         ast_body = self.parser.parse(body)
         transformer = RZILTransformer(
             ArchEnum.HEXAGON,
@@ -300,8 +904,7 @@ class Compiler:
             return_type=ret_type,
         )
         transformer.macros = self.transformer.macros
-        body = transformer.transform(ast_body)
-        return SubRoutine(name, ret_type, params, body)
+        return transformer.transform(ast_body)
 
     def compile_c_stmt(self, code: str) -> str:
         """
@@ -311,44 +914,148 @@ class Compiler:
         :param code: The C code to compile.
         :return: The RzIL representation of it.
         """
-        ast = self.parser.parse(code)
-        result = self.transformer.transform(ast)
-        self.transformer.reset()
-        return result
+        with profile_rules(self.rule_profile):
+            ast = self.parser.parse(code)
+        try:
+            return self.transformer.transform(ast)
+        finally:
+            self.transformer.reset()
+
+    def compile_c_stmts(
+        self, stmts: Iterable[str], workers: int = 0
+    ) -> list[str | Exception]:
+        """
+        Compiles many C statements (see: compile_c_stmt()) with the parser and transformer
+        of this compiler or the inherited ones of the workers.
+
+        :param stmts: The statements to compile.
+        :param workers: Number of worker processes. If 0, the statements are compiled in this process.
+        :return: The RzIL code of each statement or the exception raised while compiling it,
+                 in the order of the statements. Exceptions of workers are returned as
+                 WorkerException, because Lark's exceptions can't be pickled.
+        """
+        if not workers:
+            return [compile_stmt_with(self, stmt) for stmt in stmts]
+        with self.get_compile_pool(workers) as pool:
+            return list(pool.imap(compile_stmt_single, stmts, chunksize=16))
 
     def compile_insn(self, insn_name: str) -> RZILInstruction:
         return self.transform_insn(insn_name, self.parsed_insns[insn_name])
 
-    def parse_shortcode(self):
+    def parse_shortcode(
+        self,
+        report: Path | None = None,
+        profile: bool = False,
+        insn_behavior: dict[str, list] | None = None,
+        use_cache: bool = True,
+    ):
+        """
+        Parses all instructions into parsed_insns (with Lark trees).
+        :param report: If given, the parsing is instrumented and a report about the
+                       parse time and ambiguities of each instruction is written to it.
+                       See: Parser.write_parse_report()
+        :param profile: Profile the parser per grammar rule. The profile is added to rule_profile.
+        :param insn_behavior: The instructions to parse. Default: All preprocessor behaviors.
+        :param use_cache: Use the parse tree cache, if the compiler uses caches.
+        """
         log("Parse shortcode...")
-        self.parsed_insns = Parser().parse(self.preprocessor.behaviors)
+        parser = Parser(
+            self.parser_mode,
+            self.use_cache and use_cache,
+            instrument=report is not None,
+            profile=profile,
+        )
+        with span("parse_shortcode", "parser"), profile_stage("parse_shortcode"):
+            self.parsed_insns = parser.parse(
+                insn_behavior
+                if insn_behavior is not None
+                else self.preprocessor.behaviors
+            )
+        if report:
+            write_parse_report(self.parsed_insns, report, self.parser_mode)
+        if profile:
+            if self.rule_profile is None:
+                self.rule_profile = RuleProfile()
+            self.rule_profile.merge(parser.rule_profile)
+
+    def check_parser_conformance(self) -> bool:
+        """
+        Parses all instructions with the Earley and the LALR parser and
+        prints a report about the differences of the parse trees.
+        """
+        log("Check parser conformance...")
+        report = Parser.check_conformance(self.preprocessor.behaviors)
+        report.print()
+        return report.conforms()
+
+    def check_fast_path_parity(self) -> bool:
+        """
+        Parses all behaviors the fast path recognizes with the fast path and Lark
+        and prints a report about differences of the parse trees and the hit rate.
+        """
+        log("Check fast path parity...")
+        report = Parser.check_fast_path(self.preprocessor.behaviors, self.parser_mode)
+        report.print()
+        return report.conforms()
 
     def transform_insn(
-        self, insn_name: str, parsed_insns: ParsedInsn
+        self, insn_name: str, parsed_insns: ParsedInsn, keep: bool = True
     ) -> RZILInstruction:
         """Compiles the instruction <insn_name> and returns the RZIL code.
         An instruction of certain architectures can have multiple behaviors,
         so this method returns a list of compiled behaviors.
         For most instructions this list has a length of 1.
+        Instructions with identical behaviors are transformed only once.
+        If the behavior failed to transform before, a RepeatedTransformException
+        with the type and message of the first exception is raised.
+
+        :param keep: Memoize the result and add it to compiled_insns.
+                     Streaming compilations (see: iter_compile()) don't keep anything.
         """
+        with span("transform_insn", "transformer", insn=insn_name):
+            return self.transform_behaviors(insn_name, parsed_insns, keep)
+
+    def transform_behaviors(
+        self, insn_name: str, parsed_insns: ParsedInsn, keep: bool
+    ) -> RZILInstruction:
+        insn = self.ext.transform_insn_name(insn_name)
+        noped = insn in self.noped_insns
+        key = (get_behavior_key(parsed_insns.behaviors), noped)
+        if keep and key in self.transformed_behaviors:
+            self.dedup_hits += 1
+            transformed = self.transformed_behaviors[key]
+            if isinstance(transformed[0], type):
+                raise RepeatedTransformException(insn, *transformed)
+            rzil, meta, trees = transformed
+            self.compiled_insns[insn] = RZILInstruction(
+                insn, list(rzil), list(meta), list(trees)
+            )
+            return self.compiled_insns[insn]
+
         try:
-            insn = self.ext.transform_insn_name(insn_name)
             rzil = list()
             meta = list()
             trees = list()
-            pt: Tree
+            pt: Tree | CompactTree
             for pt, text in zip(parsed_insns.asts, parsed_insns.behaviors):
                 self.transformer.reset()
-                if insn in self.noped_insns:
+                if noped:
                     rzil.append("return NOP();")
                     meta.append(self.transformer.ext.get_noped_meta())
                 else:
                     rzil.append(self.transformer.transform(pt))
                     meta.append(self.transformer.ext.get_meta())
                 trees.append(pt.pretty())
-            self.compiled_insns[insn] = RZILInstruction(insn, rzil, meta, trees)
+            if not keep:
+                return RZILInstruction(insn, rzil, meta, trees)
+            self.transformed_behaviors[key] = (rzil, meta, trees)
+            self.compiled_insns[insn] = RZILInstruction(
+                insn, list(rzil), list(meta), list(trees)
+            )
             return self.compiled_insns[insn]
         except Exception as e:
+            if keep:
+                self.transformed_behaviors[key] = (type(e), str(e))
             raise e
         finally:
             self.transformer.reset()
@@ -364,6 +1071,324 @@ class Compiler:
         raise ValueError(f"Instruction {insn_name} not found.")
 
 
+def get_sub_routine_signature(
+    return_type: str, parameter: list[str]
+) -> tuple[ValueType, list[Parameter]]:
+    """Returns the return type and parameters of a sub-routine from their C declarations."""
+    params = list()
+    for param in parameter:
+        ptype, pname = split_var_decl(param)
+        params.append(Parameter(pname, get_value_type_by_c_type(ptype)))
+    return get_value_type_by_c_type(return_type), params
+
+
+def get_parser_exception_bucket(exception: ParserException) -> str:
+    """Returns the name of the statistics bucket for a parser exception."""
+    match exception.name:
+        case "UnexpectedToken":
+            # Parser got unexpected token
+            return "UnexpectedToken"
+        case "UnexpectedCharacters":
+            # Lexer can not match character to token.
+            return "UnexpectedCharacters"
+        case "UnexpectedEOF":
+            return "UnexpectedEOF"
+        case "Exception" | _:
+            return "Exception"
+
+
+def get_transform_exception_bucket(exception: Exception) -> str:
+    """Returns the name of the statistics bucket for a transformer exception."""
+    exc_type = type(exception)
+    if isinstance(exception, RepeatedTransformException):
+        exc_type = exception.exc_type
+    if issubclass(exc_type, VisitError):
+        # Something went wrong in the transformer
+        return "VisitError"
+    return "Exception"
+
+
+def print_leaderboards(results: dict[str, "CompiledInsnResult"], top: int) -> None:
+    """Prints the <top> slowest (parse + transform time) and largest (code size) instructions."""
+    timed = [r for r in results.values() if not r.cached]
+    slowest = sorted(
+        timed, key=lambda r: r.parse_time + r.transform_time, reverse=True
+    )[:top]
+    log(f"Slowest instructions (parse + transform time of {len(timed)} compiled):")
+    for r in slowest:
+        print(
+            f"\t{r.name:<30} {(r.parse_time + r.transform_time) * 1000:>9.2f} ms "
+            f"(parse {r.parse_time * 1000:.2f} ms, transform {r.transform_time * 1000:.2f} ms)"
+        )
+    cached = len(results) - len(timed)
+    if cached:
+        log(
+            f"{cached} instructions were read from the cache and are not timed. "
+            "Pass --no-cache to time all of them."
+        )
+    largest = sorted(results.values(), key=lambda r: r.get_code_size(), reverse=True)
+    log("Largest instructions (generated code):")
+    for r in largest[:top]:
+        print(f"\t{r.name:<30} {r.get_code_size():>9} bytes")
+
+
+def write_timings(
+    results: dict[str, "CompiledInsnResult"], path: Path, config: dict
+) -> None:
+    """
+    Writes the parse and transform time (seconds) and the code size (bytes)
+    of every instruction to a JSON file. The instructions are sorted by their total time.
+    """
+    insns = [
+        {
+            "name": r.name,
+            "parse_time": r.parse_time,
+            "transform_time": r.transform_time,
+            "code_size": r.get_code_size(),
+            "exception": r.exception,
+            "cached": r.cached,
+        }
+        for r in sorted(
+            results.values(),
+            key=lambda r: r.parse_time + r.transform_time,
+            reverse=True,
+        )
+    ]
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "config": config,
+                "parse_time": sum(i["parse_time"] for i in insns),
+                "transform_time": sum(i["transform_time"] for i in insns),
+                "code_size": sum(i["code_size"] for i in insns),
+                "instructions": insns,
+            },
+            f,
+            indent=1,
+        )
+
+
+def load_manifest(path: Path, config: str) -> dict[str, dict[str, str]]:
+    """
+    Returns the instruction entries of an incremental build manifest.
+    The entries are empty if there is no manifest or it was built with another config.
+    """
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        log("No manifest of a previous build found. Compile everything.")
+        return dict()
+    except (OSError, ValueError):
+        log(f"Broken manifest {path}. Compile everything.", LogLevel.WARNING)
+        return dict()
+    if manifest.get("config") != config:
+        log("Compiler or resources changed since the last build. Compile everything.")
+        return dict()
+    return manifest["instructions"]
+
+
+def save_manifest(path: Path, config: str, entries: dict[str, dict[str, str]]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump({"config": config, "instructions": entries}, f, indent=1)
+    os.replace(tmp, path)
+
+
+class CompiledInsnResult:
+    """
+    The result of a compile worker.
+    It only holds strings, so it is cheap to send back from the worker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        insn_name: str = "",
+        rzil: list[str] | None = None,
+        meta: list[list[str]] | None = None,
+        parse_trees: list[str] | None = None,
+        exception: str | None = None,
+        parse_time: float = 0.0,
+        transform_time: float = 0.0,
+    ):
+        self.name = name
+        # Name of the instruction after Compiler.ext.transform_insn_name()
+        self.insn_name = insn_name
+        self.rzil = rzil if rzil else list()
+        self.meta = meta if meta else list()
+        self.parse_trees = parse_trees if parse_trees else list()
+        # The statistics bucket of the exception (e.g. "VisitError"). None on success.
+        self.exception = exception
+        # Seconds spent parsing and transforming the instruction.
+        # 0 if the work was not done for this result (copies and cache hits).
+        self.parse_time = parse_time
+        self.transform_time = transform_time
+        # The result was read from a cache of compiled instructions.
+        self.cached = False
+        # Trace events of the compile worker, until they are added to the tracer.
+        self.trace_events: list[dict] | None = None
+        # cProfile statistics of the compile worker, until they are added to the stage profile.
+        self.task_stats: list[TaskStats] | None = None
+
+    def get_code_size(self) -> int:
+        """Returns the size of the generated code in bytes."""
+        return sum(len(code.encode("utf8")) for code in self.rzil)
+
+    def copy_for(self, name: str, insn_name: str) -> "CompiledInsnResult":
+        """Returns a copy of the compiled output for another instruction. The times are not copied."""
+        return CompiledInsnResult(
+            name,
+            insn_name,
+            list(self.rzil),
+            list(self.meta),
+            list(self.parse_trees),
+            self.exception,
+        )
+
+    def get_output_digest(self) -> str:
+        """Returns a digest over the compiled output. The names are not included."""
+        return get_digest(
+            json.dumps([self.rzil, self.meta, self.parse_trees, self.exception])
+        )
+
+    def to_rzil_instruction(self) -> RZILInstruction:
+        return RZILInstruction(self.insn_name, self.rzil, self.meta, self.parse_trees)
+
+
+# The compiler and parser of a compile worker process. See: init_compile_worker()
+worker_compiler: Compiler | None = None
+worker_parser: Parser | None = None
+# Memoize transformed behaviors in the worker. See: Compiler.transform_insn()
+worker_keep = True
+# The compiler which creates the compile pool. See: Compiler.get_compile_pool()
+inherited_compiler: Compiler | None = None
+
+
+def init_compile_worker(
+    arch: ArchEnum,
+    code_format: CodeFormat,
+    parser_mode: ParserMode,
+    keep: bool = True,
+    use_cache: bool = True,
+    rebuild_cache: bool = False,
+) -> None:
+    """
+    Initializer of the compile pool. Sets up the compiler once per worker.
+    Forked workers reuse the compiler of the parent process.
+    """
+    global worker_compiler, worker_parser, worker_keep
+    # Every worker would log the same setup steps.
+    Helper.LOG_LEVEL = LogLevel.WARNING
+    if inherited_compiler is not None:
+        worker_compiler = inherited_compiler
+    else:
+        worker_compiler = Compiler(
+            arch, code_format, parser_mode, use_cache, rebuild_cache
+        )
+    worker_parser = Parser(parser_mode, use_cache, compact=True)
+    worker_keep = keep
+
+
+def compile_insn_with(
+    compiler: Compiler, parser: Parser, name: str, behavior: list[str], keep: bool
+) -> CompiledInsnResult:
+    """
+    Parses and transforms a single instruction with the given compiler and parser.
+    The result is looked up in and added to the compiled output cache of the compiler.
+    """
+    result = compiler.get_cached_result(name, behavior)
+    if result:
+        return result
+    start = time.perf_counter()
+    parsed = parser.parse_insn(name, behavior)
+    parse_time = time.perf_counter() - start
+    if parsed.exception:
+        result = CompiledInsnResult(
+            name,
+            exception=get_parser_exception_bucket(parsed.exception),
+            parse_time=parse_time,
+        )
+    else:
+        start = time.perf_counter()
+        try:
+            insn = compiler.transform_insn(name, parsed, keep)
+            result = CompiledInsnResult(
+                name, insn.name, insn.rzil, insn.meta, insn.parse_trees
+            )
+        except Exception as e:
+            result = CompiledInsnResult(
+                name, exception=get_transform_exception_bucket(e)
+            )
+        result.parse_time = parse_time
+        result.transform_time = time.perf_counter() - start
+    compiler.put_cached_result(name, behavior, result)
+    return result
+
+
+def compile_single(bundle: InsnParsingBundle) -> CompiledInsnResult:
+    """Parses and transforms a single instruction in a compile worker."""
+    with collect_events() as events, profile_task() as task_stats:
+        with span("compile", "compiler", insn=bundle.name):
+            result = compile_insn_with(
+                worker_compiler,
+                worker_parser,
+                bundle.name,
+                bundle.behavior,
+                worker_keep,
+            )
+    # Set after the result was added to the compiled output cache.
+    result.trace_events = events
+    result.task_stats = task_stats
+    return result
+
+
+def get_compiler(
+    arch: ArchEnum,
+    parser_mode: ParserMode,
+    snapshot: Path | None = None,
+    use_cache: bool = True,
+    rebuild_cache: bool = False,
+) -> Compiler:
+    """
+    Returns the compiler for the CLI. If a snapshot is given, the compiler is set up from it.
+    A missing or outdated snapshot is (re)built.
+    """
+    settings = {
+        "parser_mode": parser_mode,
+        "use_cache": use_cache,
+        "rebuild_cache": rebuild_cache,
+    }
+    if snapshot:
+        try:
+            return Compiler.from_snapshot(snapshot, arch, **settings)
+        except FileNotFoundError:
+            log(f"No compiler snapshot {snapshot} found. Build it.")
+        except (OSError, ValueError) as e:
+            log(f"Rebuild compiler snapshot: {e}")
+    compiler = Compiler(arch, **settings)
+    if snapshot:
+        compiler.save_snapshot(snapshot)
+    return compiler
+
+
+def compile_stmt_with(compiler: Compiler, code: str) -> str | Exception:
+    """Returns the compiled statement or the exception raised while compiling it."""
+    try:
+        return compiler.compile_c_stmt(code)
+    except Exception as e:
+        return e
+
+
+def compile_stmt_single(code: str) -> str | WorkerException:
+    """Compiles a single statement in a compile worker."""
+    result = compile_stmt_with(worker_compiler, code)
+    if isinstance(result, Exception):
+        return WorkerException(type(result).__name__, str(result))
+    return result
+
+
 def parse_args() -> argparse.Namespace:
     argp = argparse.ArgumentParser(
         prog="RZIL Compiler",
@@ -388,15 +1413,195 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Skip file processing steps of the preprocessor.",
     )
-    return argp.parse_args()
+    argp.add_argument(
+        "-j",
+        dest="jobs",
+        type=int,
+        default=0,
+        help="Number of worker processes which parse and transform the instructions of -t. "
+        "Default: 0 (transform in the main process)",
+    )
+    argp.add_argument(
+        "--parser",
+        dest="parser_mode",
+        choices=[m.value for m in ParserMode],
+        default=ParserMode.EARLEY.value,
+        help="The parser used to parse the shortcode. Default: earley",
+    )
+    argp.add_argument(
+        "--parse-report",
+        dest="parse_report",
+        metavar="FILE",
+        type=Path,
+        help="Parse all instructions with instrumentation and write a report about "
+        "parse times and ambiguities (.csv or .json).",
+    )
+    argp.add_argument(
+        "--rule-profile",
+        dest="rule_profile",
+        metavar="N",
+        type=int,
+        nargs="?",
+        const=0,
+        help="Parse all instructions and print the <N> grammar rules the Earley parser "
+        "spends the most time in (items created, completions, cumulative time). Default: all rules",
+    )
+    argp.add_argument(
+        "--mem-profile",
+        dest="mem_profile",
+        metavar="N",
+        type=int,
+        nargs="?",
+        const=10,
+        help="Trace the memory of the preprocessor, the loading of the behaviors, the parser "
+        "and the transformer. Prints the peak and retained memory of each stage, its <N> top "
+        "allocation sites and the bytes retained per instruction. Default: 10",
+    )
+    argp.add_argument(
+        "--trace",
+        dest="trace",
+        metavar="FILE",
+        type=Path,
+        help="Record spans of the preprocessor, parser (also in the worker processes) "
+        "and transformer and write them to FILE in the Chrome trace event format "
+        "(chrome://tracing or Perfetto).",
+    )
+    argp.add_argument(
+        "--profile",
+        dest="profile_dir",
+        metavar="DIR",
+        type=Path,
+        help="Run each stage under cProfile (including the parse and compile workers) "
+        "and write a <stage>.pstats and <stage>.collapsed (flamegraph stacks) per stage to DIR.",
+    )
+    argp.add_argument(
+        "--incremental",
+        dest="incremental",
+        action="store_true",
+        help="With -t: Only compile instructions whose behavior changed since the last "
+        "incremental build and reuse the output of all others.",
+    )
+    argp.add_argument(
+        "--manifest",
+        dest="manifest",
+        metavar="FILE",
+        type=Path,
+        help="The manifest of the incremental build. Default: A file in the cache directory.",
+    )
+    argp.add_argument(
+        "--conformance",
+        dest="conformance",
+        action="store_true",
+        help="Parse all instructions with the Earley and the LALR parser and report differences of the parse trees.",
+    )
+    argp.add_argument(
+        "--fast-path-parity",
+        dest="fast_path_parity",
+        action="store_true",
+        help="Parse all behaviors the fast path for trivial behaviors recognizes "
+        "also with Lark and report differences of the parse trees and the hit rate.",
+    )
+    argp.add_argument(
+        "--snapshot",
+        dest="snapshot",
+        metavar="FILE",
+        type=Path,
+        help="Set up the compiler from the snapshot FILE instead of the resources. "
+        "It is (re)built if it is missing or outdated.",
+    )
+    argp.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        action="store_true",
+        help="Don't read or write the caches of parse trees and compiled instructions.",
+    )
+    argp.add_argument(
+        "--rebuild-cache",
+        dest="rebuild_cache",
+        action="store_true",
+        help="Compile all instructions again and replace their entries in the cache "
+        "of compiled instructions.",
+    )
+    argp.add_argument(
+        "--top",
+        dest="top",
+        metavar="N",
+        type=int,
+        default=10,
+        help="With -t: Print the N slowest and largest instructions. Default: 10",
+    )
+    argp.add_argument(
+        "--timings",
+        dest="timings",
+        metavar="FILE",
+        type=Path,
+        help="With -t: Write the parse and transform time and the code size "
+        "of every instruction to FILE (JSON).",
+    )
+    argp.add_argument(
+        "--watch",
+        dest="watch",
+        metavar="SECONDS",
+        type=float,
+        nargs="?",
+        const=1.0,
+        help="Compile all instructions, then poll the resource files every SECONDS (default: 1) "
+        "and recompile only what a change affects. Prints the pass/fail delta of each run.",
+    )
+    args = argp.parse_args()
+    if args.incremental and args.no_cache:
+        argp.error("--incremental keeps the outputs in the cache. Drop --no-cache.")
+    return args
 
 
 if __name__ == "__main__":
     args = parse_args()
-    c = Compiler(ArchEnum[args.arch.upper()])
-    if not args.skip_pp:
-        c.run_preprocessor()
-    c.preprocessor.load_insn_behavior()
+    with tracing(args.trace), profiling(args.profile_dir):
+        mem_profile = (
+            MemoryProfile(args.mem_profile) if args.mem_profile is not None else None
+        )
+        with (
+            profile_memory(mem_profile, "setup"),
+            span("setup"),
+            profile_stage("setup"),
+        ):
+            c = get_compiler(
+                ArchEnum[args.arch.upper()],
+                ParserMode(args.parser_mode),
+                args.snapshot,
+                not args.no_cache,
+                args.rebuild_cache,
+            )
+        if not args.skip_pp:
+            with (
+                profile_memory(mem_profile, "run_preprocessor"),
+                profile_stage("run_preprocessor"),
+            ):
+                c.run_preprocessor()
+        with (
+            profile_memory(mem_profile, "load_insn_behavior"),
+            profile_stage("load_insn_behavior"),
+        ):
+            c.preprocessor.load_insn_behavior()
+        if mem_profile is not None:
+            c.profile_memory(mem_profile)
+            print(mem_profile.format_report())
 
-    if args.test_all:
-        c.test_compile_all()
+        if args.parse_report or args.rule_profile is not None:
+            c.parse_shortcode(args.parse_report, args.rule_profile is not None)
+        if args.rule_profile is not None:
+            print(c.rule_profile.format_table(args.rule_profile))
+        if args.conformance:
+            with profile_stage("check_parser_conformance"):
+                c.check_parser_conformance()
+        if args.fast_path_parity:
+            with profile_stage("check_fast_path_parity"):
+                c.check_fast_path_parity()
+        if args.test_all:
+            with profile_stage("test_compile_all"):
+                c.test_compile_all(
+                    args.jobs, args.incremental, args.manifest, args.top, args.timings
+                )
+        if args.watch is not None:
+            with profile_stage("watch"):
+                watch(c, args.watch, args.jobs)
@@ -16,6 +16,7 @@ class InputFile(StrEnum):
     """
 
     GRAMMAR = "<REPO>/Resources/<ARCH>/grammar.lark"
+    GRAMMAR_LALR = "<REPO>/Resources/<ARCH>/grammar_lalr.lark"
     HEXAGON_PP_COMBINED_H = "<REPO>/Resources/Hexagon/Preprocessor/combined.h"
     HEXAGON_PP_MACROS_H = "<REPO>/Resources/Hexagon/Preprocessor/macros.h"
     HEXAGON_PP_MACROS_MMVEC_H = "<REPO>/Resources/Hexagon/Preprocessor/macros_mmvec.h"
@@ -36,6 +37,7 @@ class InputFile(StrEnum):
     HEXAGON_SUB_ROUTINES_JSON = "<REPO>/Resources/Hexagon/sub_routines.json"
     HEXAGON_QEMU_RZIL_MACROS_JSON = "<REPO>/Resources/Hexagon/qemu_rzil_macros.json"
     HEXAGON_NOPED_INSNS_JSON = "<REPO>/Resources/Hexagon/noped_insns.json"
+    CACHE_DIR = "<REPO>/.cache"
 
 
 def is_submodule() -> bool:
@@ -53,21 +55,35 @@ class Conf:
     Holds all the configurable values like paths.
     """
 
+    # Repository root per working directory. See: get_repo_root()
+    repo_roots: dict[Path, Path] = dict()
+
+    @staticmethod
+    def get_repo_root() -> Path:
+        """
+        Returns the root of the repository.
+        It is resolved with git once per working directory.
+        """
+        cwd = Path.cwd()
+        if cwd in Conf.repo_roots:
+            return Conf.repo_roots[cwd]
+        root = subprocess.run(
+            ["git", "rev-parse", "--show-toplevel"],
+            check=True,
+            stdout=subprocess.PIPE,
+        )
+        root_dir = Path(root.stdout.decode("utf8").strip("\n"))
+        if is_submodule():
+            root_dir = root_dir.joinpath("rzil_compiler")
+        if not root_dir.exists():
+            raise NotADirectoryError(str(root_dir))
+        Conf.repo_roots[cwd] = root_dir
+        return root_dir
+
     @staticmethod
     def replace_placeholders(path_str: str, arch: str = "") -> str:
         if "<REPO>" in path_str:
-            root = subprocess.run(
-                ["git", "rev-parse", "--show-toplevel"],
-                check=True,
-                stdout=subprocess.PIPE,
-            )
-            root_dir = Path(root.stdout.decode("utf8").strip("\n"))
-            if is_submodule():
-                root_dir = root_dir.joinpath("rzil_compiler")
-            if not root_dir.exists():
-                raise NotADirectoryError(str(root_dir))
-
-            path_str = path_str.replace("<REPO>", str(root_dir))
+            path_str = path_str.replace("<REPO>", str(Conf.get_repo_root()))
         if "<ARCH>" in path_str:
             if not arch:
                 raise ValueError("No architecture name passed.")
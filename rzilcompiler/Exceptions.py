@@ -6,3 +6,32 @@ class OverloadException(BaseException):
     def __init__(self, message):
         message = "\nPlease overload this method.\n" + message
         super().__init__(message)
+
+
+class WorkerException(Exception):
+    """
+    Stand-in for an exception raised in a worker process.
+    Lark's exceptions can't be pickled, so only their name and message are sent back.
+    """
+
+    def __init__(self, name: str, message: str):
+        super().__init__(name, message)
+        self.name = name
+        self.message = message
+
+    def __str__(self):
+        return f"{self.name}: {self.message}"
+
+
+class RepeatedTransformException(Exception):
+    """
+    Raised for an instruction whose behavior failed to transform before
+    for another instruction. See: Compiler.transform_insn()
+    Only the type and message of the original exception are kept.
+    """
+
+    def __init__(self, insn_name: str, exc_type: type, message: str):
+        super().__init__(f"{insn_name}: {exc_type.__name__}: {message}")
+        self.insn_name = insn_name
+        self.exc_type = exc_type
+        self.message = message
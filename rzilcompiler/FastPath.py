@@ -0,0 +1,238 @@
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import re
+
+from lark import Token, Tree
+
+# Maps the register part of a register token to the token type
+# the Earley grammar assigns to it.
+REG_PART_TYPES = {
+    "s": "SRC_REG",
+    "t": "SRC_REG",
+    "u": "SRC_REG",
+    "v": "SRC_REG",
+    "w": "SRC_REG",
+    "d": "DEST_REG",
+    "e": "DEST_REG",
+    "x": "SRC_DEST_REG",
+    "y": "SRC_DEST_REG",
+    "z": "SRC_DEST_REG",
+    "ss": "SRC_REG_PAIR",
+    "tt": "SRC_REG_PAIR",
+    "uu": "SRC_REG_PAIR",
+    "vv": "SRC_REG_PAIR",
+    "dd": "DEST_REG_PAIR",
+    "xx": "SRC_DEST_REG_PAIR",
+    "yy": "SRC_DEST_REG_PAIR",
+}
+
+# Binary operators from the lowest to the highest precedence:
+# (rule name, {operator: token type})
+BINARY_LEVELS = [
+    ("logical_or_expr", {"||": "OR_OP"}),
+    ("logical_and_expr", {"&&": "AND_OP"}),
+    ("inclusive_or_expr", {"|": "BIT_OR_OP"}),
+    ("exclusive_or_expr", {"^": "BIT_XOR_OP"}),
+    ("and_expr", {"&": "BIT_AND_OP"}),
+    ("equality_expr", {"==": "EQ_OP", "!=": "NE_OP"}),
+    ("relational_expr", {"<": "LT_OP", ">": "GT_OP", "<=": "LE_OP", ">=": "GE_OP"}),
+    ("shift_expr", {"<<": "LEFT_OP", ">>": "RIGHT_OP"}),
+    ("additive_expr", {"+": "ADD_OP", "-": "SUB_OP"}),
+    ("multiplicative_expr", {"*": "MUL_OP", "/": "DIV_OP", "%": "MOD_OP"}),
+]
+ASSIGN_OPS = {"=", "*=", "/=", "%=", "+=", "-=", "<<=", ">>=", "&=", "^=", "|="}
+UNARY_OPS = {"-", "+", "~", "!"}
+# Operators the fast path doesn't handle. They are tokenized as a whole,
+# so "--" is never read as two unary minus.
+UNSUPPORTED_OPS = {"++", "--", "->"}
+
+# Identifiers which are (or start like) keywords, types, macros or special tokens
+# of the grammar. Behaviors with them are left to Lark.
+RESERVED_IDENTIFIER = re.compile(
+    r"(auto|break|case|char|const|continue|default|do|double|else|enum|extern|float|for|goto"
+    r"|if|inline|int|long|register|restrict|return|short|signed|sizeof|static|struct|switch"
+    r"|typedef|union|unsigned|void|volatile|while|uint|size|mem_|JUMP|WRITE_PRED|HEX_|FLOAT"
+    r"|DOUBLE|fUN|REGFIELD|extract|sextract|deposit|bswap|get_corresponding_CS"
+    r"|cancel_slot|_|[RCPVQMGS][0-3]"
+    r"|[CNPRMQVO](ss|tt|uu|vv|dd|xx|yy|[stuvwdexyz])[VN]|[rRsSuUmn]iV)"
+)
+
+TOKEN_PATTERN = re.compile(
+    r"\s*(?:"
+    r"(?P<reg>(?P<reg_type>[CNPRMQVO])(?P<reg_part>ss|tt|uu|vv|dd|xx|yy|[stuvwdexyz])(?P<reg_kind>[VN]))"
+    r"|(?P<explicit_reg>[RCPVQMGS][0-3]{1,2}(?::[0-3]{1,2})?)"
+    r"|(?P<imm>[rRsSuUmn])iV"
+    r"|(?P<number>(?P<hex>0[xX][\da-fA-F]+)|(?P<dec>0|[1-9]\d*))(?P<post>ULL|LL|ull|ll|U|u)?"
+    r"|(?P<identifier>[A-Za-z_]\w*)"
+    r")(?![\w.])"
+    r"|\s*(?P<op>\+\+|--|->|<<=|>>=|<<|>>|<=|>=|==|!=|&&|\|\||[*/%+\-&^|]=|[-+*/%&|^~!?:=;(){}<>])"
+)
+
+
+class NoFastPath(Exception):
+    """The behavior has a shape the fast path doesn't handle."""
+
+
+def tokenize(behavior: str) -> list[tuple[str, re.Match]]:
+    """Splits the behavior into (kind, match) tuples. The kind of operators is the operator."""
+    tokens = list()
+    pos = 0
+    end = len(behavior.rstrip())
+    while pos < end:
+        m = TOKEN_PATTERN.match(behavior, pos)
+        if not m:
+            raise NoFastPath()
+        kind = m.lastgroup
+        if kind == "op":
+            kind = m.group("op")
+            if kind in UNSUPPORTED_OPS:
+                raise NoFastPath()
+        elif m.group("reg"):
+            kind = "reg"
+        elif m.group("number"):
+            kind = "number"
+        elif m.group("identifier"):
+            kind = "identifier"
+            if RESERVED_IDENTIFIER.match(m.group(kind)):
+                raise NoFastPath()
+        tokens.append((kind, m))
+        pos = m.end()
+    return tokens
+
+
+class FastPathParser:
+    """
+    Recursive descent parser for a fixed set of trivial behavior shapes:
+    A block of assignments (or empty statements), whose expressions consist of
+    registers, immediates, numbers, identifiers, parentheses,
+    unary, binary and conditional operators.
+    It builds the same trees as the LALR parser. The Earley parser resolves some
+    ambiguous expressions differently (e.g. "RdV = RsV==1&~RtV;").
+    See: Parser.check_fast_path()
+    """
+
+    def __init__(self, behavior: str):
+        self.tokens = tokenize(behavior)
+        self.pos = 0
+
+    def peek(self) -> str | None:
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def next(self) -> tuple[str, re.Match]:
+        if self.pos >= len(self.tokens):
+            raise NoFastPath()
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+    def expect(self, kind: str) -> None:
+        if self.next()[0] != kind:
+            raise NoFastPath()
+
+    def parse(self) -> Tree:
+        self.expect("{")
+        items = list()
+        while self.peek() != "}":
+            items.append(Tree("block_item", [self.stmt()]))
+        self.expect("}")
+        if self.peek() is not None:
+            raise NoFastPath()
+
+        if not items:
+            return Tree("fbody", [Tree("compound_stmt", [])])
+        body = items[0]
+        for item in items[1:]:
+            body = Tree("block_item_list", [body, item])
+        return Tree("fbody", [body])
+
+    def stmt(self) -> Tree:
+        if self.peek() == ";":
+            self.next()
+            return Tree("expr_stmt", [])
+        lhs = self.primary(allow_parentheses=False)
+        op = self.next()[0]
+        if op not in ASSIGN_OPS:
+            raise NoFastPath()
+        rhs = self.conditional()
+        self.expect(";")
+        return Tree("assignment_expr", [lhs, Token("ASSIGN_OP", op), rhs])
+
+    def conditional(self) -> Tree:
+        cond = self.binary(0)
+        if self.peek() != "?":
+            return cond
+        self.next()
+        then = self.conditional()
+        self.expect(":")
+        return Tree("conditional_expr", [cond, then, self.conditional()])
+
+    def binary(self, level: int) -> Tree:
+        if level == len(BINARY_LEVELS):
+            return self.unary()
+        rule, ops = BINARY_LEVELS[level]
+        left = self.binary(level + 1)
+        while self.peek() in ops:
+            op = self.next()[0]
+            right = self.binary(level + 1)
+            left = Tree(rule, [left, Token(ops[op], op), right])
+        return left
+
+    def unary(self) -> Tree:
+        if self.peek() in UNARY_OPS:
+            op = self.next()[0]
+            return Tree("unary_expr", [Token("UNARY_OP", op), self.unary()])
+        return self.primary()
+
+    def primary(self, allow_parentheses: bool = True) -> Tree:
+        kind, m = self.next()
+        match kind:
+            case "reg":
+                reg_part = m.group("reg_part")
+                rule = "reg" if m.group("reg_kind") == "V" else "new_reg"
+                return Tree(
+                    rule,
+                    [
+                        Token("REG_TYPE", m.group("reg_type")),
+                        Token(REG_PART_TYPES[reg_part], reg_part),
+                    ],
+                )
+            case "explicit_reg":
+                return Tree(
+                    "explicit_reg", [Token("EXPLICIT_REG", m.group(kind)), None]
+                )
+            case "imm":
+                return Tree("imm", [Token("IMMEDIATE", m.group(kind))])
+            case "number":
+                if m.group("hex"):
+                    number = Token("HEX_NUMBER", m.group("hex"))
+                else:
+                    number = Token("DEC_NUMBER", m.group("dec"))
+                post = m.group("post")
+                return Tree(
+                    "number",
+                    [
+                        number,
+                        Token("INT_POST_TYPE", post) if post else None,
+                    ],
+                )
+            case "identifier":
+                if self.peek() == "(":
+                    # Function call
+                    raise NoFastPath()
+                return Tree("identifier", [Token("IDENTIFIER", m.group(kind))])
+            case "(" if allow_parentheses:
+                expr = self.conditional()
+                self.expect(")")
+                return expr
+        raise NoFastPath()
+
+
+def parse_fast(behavior: str) -> Tree | None:
+    """
+    Returns the parse tree of a trivial behavior. Or None, if the behavior
+    has a shape which must be parsed by Lark.
+    """
+    try:
+        return FastPathParser(behavior).parse()
+    except (NoFastPath, RecursionError):
+        return None
@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import sys
+import tracemalloc
+import types
+
+from contextlib import contextmanager
+
+# Objects shared by all instances. They are not retained by a single one.
+SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+
+
+def get_deep_size(obj: object) -> int:
+    """
+    Returns the size in bytes of the object and all objects reachable from it
+    (containers, attributes and slots). Each object is counted once.
+    Classes, modules and functions are not counted.
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, SHARED_TYPES):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        if hasattr(o, "__dict__"):
+            stack.append(o.__dict__)
+        for cls in type(o).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                if hasattr(o, slot):
+                    stack.append(getattr(o, slot))
+    return size
+
+
+def format_size(size: int) -> str:
+    for unit in ["B", "KiB", "MiB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+class StageMemory:
+    """The memory a pipeline stage allocated."""
+
+    def __init__(
+        self,
+        name: str,
+        retained: int,
+        peak: int,
+        sites: list[tracemalloc.StatisticDiff],
+    ):
+        self.name = name
+        # Bytes still allocated after the stage.
+        self.retained = retained
+        # Maximum of the bytes allocated during the stage.
+        self.peak = peak
+        # The source lines which allocated the most retained memory.
+        self.sites = sites
+
+
+class MemoryProfile:
+    """
+    Peak and retained memory of pipeline stages, measured with tracemalloc.
+    Only allocations of this process are traced, not the ones of worker processes.
+    See: profile_memory()
+    """
+
+    def __init__(self, top: int = 10):
+        """
+        :param top: Number of allocation sites recorded per stage.
+        """
+        self.top = top
+        self.stages: list[StageMemory] = list()
+        # Retained bytes per instruction. E.g. {"parsed_insns": {"A2_add": 4096}}
+        self.insn_sizes: dict[str, dict[str, int]] = dict()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Context in which all allocations are attributed to the stage <name>."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        before = self.take_snapshot()
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            sites = [
+                s
+                for s in self.take_snapshot().compare_to(before, "lineno")
+                if s.size_diff > 0
+            ]
+            sites.sort(key=lambda s: s.size_diff, reverse=True)
+            self.stages.append(
+                StageMemory(name, current - start, peak - start, sites[: self.top])
+            )
+
+    @staticmethod
+    def take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+
+    def add_insn_sizes(self, kind: str, insns: dict[str, object]) -> None:
+        """
+        Records the bytes retained by each instruction of <insns>.
+        :param kind: The name the sizes are reported under (e.g. "parsed_insns").
+        """
+        self.insn_sizes[kind] = {n: get_deep_size(o) for n, o in insns.items()}
+
+    def format_report(self) -> str:
+        width = max([len("Stage")] + [len(s.name) for s in self.stages])
+        lines = [f"{'Stage':<{width}} {'Retained':>12} {'Peak':>12}"]
+        for s in self.stages:
+            lines.append(
+                f"{s.name:<{width}} {format_size(s.retained):>12} {format_size(s.peak):>12}"
+            )
+        for s in self.stages:
+            if not s.sites:
+                continue
+            lines.append(f"Top allocation sites of {s.name} (retained):")
+            for site in s.sites:
+                frame = site.traceback[0]
+                lines.append(
+                    f"\t{format_size(site.size_diff):>12} {site.count_diff:>8} blocks  "
+                    f"{frame.filename}:{frame.lineno}"
+                )
+        for kind, sizes in self.insn_sizes.items():
+            if not sizes:
+                continue
+            total = sum(sizes.values())
+            largest = max(sizes, key=sizes.get)
+            lines.append(
+                f"{kind}: {len(sizes)} instructions retain {format_size(total)}, "
+                f"mean {format_size(total // len(sizes))}, "
+                f"max {format_size(sizes[largest])} ({largest})"
+            )
+        return "\n".join(lines)
+
+
+@contextmanager
+def profile_memory(profile: MemoryProfile | None, stage: str):
+    """
+    Context whose allocations are recorded as <stage> in the profile.
+    If profile is None, nothing is done.
+    """
+    if profile is None:
+        yield
+        return
+    with profile.stage(stage):
+        yield
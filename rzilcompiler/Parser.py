@@ -1,19 +1,133 @@
 # SPDX-FileCopyrightText: 2022 Rot127 <rot127@posteo.com>
 # SPDX-License-Identifier: LGPL-3.0-only
 
+import csv
+import functools
+import inspect
+import io
+import json
+import pickle
+import re
+import sys
+import time
+
+from enum import StrEnum
 from multiprocessing import Pool
+from pathlib import Path
 
-from lark import Lark, Tree
+import lark
+from lark import Lark, Token, Transformer, Tree
 from tqdm import tqdm
 
+from rzilcompiler.Cache import FileCache, get_cache_dir, get_digest
+from rzilcompiler.CompactTree import CompactTree
 from rzilcompiler.Configuration import Conf, InputFile
+from rzilcompiler.FastPath import REG_PART_TYPES, parse_fast
+from rzilcompiler.Helper import log, LogLevel
+from rzilcompiler.RuleProfile import RuleProfile, profile_rules
+from rzilcompiler.StageProfile import TaskStats, add_task_stats, profile_task
+from rzilcompiler.Trace import add_events, collect_events, span
+
+
+class ParserMode(StrEnum):
+    """
+    The Lark parser used to parse the shortcode.
+    EARLEY uses the reference grammar. LALR uses the LALR(1) compatible variant of it
+    with a contextual lexer. It is magnitudes faster, but see check_conformance().
+    """
+
+    EARLEY = "earley"
+    LALR = "lalr"
+
+
+class LALRTreeNormalizer(Transformer):
+    """
+    The LALR grammar lexes registers, immediates and C types as single tokens
+    (the lexer can't resolve them otherwise).
+    This transformer splits them up again, so the resulting trees are the same
+    as the ones of the Earley parser.
+    It is applied while parsing (passed as transformer to Lark).
+    """
+
+    def __default__(self, data, children, meta):
+        return Tree(data, children, meta)
+
+    @staticmethod
+    def split_reg(data: str, children: list) -> Tree:
+        value = children[0].value
+        reg_part = value[1:-1]
+        return Tree(
+            data,
+            [Token("REG_TYPE", value[0]), Token(REG_PART_TYPES[reg_part], reg_part)],
+        )
+
+    def reg(self, children):
+        return self.split_reg("reg", children)
+
+    def new_reg(self, children):
+        return self.split_reg("new_reg", children)
+
+    def imm(self, children):
+        return Tree("imm", [Token("IMMEDIATE", children[0].value[0])])
+
+    def reg_alias(self, children):
+        name = children[0].value[len("HEX_REG_ALIAS_") :]
+        postfix = None
+        if name.endswith("_NEW"):
+            name = name[: -len("_NEW")]
+            postfix = Tree("reg_alias_new_postfix", [])
+        return Tree("reg_alias", [Token("REG_ALIAS_NAME", name), postfix])
+
+    def c_int_type(self, children):
+        value = children[0].value
+        if value[0] == "u":
+            sign, width = "uint", value[4:-2]
+        else:
+            sign, width = "int", value[3:-2]
+        return Tree(
+            "c_int_type", [Token("SIGN_TYPE_INT", sign), Token("BIT_WIDTH", width)]
+        )
+
+    def c_size_type(self, children):
+        value = children[0].value
+        return Tree(
+            "c_size_type",
+            [Token("BIT_WIDTH", value[4:-3]), Token("SIGN_TYPE", value[-3])],
+        )
 
 
 class InsnParsingBundle:
-    def __init__(self, grammar: str, name: str, behavior: list[str]):
-        self.grammar = grammar
+    """
+    A single parsing task. It only holds the instruction name and its behaviors.
+    The parser is built once per worker process (see: init_worker()).
+    If a tree cache is given, the parse results are written to it with the cache keys
+    of the behaviors.
+    If compact is set, the parse trees are returned as CompactTree.
+    If instrument is set, the parse statistics are recorded (see: ParseStats).
+    If profile is set, the work of the Earley parser is recorded per grammar rule
+    (see: RuleProfile).
+    If fast_path is set, trivial behaviors are parsed by the fast path (see: parse_fast()).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        behavior: list[str],
+        tree_cache: FileCache | None = None,
+        cache_keys: list[str] | None = None,
+        compact: bool = False,
+        instrument: bool = False,
+        profile: bool = False,
+        fast_path: bool = False,
+    ):
         self.name = name
         self.behavior = behavior
+        self.tree_cache = tree_cache
+        self.cache_keys = cache_keys
+        self.compact = compact
+        self.instrument = instrument
+        self.profile = profile
+        self.fast_path = fast_path
 
 
 class ParserException:
@@ -27,52 +141,831 @@ class ParserException:
         self.name = str(type(exception).__name__)
 
 
+class ParseStats:
+    """
+    Instrumentation data about parsing an instruction (summed over all its behaviors).
+    See: Parser(instrument=True)
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # Wall time of the parser in seconds.
+        self.parse_time = 0.0
+        self.length = 0
+        # Tokens of one derivation (including anonymous tokens like braces).
+        self.tokens = 0
+        # Number of _ambig nodes in the tree of the Earley parser with explicit ambiguity.
+        self.ambiguities = 0
+        # Rules at which the derivations of the ambiguities diverge
+        # (e.g. "identifier|op") -> number of occurrences.
+        self.ambiguous_rules: dict[str, int] = dict()
+
+    def to_dict(self, ambiguity_prefix: str = "") -> dict:
+        """
+        :param ambiguity_prefix: Prefix of the ambiguity keys.
+                                 See: write_parse_report()
+        """
+        return {
+            "name": self.name,
+            "parse_time": self.parse_time,
+            "length": self.length,
+            "tokens": self.tokens,
+            ambiguity_prefix + "ambiguities": self.ambiguities,
+            ambiguity_prefix + "ambiguous_rules": self.ambiguous_rules,
+        }
+
+
 class ParsedInsn:
     def __init__(
         self,
         name: str,
-        asts: list[Tree],
+        asts: list[Tree | CompactTree],
         behaviors: list[str],
         exception: ParserException | None = None,
+        stats: ParseStats | None = None,
+        profile: RuleProfile | None = None,
+        fast_path_hits: int = 0,
+        parse_time: float = 0.0,
     ):
         self.name = name
         self.asts: list = asts
         self.behaviors: list = behaviors
         self.exception = exception
+        self.stats = stats
+        self.profile = profile
+        # Number of behaviors parsed by the fast path.
+        self.fast_path_hits = fast_path_hits
+        # Seconds spent parsing all behaviors. 0 for parse trees from the tree cache.
+        self.parse_time = parse_time
+        # Trace events of the parse task, until they are added to the tracer.
+        # See: Parser.add_stats()
+        self.trace_events: list[dict] | None = None
+        # cProfile statistics of the parse task, until they are added to the stage profile.
+        self.task_stats: list[TaskStats] | None = None
+
+
+def get_grammar(mode: ParserMode = ParserMode.EARLEY) -> str:
+    grammar = InputFile.GRAMMAR if mode == ParserMode.EARLEY else InputFile.GRAMMAR_LALR
+    with open(Conf.get_path(grammar, "Hexagon")) as f:
+        return "".join(f.readlines())
+
+
+def get_parser_options(mode: ParserMode) -> dict:
+    if mode == ParserMode.EARLEY:
+        return {"start": "fbody", "parser": "earley"}
+    return {"start": "fbody", "parser": "lalr", "lexer": "contextual"}
+
+
+def get_parser_cache_file(grammar: str, mode: ParserMode) -> Path:
+    """
+    Returns the path to the cached parser tables of the grammar.
+    The file name is keyed by the grammar, the Lark version and the parser options.
+    So a changed grammar or Lark update never loads outdated tables.
+    """
+    options = get_parser_options(mode)
+    digest = get_digest(
+        grammar,
+        lark.__version__,
+        sys.version,
+        ";".join(f"{k}={v}" for k, v in sorted(options.items())),
+    )
+    return get_cache_dir("parser").joinpath(f"{mode}_{digest}.lark")
 
 
-def parse_single(bundle: InsnParsingBundle) -> dict[str:ParsedInsn]:
+# Parsers are built only once per process. See: get_lark_parser()
+lark_parsers: dict[ParserMode, Lark] = dict()
+
+
+def get_lark_parser(mode: ParserMode = ParserMode.EARLEY) -> Lark:
+    """
+    Returns the Lark parser for the shortcode with the given mode.
+    The parser is built once per process. The tables of the LALR parser are
+    additionally cached on disk (Lark can't serialize Earley parsers).
+    """
+    if mode in lark_parsers:
+        return lark_parsers[mode]
+    grammar = get_grammar(mode)
+    options = get_parser_options(mode)
+    if mode == ParserMode.LALR:
+        options["transformer"] = LALRTreeNormalizer()
+        try:
+            options["cache"] = str(get_parser_cache_file(grammar, mode))
+        except OSError as e:
+            log(f"Parser cache not available: {e}", LogLevel.WARNING)
+    lark_parsers[mode] = Lark(grammar, **options)
+    return lark_parsers[mode]
+
+
+def save_lark_parser(mode: ParserMode) -> bytes | None:
+    """
+    Returns the serialized Lark parser of the mode (see: load_lark_parser()).
+    None for the Earley parser. Lark can only serialize LALR parsers.
+    """
+    if mode != ParserMode.LALR:
+        return None
+    f = io.BytesIO()
+    get_lark_parser(mode).save(f, exclude_options={"transformer"})
+    return f.getvalue()
+
+
+def load_lark_parser(mode: ParserMode, data: bytes) -> Lark:
+    """Sets the parser of the mode to the one serialized by save_lark_parser()."""
+    d = pickle.loads(data)
+    lark_parsers[mode] = Lark._load_from_dict(
+        d["data"], d["memo"], transformer=LALRTreeNormalizer()
+    )
+    return lark_parsers[mode]
+
+
+# Parser for the instrumentation. See: get_ambiguity_parser()
+ambiguity_parser: Lark | None = None
+
+
+def get_ambiguity_parser() -> Lark:
+    """
+    Returns an Earley parser which keeps all ambiguities (as _ambig nodes)
+    and all tokens in the tree. Only used for the parse instrumentation.
+    """
+    global ambiguity_parser
+    if not ambiguity_parser:
+        ambiguity_parser = Lark(
+            get_grammar(ParserMode.EARLEY),
+            start="fbody",
+            parser="earley",
+            ambiguity="explicit",
+            keep_all_tokens=True,
+        )
+    return ambiguity_parser
+
+
+def get_divergence(a, b) -> set[str]:
+    """
+    Returns the rule names (or token types) of the first nodes
+    in which both derivations differ.
+    """
+    while (
+        isinstance(a, Tree)
+        and isinstance(b, Tree)
+        and a.data == b.data
+        and len(a.children) == len(b.children)
+    ):
+        diff = [(x, y) for x, y in zip(a.children, b.children) if x != y]
+        if not diff:
+            return {str(a.data)}
+        a, b = diff[0]
+    return {
+        (
+            str(n.data)
+            if isinstance(n, Tree)
+            else n.type if isinstance(n, Token) else "None"
+        )
+        for n in [a, b]
+    }
+
+
+def count_ambiguities(tree: Tree, stats: ParseStats) -> None:
+    """
+    Adds the number of ambiguities, the involved rules and the number of tokens
+    of a tree with explicit ambiguities to the stats.
+    Tokens are only counted for the first alternative of each ambiguity.
+    """
+    stack = [(tree, True)]
+    while stack:
+        node, count_tokens = stack.pop()
+        if isinstance(node, Token):
+            stats.tokens += 1 if count_tokens else 0
+            continue
+        if not isinstance(node, Tree):
+            continue
+        if node.data != "_ambig":
+            stack.extend((c, count_tokens) for c in node.children)
+            continue
+        stats.ambiguities += 1
+        rules = set()
+        for alt in node.children[1:]:
+            rules.add("|".join(sorted(get_divergence(node.children[0], alt))))
+        for rule in rules:
+            stats.ambiguous_rules[rule] = stats.ambiguous_rules.get(rule, 0) + 1
+        for i, alt in enumerate(node.children):
+            stack.append((alt, count_tokens and i == 0))
+
+
+def instrument_behavior(
+    parser: Lark, behavior: str, stats: ParseStats, profile: RuleProfile | None = None
+) -> Tree | None:
+    """
+    Parses the behavior, records the statistics about it and returns the tree.
+    Only the actual parse is added to the rule profile (if given).
+    """
+    stats.length += len(behavior)
+    start = time.perf_counter()
+    try:
+        with profile_rules(profile):
+            return parser.parse(behavior)
+    finally:
+        stats.parse_time += time.perf_counter() - start
+        try:
+            count_ambiguities(get_ambiguity_parser().parse(behavior), stats)
+        except Exception:
+            # Failing behaviors have no tree.
+            pass
+
+
+def write_parse_report(
+    parsed_insns: dict[str, ParsedInsn],
+    path: Path,
+    mode: ParserMode = ParserMode.EARLEY,
+) -> None:
+    """
+    Writes the parse statistics of the instructions to path,
+    sorted by parse time (slowest first).
+    The format (CSV or JSON) is chosen by the file extension.
+    The ambiguities are always the ones of the Earley grammar.
+    The LALR parser resolves them deterministically. So for the LALR parser (mode)
+    the ambiguity fields are labeled with an "earley_" prefix.
+    """
+    stats = sorted(
+        [p.stats for p in parsed_insns.values() if p.stats],
+        key=lambda s: s.parse_time,
+        reverse=True,
+    )
+    rules: dict[str, int] = dict()
+    for s in stats:
+        for rule, count in s.ambiguous_rules.items():
+            rules[rule] = rules.get(rule, 0) + count
+    rules = dict(sorted(rules.items(), key=lambda r: r[1], reverse=True))
+    prefix = "earley_" if mode == ParserMode.LALR else ""
+
+    path = Path(path)
+    if path.suffix == ".json":
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "parser": str(mode),
+                    "instructions": [s.to_dict(prefix) for s in stats],
+                    prefix + "ambiguous_rules": rules,
+                },
+                f,
+                indent=2,
+            )
+    elif path.suffix == ".csv":
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                [
+                    "name",
+                    "parse_time",
+                    "length",
+                    "tokens",
+                    prefix + "ambiguities",
+                    prefix + "ambiguous_rules",
+                ]
+            )
+            for s in stats:
+                writer.writerow(
+                    [
+                        s.name,
+                        f"{s.parse_time:.6f}",
+                        s.length,
+                        s.tokens,
+                        s.ambiguities,
+                        ";".join(f"{r}:{c}" for r, c in s.ambiguous_rules.items()),
+                    ]
+                )
+    else:
+        raise ValueError(f"Unknown report format: {path.suffix}. Use .csv or .json")
+
+    log(f"Wrote parse report to {path}")
+    grammar = " (Earley grammar)" if prefix else ""
+    for rule, count in list(rules.items())[:10]:
+        log(f"\tAmbiguous rule{grammar}: {rule} ({count} times)")
+
+
+def init_worker(*modes: ParserMode, instrument: bool = False) -> None:
+    """
+    Initializer of the parse pool. Compiles the grammars once per worker.
+    The pools call it in the parent process before the workers are forked.
+    So the workers inherit the parsers and start without any grammar work.
+    If instrument is set, the parser of the instrumentation is built as well
+    (see: get_ambiguity_parser()).
+    """
+    for mode in modes:
+        get_lark_parser(mode)
+    if instrument:
+        get_ambiguity_parser()
+
+
+def parse_single(
+    bundle: InsnParsingBundle, mode: ParserMode = ParserMode.EARLEY
+) -> dict[str:ParsedInsn]:
+    with collect_events() as events, profile_task() as task_stats:
+        with span("parse", "parser", insn=bundle.name):
+            pinsn = parse_bundle(bundle, mode)
+    pinsn.trace_events = events
+    pinsn.task_stats = task_stats
+    return {bundle.name: pinsn}
+
+
+def parse_bundle(bundle: InsnParsingBundle, mode: ParserMode) -> ParsedInsn:
+    parser = get_lark_parser(mode)
     name = bundle.name
     behaviors = bundle.behavior
-    grammar = bundle.grammar
-    parser = Lark(grammar, start="fbody", parser="earley")
+    cache = bundle.tree_cache
+    stats = ParseStats(name) if bundle.instrument else None
+    profile = RuleProfile() if bundle.profile else None
+    fast_path_hits = 0
+    start = time.perf_counter()
     try:
         asts = list()
-        for b in behaviors:
-            asts.append(parser.parse(b))
-        pinsn = ParsedInsn(name, asts, behaviors)
+        for i, b in enumerate(behaviors):
+            try:
+                tree = parse_fast(b) if bundle.fast_path else None
+                if tree is not None:
+                    fast_path_hits += 1
+                    asts.append(tree)
+                elif stats:
+                    asts.append(instrument_behavior(parser, b, stats, profile))
+                else:
+                    with profile_rules(profile):
+                        asts.append(parser.parse(b))
+            except Exception as e:
+                if cache:
+                    cache.put(bundle.cache_keys[i], ParserException(e))
+                raise e
+            if bundle.compact or cache:
+                compact_tree = CompactTree.from_tree(asts[-1])
+                if bundle.compact:
+                    asts[-1] = compact_tree
+                if cache:
+                    cache.put(bundle.cache_keys[i], compact_tree)
+        exception = None
     except Exception as e:
-        pinsn = ParsedInsn(name, [], behaviors, ParserException(e))
-    return {name: pinsn}
+        asts = []
+        exception = ParserException(e)
+    return ParsedInsn(
+        name,
+        asts,
+        behaviors,
+        exception,
+        stats,
+        profile,
+        fast_path_hits,
+        time.perf_counter() - start,
+    )
 
 
-class Parser:
+def parse_single_lalr(bundle: InsnParsingBundle) -> dict[str:ParsedInsn]:
+    return parse_single(bundle, ParserMode.LALR)
+
+
+# Whitespace outside of string literals.
+BEHAVIOR_WS_PATTERN = re.compile(r'("(?:\\.|[^"\\])*")|\s+')
+
+
+def normalize_behavior(behavior: str) -> str:
+    """
+    Returns the behavior with all whitespace (outside of strings) collapsed to a single space.
+    Whitespace is ignored by the grammar, so normalized behaviors parse to the same tree.
+    """
+    return BEHAVIOR_WS_PATTERN.sub(
+        lambda m: m.group(1) if m.group(1) else " ", behavior
+    ).strip()
+
+
+def get_behavior_key(behaviors: list[str]) -> tuple[str, ...]:
+    """Instructions with the same key have identical behaviors."""
+    return tuple(normalize_behavior(b) for b in behaviors)
+
+
+def group_by_behavior(insn_behavior: dict[str, list]) -> dict[tuple, list[str]]:
+    """
+    Groups the instructions by their normalized behavior.
+    Returns a dict of behavior key -> instruction names (in input order).
+    """
+    groups: dict[tuple, list[str]] = dict()
+    for name, behaviors in insn_behavior.items():
+        groups.setdefault(get_behavior_key(behaviors), list()).append(name)
+    return groups
+
+
+def first_tree_diff(a, b, path: str = "fbody") -> str | None:
+    """Returns the path to the first node which differs in both trees. None if equal."""
+    if isinstance(a, Tree) and isinstance(b, Tree):
+        if a.data != b.data or len(a.children) != len(b.children):
+            return f"{path}: {a.data} != {b.data}"
+        for i, (ca, cb) in enumerate(zip(a.children, b.children)):
+            diff = first_tree_diff(ca, cb, f"{path}/{a.data}[{i}]")
+            if diff:
+                return diff
+        return None
+    if a == b and type(a) is type(b):
+        return None
+    return f"{path}: {repr(a)} != {repr(b)}"
+
+
+def compare_single(bundle: InsnParsingBundle) -> tuple[str, str, str | None]:
+    """
+    Parses a bundle with the Earley and the LALR parser and compares the trees.
+    Returns the instruction name, the conformance category and the first difference.
+    """
+    earley = parse_single(bundle, ParserMode.EARLEY)[bundle.name]
+    lalr = parse_single(bundle, ParserMode.LALR)[bundle.name]
+    if earley.exception and lalr.exception:
+        return bundle.name, "both_failed", None
+    if earley.exception:
+        return bundle.name, "earley_failed", earley.exception.name
+    if lalr.exception:
+        return bundle.name, "lalr_failed", lalr.exception.name
+    for a, b in zip(earley.asts, lalr.asts):
+        diff = first_tree_diff(a, b)
+        if diff:
+            return bundle.name, "differ", diff
+    return bundle.name, "equal", None
+
+
+class ConformanceReport:
+    """The result of Parser.check_conformance()."""
+
+    categories = ["equal", "differ", "earley_failed", "lalr_failed", "both_failed"]
+
     def __init__(self):
-        pass
+        self.insns: dict[str, list[str]] = {c: list() for c in self.categories}
+        self.details: dict[str, str] = dict()
 
-    @staticmethod
-    def parse(insn_behavior: dict[str, list]) -> dict[str, ParsedInsn]:
-        with open(Conf.get_path(InputFile.GRAMMAR, "Hexagon")) as f:
-            grammar = "".join(f.readlines())
+    def add(self, name: str, category: str, detail: str | None) -> None:
+        self.insns[category].append(name)
+        if detail:
+            self.details[name] = detail
 
-        args = [
-            InsnParsingBundle(grammar, insn_name, insn_beh)
-            for insn_name, insn_beh in insn_behavior.items()
+    def conforms(self) -> bool:
+        return (
+            len(self.insns["differ"]) == 0
+            and len(self.insns["earley_failed"]) == 0
+            and len(self.insns["lalr_failed"]) == 0
+        )
+
+    def print(self) -> None:
+        for category in ["differ", "earley_failed", "lalr_failed"]:
+            for name in self.insns[category]:
+                log(f"{category}: {name}: {self.details.get(name)}", LogLevel.DEBUG)
+        log("Parser conformance (Earley vs. LALR):")
+        for category, names in self.insns.items():
+            log(f"\t{category}: {len(names)}")
+
+
+def compare_fast_path(
+    bundle: InsnParsingBundle, mode: ParserMode = ParserMode.EARLEY
+) -> tuple[str, list[tuple[str, str | None]]]:
+    """
+    Parses the behaviors recognized by the fast path with Lark as well and compares the trees.
+    Returns the instruction name and the category (and first difference) of each behavior.
+    """
+    results = list()
+    for behavior in bundle.behavior:
+        fast = parse_fast(behavior)
+        if fast is None:
+            results.append(("fallback", None))
+            continue
+        try:
+            tree = get_lark_parser(mode).parse(behavior)
+        except Exception as e:
+            results.append(("lark_failed", type(e).__name__))
+            continue
+        diff = first_tree_diff(tree, fast)
+        results.append(("differ", diff) if diff else ("equal", None))
+    return bundle.name, results
+
+
+def compare_fast_path_lalr(bundle: InsnParsingBundle):
+    return compare_fast_path(bundle, ParserMode.LALR)
+
+
+class FastPathReport:
+    """The result of Parser.check_fast_path(). Counts behaviors, not instructions."""
+
+    categories = ["equal", "differ", "lark_failed", "fallback"]
+
+    def __init__(self):
+        self.counts: dict[str, int] = {c: 0 for c in self.categories}
+        # Instruction name -> category and first difference of the failed comparisons.
+        self.mismatches: dict[str, tuple[str, str]] = dict()
+
+    def add(self, name: str, category: str, detail: str | None) -> None:
+        self.counts[category] += 1
+        if category in ["differ", "lark_failed"]:
+            self.mismatches[name] = (category, detail)
+
+    def get_hit_rate(self) -> float:
+        total = sum(self.counts.values())
+        return (total - self.counts["fallback"]) / total if total else 0.0
+
+    def conforms(self) -> bool:
+        return len(self.mismatches) == 0
+
+    def print(self) -> None:
+        for name, (category, detail) in self.mismatches.items():
+            log(f"{category}: {name}: {detail}", LogLevel.WARNING)
+        log("Fast path parity (fast path vs. Lark):")
+        for category, count in self.counts.items():
+            log(f"\t{category}: {count}")
+        log(f"\tHit rate: {self.get_hit_rate() * 100:.1f}%")
+
+
+class default_instance_method:
+    """
+    Decorator of a method which can be called on the class as well.
+    Called on the class, it is called with an instance built with the default arguments.
+    So Parser.parse(), which used to be a static method, keeps working.
+    """
+
+    def __init__(self, fcn):
+        self.fcn = fcn
+        functools.update_wrapper(self, fcn)
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return functools.partial(self.fcn, objtype())
+        return self.fcn.__get__(obj, objtype)
+
+
+class Parser:
+    def __init__(
+        self,
+        mode: ParserMode = ParserMode.EARLEY,
+        use_cache: bool = True,
+        compact: bool = False,
+        instrument: bool = False,
+        profile: bool = False,
+        fast_path: bool | None = None,
+    ):
+        """
+        :param mode: The parser to use.
+        :param use_cache: Look up parse trees in the on-disk parse tree cache
+                          and add new ones to it.
+        :param compact: Return the parse trees as CompactTree instead of Lark trees.
+                        They are cheaper to hold in memory.
+                        The workers always send CompactTrees, they are only
+                        converted back to Lark trees in this process.
+        :param instrument: Record statistics about the parsing of each instruction
+                           (ParsedInsn.stats). See: write_parse_report().
+                           The tree cache is not used, so every instruction is actually parsed.
+        :param profile: Record the work of the Earley parser per grammar rule
+                        over all parsed instructions (rule_profile).
+                        The tree cache is not used as well.
+        :param fast_path: Parse trivial behaviors with the fast path instead of Lark
+                          (see: parse_fast()). It is not used for instrumented or profiled parses,
+                          because they measure the Lark parser.
+                          Default: Only for the LALR parser. The Earley parser builds other
+                          trees for some of the behaviors (see: check_fast_path()).
+        """
+        self.mode = mode
+        self.compact = compact
+        self.instrument = instrument
+        if fast_path is None:
+            fast_path = mode == ParserMode.LALR
+        self.fast_path = fast_path and not instrument and not profile
+        # Parsed behaviors of the fast path and the ones left to Lark (cache hits not included).
+        self.fast_path_hits = 0
+        self.lark_parses = 0
+        self.rule_profile: RuleProfile | None = None
+        if profile:
+            if mode != ParserMode.EARLEY:
+                log(
+                    "Rule profiles are only recorded by the Earley parser.",
+                    LogLevel.WARNING,
+                )
+            self.rule_profile = RuleProfile()
+        self.tree_cache: FileCache | None = None
+        self.parser_digest = ""
+        if use_cache and not instrument and not profile:
+            try:
+                self.tree_cache = FileCache("parse_trees")
+            except OSError as e:
+                log(f"Parse tree cache not available: {e}", LogLevel.WARNING)
+            self.parser_digest = self.get_parser_digest()
+
+    def get_parser_digest(self) -> str:
+        """
+        Returns a digest over everything which determines the parse trees
+        besides the behavior.
+        """
+        parts = [
+            get_grammar(self.mode),
+            self.mode,
+            lark.__version__,
+            inspect.getsource(inspect.getmodule(parse_fast)),
+            # Trees of the fast path are only cached for parsers which use it.
+            # So a fast path bug never leaks into the trees of Lark-only parsers.
+            str(self.fast_path),
         ]
+        if self.mode == ParserMode.LALR:
+            parts.append(inspect.getsource(LALRTreeNormalizer))
+        return get_digest(*parts)
+
+    def get_cache_key(self, behavior: str) -> str:
+        return get_digest(self.parser_digest, behavior)
+
+    def get_cached(self, name: str, behaviors: list[str]) -> ParsedInsn | None:
+        """Returns the parsed instruction from the tree cache or None on a cache miss."""
+        asts = list()
+        for b in behaviors:
+            entry = self.tree_cache.get(self.get_cache_key(b))
+            if entry is None:
+                return None
+            if isinstance(entry, ParserException):
+                # The parser stops at the first failing behavior as well.
+                return ParsedInsn(name, [], behaviors, entry)
+            if self.compact and isinstance(entry, Tree):
+                entry = CompactTree.from_tree(entry)
+            elif not self.compact and isinstance(entry, CompactTree):
+                entry = entry.to_tree()
+            asts.append(entry)
+        return ParsedInsn(name, asts, behaviors)
+
+    def parse_insn(self, name: str, behaviors: list[str]) -> ParsedInsn:
+        """Parses the behaviors of a single instruction in this process."""
+        if not self.tree_cache:
+            bundle = InsnParsingBundle(
+                name,
+                behaviors,
+                compact=self.compact,
+                instrument=self.instrument,
+                profile=self.rule_profile is not None,
+                fast_path=self.fast_path,
+            )
+            return self.add_stats(parse_single(bundle, self.mode)[name])
+        cached = self.get_cached(name, behaviors)
+        if cached:
+            return cached
+        keys = [self.get_cache_key(b) for b in behaviors]
+        bundle = InsnParsingBundle(
+            name,
+            behaviors,
+            self.tree_cache,
+            keys,
+            self.compact,
+            fast_path=self.fast_path,
+        )
+        return self.add_stats(parse_single(bundle, self.mode)[name])
+
+    @default_instance_method
+    def parse(self, insn_behavior: dict[str, list]) -> dict[str, ParsedInsn]:
+        """
+        Parses the behaviors of all instructions.
+        Instructions with identical behaviors are parsed only once.
+        Parser.parse() parses them with a Parser() with the default settings.
+        """
+        groups = group_by_behavior(insn_behavior)
+        saved = len(insn_behavior) - len(groups)
+        if saved:
+            log(
+                f"Deduplicated behaviors: {len(insn_behavior)} instructions, "
+                f"{len(groups)} unique ({saved} parses saved)."
+            )
+        parsed = self.parse_unique(
+            {names[0]: insn_behavior[names[0]] for names in groups.values()}
+        )
+        # Fan out the results to the instructions with the same behavior.
+        for names in groups.values():
+            first = parsed[names[0]]
+            for name in names[1:]:
+                parsed[name] = ParsedInsn(
+                    name, list(first.asts), insn_behavior[name], first.exception
+                )
+        # Keep the order of the input.
+        return {name: parsed[name] for name in insn_behavior.keys()}
+
+    def parse_unique(self, insn_behavior: dict[str, list]) -> dict[str, ParsedInsn]:
         result: dict[str, ParsedInsn] = dict()
-        with Pool() as pool:
+        args = list()
+        for insn_name, insn_beh in insn_behavior.items():
+            if not self.tree_cache:
+                args.append(
+                    InsnParsingBundle(
+                        insn_name,
+                        insn_beh,
+                        compact=True,
+                        instrument=self.instrument,
+                        profile=self.rule_profile is not None,
+                        fast_path=self.fast_path,
+                    )
+                )
+                continue
+            cached = self.get_cached(insn_name, insn_beh)
+            if cached:
+                result[insn_name] = cached
+                continue
+            keys = [self.get_cache_key(b) for b in insn_beh]
+            args.append(
+                InsnParsingBundle(
+                    insn_name,
+                    insn_beh,
+                    self.tree_cache,
+                    keys,
+                    True,
+                    fast_path=self.fast_path,
+                )
+            )
+        if self.tree_cache:
+            log(f"Parse tree cache: {len(result)} hits, {len(args)} misses.")
+        if not args:
+            return result
+
+        parse_fcn = (
+            parse_single if self.mode == ParserMode.EARLEY else parse_single_lalr
+        )
+        initializer = functools.partial(
+            init_worker, self.mode, instrument=self.instrument
+        )
+        initializer()
+        with Pool(initializer=initializer) as pool:
             for res in tqdm(
-                pool.imap(parse_single, args), total=len(args), desc="Parse shortcode"
+                pool.imap(parse_fcn, args, chunksize=8),
+                total=len(args),
+                desc="Parse shortcode",
             ):
+                for parsed in res.values():
+                    self.add_stats(parsed)
+                    if not self.compact:
+                        parsed.asts = [t.to_tree() for t in parsed.asts]
                 result.update(res)
+        if self.fast_path:
+            log(
+                f"Fast path: {self.fast_path_hits} of "
+                f"{self.fast_path_hits + self.lark_parses} parsed behaviors "
+                f"({self.get_fast_path_hit_rate() * 100:.1f}%)."
+            )
         return result
+
+    def add_stats(self, parsed: ParsedInsn) -> ParsedInsn:
+        """
+        Counts the fast path hits of the parsed instruction,
+        merges its rule profile into rule_profile
+        and adds its trace events and cProfile statistics to the tracer and stage profile.
+        """
+        add_events(parsed.trace_events)
+        add_task_stats(parsed.task_stats)
+        parsed.trace_events = None
+        parsed.task_stats = None
+        if self.fast_path:
+            self.fast_path_hits += parsed.fast_path_hits
+            self.lark_parses += len(parsed.behaviors) - parsed.fast_path_hits
+        if self.rule_profile and parsed.profile:
+            self.rule_profile.merge(parsed.profile)
+        return parsed
+
+    def get_fast_path_hit_rate(self) -> float:
+        total = self.fast_path_hits + self.lark_parses
+        return self.fast_path_hits / total if total else 0.0
+
+    @staticmethod
+    def check_fast_path(
+        insn_behavior: dict[str, list], mode: ParserMode = ParserMode.EARLEY
+    ) -> FastPathReport:
+        """
+        Checks that the fast path builds the same trees as the Lark parser
+        for every behavior it recognizes. Only those behaviors are parsed with Lark.
+        """
+        args = [
+            InsnParsingBundle(insn_name, insn_beh)
+            for insn_name, insn_beh in insn_behavior.items()
+        ]
+        compare_fcn = (
+            compare_fast_path if mode == ParserMode.EARLEY else compare_fast_path_lalr
+        )
+        report = FastPathReport()
+        init_worker(mode)
+        with Pool(initializer=init_worker, initargs=(mode,)) as pool:
+            for name, results in tqdm(
+                pool.imap(compare_fcn, args, chunksize=8),
+                total=len(args),
+                desc="Check fast path parity",
+            ):
+                for category, detail in results:
+                    report.add(name, category, detail)
+        return report
+
+    @staticmethod
+    def check_conformance(insn_behavior: dict[str, list]) -> ConformanceReport:
+        """
+        Parses every behavior with the Earley and the LALR parser and compares the trees.
+        Known differences are the L2/L4_loadb*w* instructions (the Earley parser
+        resolves the ambiguous "};" arbitrarily) and the S2_parityp, S2_lfsp,
+        S4_parity instructions (the Earley parser lexes "1&ctpop32" as pointer).
+        """
+        args = [
+            InsnParsingBundle(insn_name, insn_beh)
+            for insn_name, insn_beh in insn_behavior.items()
+        ]
+        report = ConformanceReport()
+        init_worker(ParserMode.EARLEY, ParserMode.LALR)
+        with Pool(
+            initializer=init_worker, initargs=(ParserMode.EARLEY, ParserMode.LALR)
+        ) as pool:
+            for name, category, detail in tqdm(
+                pool.imap(compare_single, args, chunksize=8),
+                total=len(args),
+                desc="Check parser conformance",
+            ):
+                report.add(name, category, detail)
+        return report
@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import json
+import os
+
+from collections.abc import Callable
+from pathlib import Path
+
+from rzilcompiler.Cache import get_cache_dir, get_digest
+from rzilcompiler.Helper import log, LogLevel
+from rzilcompiler.Trace import span
+
+# Version of the manifest format. See: BuildGraph.save_manifest()
+BUILD_GRAPH_VERSION = 1
+
+
+def get_file_digest(path: Path) -> str:
+    return get_digest(path.read_bytes())
+
+
+class BuildStep:
+    """A step which writes the <outputs> files from the <inputs> files."""
+
+    def __init__(
+        self,
+        name: str,
+        inputs: list[Path],
+        outputs: list[Path],
+        action: Callable[[], None],
+    ):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.action = action
+
+
+class BuildGraph:
+    """
+    Runs build steps only if their inputs changed since their last run.
+    The content hashes of the inputs and outputs of each step are recorded in a manifest
+    in the cache directory. A step is skipped if the hash of its inputs is the recorded one
+    and its outputs still have the recorded content.
+    An output which is rewritten with the same content doesn't rerun the steps using it.
+
+    Steps run in the order they are added. So a step must be added after the steps
+    which write its inputs.
+    """
+
+    def __init__(self, name: str, recipe: str):
+        """
+        :param name: The name of the manifest file.
+        :param recipe: Everything which determines the outputs besides the input files
+                       (e.g. the source of the steps). All steps run if it changes.
+        """
+        self.steps: list[BuildStep] = list()
+        self.recipe = recipe
+        self.manifest_path = get_cache_dir("build_graph").joinpath(f"{name}.json")
+
+    def add_step(
+        self,
+        name: str,
+        inputs: list[Path],
+        outputs: list[Path],
+        action: Callable[[], None],
+    ) -> None:
+        self.steps.append(BuildStep(name, inputs, outputs, action))
+
+    def get_input_digest(self, step: BuildStep) -> str:
+        parts = [self.recipe, step.name]
+        for path in step.inputs:
+            parts += [path.name, get_file_digest(path)]
+        return get_digest(*parts)
+
+    @staticmethod
+    def is_up_to_date(step: BuildStep, digest: str, entry: dict | None) -> bool:
+        if not entry or entry["inputs"] != digest:
+            return False
+        for path in step.outputs:
+            recorded = entry["outputs"].get(str(path))
+            if not path.exists() or recorded != get_file_digest(path):
+                return False
+        return True
+
+    def load_manifest(self) -> dict[str, dict]:
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return dict()
+        except (OSError, ValueError):
+            log(f"Broken build manifest {self.manifest_path}.", LogLevel.WARNING)
+            return dict()
+        if manifest.get("version") != BUILD_GRAPH_VERSION:
+            return dict()
+        return manifest["steps"]
+
+    def save_manifest(self, entries: dict[str, dict]) -> None:
+        tmp = self.manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": BUILD_GRAPH_VERSION, "steps": entries}, f, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def run(self, force: bool = False) -> list[str]:
+        """
+        Runs all steps whose inputs or outputs changed.
+        :param force: Run all steps.
+        :return: The names of the steps which ran.
+        """
+        entries = self.load_manifest()
+        ran = list()
+        for step in self.steps:
+            digest = self.get_input_digest(step)
+            if not force and self.is_up_to_date(step, digest, entries.get(step.name)):
+                log(f"{step.name}: Up to date.", LogLevel.DEBUG)
+                continue
+            with span(step.name, "preprocessor"):
+                step.action()
+            ran.append(step.name)
+            entries[step.name] = {
+                "inputs": digest,
+                "outputs": {str(p): get_file_digest(p) for p in step.outputs},
+            }
+            # Save after each step, so an interrupted build keeps the finished steps.
+            self.save_manifest(entries)
+        return ran
@@ -2,13 +2,18 @@
 # SPDX-FileCopyrightText: 2022 Rot127 <rot127@posteo.com>
 # SPDX-License-Identifier: LGPL-3.0-only
 
+import inspect
 import re
 import pcpp
 
+from collections.abc import Iterator
 from pathlib import Path
 
+from rzilcompiler.Cache import get_digest
 from rzilcompiler.Configuration import InputFile, Conf
 from rzilcompiler.Helper import log
+from rzilcompiler.Preprocessor.BuildGraph import BuildGraph
+from rzilcompiler.Trace import span
 
 
 class PreprocessorHexagon:
@@ -18,10 +23,54 @@ class PreprocessorHexagon:
     def __init__(self, shortcode_path: Path):
         self.shortcode_path: Path = shortcode_path
 
-    def run_preprocess_steps(self):
-        self.preprocess_macros()
-        self.preprocess_shortcode()
-        self.postprocess_shortcode()
+    def run_preprocess_steps(self, force: bool = False):
+        """
+        Runs the preprocessor steps whose input files changed since their last run.
+        :param force: Run all steps.
+        """
+        ran = self.get_build_graph().run(force)
+        if not ran:
+            log("Preprocessor outputs are up to date.")
+
+    def get_build_graph(self) -> BuildGraph:
+        macros_patched = Conf.get_path(InputFile.HEXAGON_PP_MACROS_PATCHED_H)
+        combined = Conf.get_path(InputFile.HEXAGON_PP_COMBINED_H)
+        resolved_tmp = Conf.get_path(InputFile.HEXAGON_PP_SHORTCODE_RESOLVED_TMP_H)
+        resolved = Conf.get_path(InputFile.HEXAGON_PP_SHORTCODE_RESOLVED_H)
+        graph = BuildGraph(
+            "hexagon_preprocessor",
+            get_digest(inspect.getsource(PreprocessorHexagon), pcpp.__version__),
+        )
+        graph.add_step(
+            "preprocess_macros",
+            [
+                Conf.get_path(InputFile.HEXAGON_PP_MACROS_INC),
+                Conf.get_path(InputFile.HEXAGON_PP_MACROS_H),
+                Conf.get_path(InputFile.HEXAGON_PP_MACROS_MMVEC_H),
+                Conf.get_path(InputFile.HEXAGON_PP_PATCHES_MACROS_H),
+            ],
+            [macros_patched],
+            self.preprocess_macros,
+        )
+        graph.add_step(
+            "combine_shortcode",
+            [macros_patched, self.shortcode_path],
+            [combined],
+            self.combine_shortcode,
+        )
+        graph.add_step(
+            "resolve_shortcode_tmp",
+            [combined],
+            [resolved_tmp],
+            self.resolve_shortcode_tmp,
+        )
+        graph.add_step(
+            "resolve_shortcode",
+            [macros_patched, resolved_tmp],
+            [resolved],
+            self.resolve_shortcode,
+        )
+        return graph
 
     def preprocess_macros(self):
         """Remove includes. Decide between QEMU_GENERATE or not. Patch certain macros with ou version."""
@@ -121,21 +170,32 @@ class PreprocessorHexagon:
 
     def preprocess_shortcode(self):
         """Run pcpp on shortcode + macro files."""
-        combined_path = Conf.get_path(InputFile.HEXAGON_PP_COMBINED_H)
-        with open(combined_path, "w") as f:
+        self.combine_shortcode()
+        self.resolve_shortcode_tmp()
+        self.resolve_shortcode()
+
+    def combine_shortcode(self):
+        """Writes the patched macros and the shortcode into a single file for pcpp."""
+        with open(Conf.get_path(InputFile.HEXAGON_PP_COMBINED_H), "w") as f:
             with open(Conf.get_path(InputFile.HEXAGON_PP_MACROS_PATCHED_H)) as g:
                 f.writelines(g.readlines())
             f.write("\n")
             with open(self.shortcode_path) as g:
                 f.writelines(g.readlines())
+
+    def resolve_shortcode_tmp(self):
         argv = [
             "script_name",
-            str(combined_path),
+            str(Conf.get_path(InputFile.HEXAGON_PP_COMBINED_H)),
             "-o",
             str(Conf.get_path(InputFile.HEXAGON_PP_SHORTCODE_RESOLVED_TMP_H)),
         ]
         log("Resolve macros of shortcode with pcpp...")
-        pcpp.pcmd.CmdPreprocessor(argv)
+        with span("pcpp", "preprocessor", output=argv[-1]):
+            pcpp.pcmd.CmdPreprocessor(argv)
+
+    def resolve_shortcode(self):
+        """Runs pcpp a second time and removes the one-time do-whiles."""
         log("Do it again due to https://github.com/ned14/pcpp/issues/71")
         argv = [
             "script_name",
@@ -144,20 +204,29 @@ class PreprocessorHexagon:
             "-o",
             str(Conf.get_path(InputFile.HEXAGON_PP_SHORTCODE_RESOLVED_H)),
         ]
-        pcpp.pcmd.CmdPreprocessor(argv)
+        with span("pcpp", "preprocessor", output=argv[-1]):
+            pcpp.pcmd.CmdPreprocessor(argv)
+        self.postprocess_shortcode()
 
     def load_insn_behavior(self):
         log("Load instruction/behavior pairs.")
+        with span("load_insn_behavior", "preprocessor"):
+            for insn_name, insn_beh in self.iter_insn_behavior():
+                self.behaviors[insn_name] = insn_beh
+
+    @staticmethod
+    def iter_insn_behavior() -> Iterator[tuple[str, list[str]]]:
+        """Yields the instruction/behavior pairs of the resolved shortcode line by line."""
         with open(Conf.get_path(InputFile.HEXAGON_PP_SHORTCODE_RESOLVED_H)) as f:
-            for line in f.readlines():
+            for line in f:
                 if line[0] == "#":
                     continue
-                insn_name, insn_beh = self.split_resolved_shortcode(line)
+                insn_name, insn_beh = PreprocessorHexagon.split_resolved_shortcode(line)
                 if "__COMPOUND_PART1__" not in insn_beh:
-                    self.behaviors[insn_name] = [insn_beh]
+                    yield insn_name, [insn_beh]
                     continue
-                ib1, ib2 = self.split_compounds(insn_beh)
-                self.behaviors[insn_name] = [ib1, ib2]
+                ib1, ib2 = PreprocessorHexagon.split_compounds(insn_beh)
+                yield insn_name, [ib1, ib2]
 
     def get_insn_behavior(self, insn_name) -> [str]:
         """Returns a list of instruction behaviors. Most instruction will only have one element in the list.
@@ -0,0 +1,134 @@
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import time
+
+from contextlib import contextmanager
+
+from lark.parsers import earley, earley_common
+
+
+class RuleStats:
+    """The work the Earley parser did for a single grammar rule."""
+
+    __slots__ = ("items", "completions", "time")
+
+    def __init__(self):
+        # Earley items created for the rule (a measure of the chart size).
+        self.items = 0
+        # Items of the rule which were complete (the rule was matched).
+        self.completions = 0
+        # Seconds spent by the parser until an item of the rule was created.
+        self.time = 0.0
+
+
+class RuleProfile:
+    """
+    Per grammar rule statistics of the Earley parser, summed over all profiled parses.
+    See: profile_rules()
+    """
+
+    def __init__(self):
+        self.rules: dict[str, RuleStats] = dict()
+        self.parses = 0
+        # Total wall time of all profiled parses.
+        self.parse_time = 0.0
+        # Time after the last item was created (SPPF to tree conversion).
+        self.tree_time = 0.0
+        # Time of the last event of the current parse.
+        self.last = 0.0
+
+    def add_item(self, item: earley_common.Item) -> None:
+        now = time.perf_counter()
+        name = item.rule.origin.name
+        stats = self.rules.get(name)
+        if stats is None:
+            stats = self.rules[name] = RuleStats()
+        stats.items += 1
+        stats.completions += 1 if item.is_complete else 0
+        stats.time += now - self.last
+        self.last = now
+
+    def merge(self, other: "RuleProfile") -> None:
+        self.parses += other.parses
+        self.parse_time += other.parse_time
+        self.tree_time += other.tree_time
+        for name, o in other.rules.items():
+            stats = self.rules.get(name)
+            if stats is None:
+                stats = self.rules[name] = RuleStats()
+            stats.items += o.items
+            stats.completions += o.completions
+            stats.time += o.time
+
+    def get_ranked(self) -> list[tuple[str, RuleStats]]:
+        """Returns the rules sorted by their cumulative time (slowest first)."""
+        return sorted(self.rules.items(), key=lambda r: r[1].time, reverse=True)
+
+    def format_table(self, top: int = 0) -> str:
+        """
+        Returns the ranked rules as table.
+        :param top: Only the <top> slowest rules. All if 0.
+        """
+        ranked = self.get_ranked()
+        ranked = ranked[:top] if top > 0 else ranked
+        total = self.parse_time if self.parse_time > 0 else 1.0
+        width = max([len("Rule")] + [len(name) for name, _ in ranked])
+        lines = [
+            f"{'Rule':<{width}} {'Items':>10} {'Completions':>12} {'Time (s)':>10} {'Time %':>7}"
+        ]
+        for name, s in ranked:
+            lines.append(
+                f"{name:<{width}} {s.items:>10} {s.completions:>12} "
+                f"{s.time:>10.4f} {100 * s.time / total:>6.1f}%"
+            )
+        lines.append(
+            f"{self.parses} parses in {self.parse_time:.4f}s "
+            f"({self.tree_time:.4f}s building the trees)."
+        )
+        return "\n".join(lines)
+
+
+# The profile the created Earley items are counted in. See: profile_rules()
+active_profile: RuleProfile | None = None
+
+
+class ProfiledItem(earley_common.Item):
+    """An Earley item which counts itself into the active profile."""
+
+    __slots__ = ()
+
+    def __init__(self, rule, ptr, start):
+        super().__init__(rule, ptr, start)
+        active_profile.add_item(self)
+
+
+@contextmanager
+def profile_rules(profile: RuleProfile | None):
+    """
+    Context in which the Earley parses are profiled per grammar rule.
+    The time between two created Earley items is attributed to the rule of the later one.
+    So it includes the prediction, completion and scanning work which led to the item.
+
+    Lark's Earley items are replaced with ProfiledItem for the duration of the context.
+    If profile is None, nothing is done.
+    """
+    global active_profile
+    if profile is None:
+        yield
+        return
+
+    item_cls = earley_common.Item
+    earley.Item = earley_common.Item = ProfiledItem
+    active_profile = profile
+    start = time.perf_counter()
+    profile.last = start
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        earley.Item = earley_common.Item = item_cls
+        active_profile = None
+        profile.parses += 1
+        profile.parse_time += end - start
+        profile.tree_time += end - profile.last
@@ -0,0 +1,315 @@
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+
+from collections.abc import Callable
+from multiprocessing.pool import Pool
+from pathlib import Path
+
+from rzilcompiler.ArchEnum import ArchEnum
+from rzilcompiler.Compiler import (
+    Compiler,
+    CompiledInsnResult,
+    compile_insn_with,
+    compile_single,
+    compile_stmt_single,
+    compile_stmt_with,
+    get_compiler,
+)
+from rzilcompiler.Helper import log, LogLevel
+from rzilcompiler.Parser import InsnParsingBundle, Parser, ParserMode, lark_parsers
+
+
+class RequestError(Exception):
+    """An invalid request. It is answered with an error response."""
+
+
+class CompileRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles the requests of a single connection.
+    Each line is a JSON request, each is answered with a single line JSON response:
+
+    Request:  {"id": <any>, "method": "<method>", "params": {...}}
+    Response: {"id": <id of request>, "result": <result>}
+              {"id": <id of request>, "error": {"type": "<exception name>", "message": "<msg>"}}
+
+    See CompileServer for the methods.
+    """
+
+    server: "CompileServer"
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.server.handle_request_line(line)
+            self.wfile.write(json.dumps(response).encode("utf8") + b"\n")
+            self.wfile.flush()
+
+
+class CompileServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Serves compile requests over a Unix domain socket with a resident compiler.
+    Connections are handled in threads. The compilations run in a pool of workers
+    (see: Compiler.get_compile_pool()). Forking a process with running threads can
+    deadlock the child. So the workers are spawned and set up their own compiler.
+    Without workers, the requests are compiled one after another in the server process.
+
+    Methods:
+    ping:           -> {"pid": <server pid>, "instructions": <number of instructions>}
+    compile_insn:   {"name": <insn>} -> {"name", "insn_name", "rzil", "meta", "exception"}
+                    exception is the name of the failed compile step or null.
+    compile_stmt:   {"code": "{ <stmt> }"} -> {"rzil": <code>}
+    get_meta:       {"name": <insn>} -> {"meta": [[<meta of each behavior>], ...]}
+    reload:         Sets up the compiler again from the resources.
+                    The preprocessor is not run. So changes of the QEMU headers are only
+                    picked up if the resolved shortcode was generated again before
+                    (e.g. by Compiler.py without --skip-pp).
+                    -> {"instructions": <number of instructions>}
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, path: Path, compiler_factory: Callable[[], Compiler], jobs: int = 0
+    ):
+        """
+        :param path: The path of the socket.
+        :param compiler_factory: Returns a set up compiler. It is called again on reload.
+        :param jobs: Number of worker processes. If 0, requests are compiled in this process.
+        """
+        self.compiler_factory = compiler_factory
+        self.jobs = jobs
+        # Guards the compiler, parser, behaviors and pool. Without workers also the compilations.
+        self.lock = threading.Lock()
+        self.compiler: Compiler | None = None
+        self.parser: Parser | None = None
+        self.behaviors: dict[str, list[str]] = dict()
+        self.pool: Pool | None = None
+        self.load()
+
+        path = Path(path)
+        remove_stale_socket(path)
+        super().__init__(str(path), CompileRequestHandler)
+        self.path = path
+        self.methods = {
+            "ping": self.ping,
+            "compile_insn": self.compile_insn,
+            "compile_stmt": self.compile_stmt,
+            "get_meta": self.get_meta,
+            "reload": self.reload,
+        }
+
+    def load(self) -> None:
+        """Sets up the compiler and its worker pool. The caller must hold the lock."""
+        self.compiler = self.compiler_factory()
+        # The behaviors are shared by all preprocessors of a process.
+        # Clear them, so instructions removed from the resources are gone.
+        self.compiler.preprocessor.behaviors.clear()
+        self.compiler.preprocessor.load_insn_behavior()
+        self.behaviors = self.compiler.preprocessor.behaviors
+        if self.jobs:
+            # Interrupts are handled by the server, which stops the workers.
+            # The workers inherit the signal mask of the forking thread.
+            mask = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGINT})
+            try:
+                self.pool = self.compiler.get_compile_pool(
+                    self.jobs, keep=False, start_method="spawn"
+                )
+            finally:
+                signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+        else:
+            self.parser = Parser(self.compiler.parser_mode, compact=True)
+
+    def server_close(self):
+        super().server_close()
+        self.path.unlink(missing_ok=True)
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+
+    def handle_request_line(self, line: bytes) -> dict:
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError("The request must be a JSON object.")
+            request_id = request.get("id")
+            method = self.methods.get(request.get("method"))
+            if method is None:
+                raise RequestError(f"Unknown method: {request.get('method')}")
+            params = request.get("params", dict())
+            if not isinstance(params, dict):
+                raise RequestError("The params must be a JSON object.")
+            return {"id": request_id, "result": method(**params)}
+        except Exception as e:
+            log(f"Request failed: {type(e).__name__}: {e}", LogLevel.DEBUG)
+            return {
+                "id": request_id,
+                "error": {"type": type(e).__name__, "message": str(e)},
+            }
+
+    def ping(self) -> dict:
+        return {"pid": os.getpid(), "instructions": len(self.behaviors)}
+
+    def run_compile_insn(self, name: str) -> CompiledInsnResult:
+        with self.lock:
+            if name not in self.behaviors:
+                raise RequestError(f"Instruction {name} not found.")
+            behavior = self.behaviors[name]
+            if not self.pool:
+                return compile_insn_with(
+                    self.compiler, self.parser, name, behavior, keep=False
+                )
+            # Submitted under the lock, so a reload doesn't close the pool before.
+            result = self.pool.apply_async(
+                compile_single, (InsnParsingBundle(name, behavior),)
+            )
+        return result.get()
+
+    def compile_insn(self, name: str) -> dict:
+        result = self.run_compile_insn(name)
+        return {
+            "name": result.name,
+            "insn_name": result.insn_name,
+            "rzil": result.rzil,
+            "meta": result.meta,
+            "exception": result.exception,
+        }
+
+    def compile_stmt(self, code: str) -> dict:
+        with self.lock:
+            if self.pool:
+                pending = self.pool.apply_async(compile_stmt_single, (code,))
+            else:
+                pending = None
+                result = compile_stmt_with(self.compiler, code)
+        if pending:
+            result = pending.get()
+        if isinstance(result, Exception):
+            raise result
+        return {"rzil": result}
+
+    def get_meta(self, name: str) -> dict:
+        result = self.run_compile_insn(name)
+        if result.exception:
+            raise RequestError(f"{name} failed to compile: {result.exception}")
+        return {"meta": result.meta}
+
+    def reload(self) -> dict:
+        with self.lock:
+            old_pool = self.pool
+            # Sub-routines and parsers are shared by all compilers of a process.
+            # This process only uses them while it holds the lock.
+            # The workers have their own.
+            Compiler.sub_routines.clear()
+            lark_parsers.clear()
+            self.load()
+        if old_pool:
+            # Lets the running requests finish.
+            old_pool.close()
+            old_pool.join()
+        log(f"Reloaded compiler: {len(self.behaviors)} instructions.")
+        return {"instructions": len(self.behaviors)}
+
+
+def remove_stale_socket(path: Path) -> None:
+    """Removes the socket file of a server which is not running anymore."""
+    if not path.exists():
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path))
+        except OSError:
+            path.unlink()
+            return
+    raise OSError(f"A server is already listening on {path}")
+
+
+def serve(path: Path, compiler_factory: Callable[[], Compiler], jobs: int = 0):
+    """Serves compile requests on the Unix socket at path until interrupted."""
+    with CompileServer(path, compiler_factory, jobs) as server:
+        log(f"Serve compile requests on {path} (workers: {jobs})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            log("Stop server.")
+
+
+def request(path: Path, method: str, **params):
+    """
+    Sends a single request to the server at path and returns its result.
+    Raises a RuntimeError with the type and message of the error response.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(path))
+        sock.sendall(
+            json.dumps({"id": 0, "method": method, "params": params}).encode("utf8")
+            + b"\n"
+        )
+        with sock.makefile("rb") as f:
+            response = json.loads(f.readline())
+    if "error" in response:
+        error = response["error"]
+        raise RuntimeError(f"{error['type']}: {error['message']}")
+    return response["result"]
+
+
+def parse_args() -> argparse.Namespace:
+    argp = argparse.ArgumentParser(
+        prog="RZIL Compile Server",
+        description="Serves compile requests over a Unix domain socket with a resident compiler.",
+    )
+    argp.add_argument(
+        "-a",
+        dest="arch",
+        choices=["Hexagon"],
+        required=True,
+        help="Architecture to compile for.",
+    )
+    argp.add_argument(
+        "-j",
+        dest="jobs",
+        type=int,
+        default=0,
+        help="Number of worker processes which compile the requests. "
+        "Default: 0 (compile in the server process)",
+    )
+    argp.add_argument(
+        "--parser",
+        dest="parser_mode",
+        choices=[m.value for m in ParserMode],
+        default=ParserMode.EARLEY.value,
+        help="The parser used to parse the shortcode. Default: earley",
+    )
+    argp.add_argument(
+        "--snapshot",
+        dest="snapshot",
+        metavar="FILE",
+        type=Path,
+        help="Set up the compiler from the snapshot FILE. See: Compiler.py --snapshot",
+    )
+    argp.add_argument(
+        "socket",
+        type=Path,
+        help="Path of the Unix domain socket.",
+    )
+    return argp.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    serve(
+        args.socket,
+        lambda: get_compiler(
+            ArchEnum[args.arch.upper()], ParserMode(args.parser_mode), args.snapshot
+        ),
+        args.jobs,
+    )
@@ -0,0 +1,250 @@
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import cProfile
+import os
+import pstats
+
+from contextlib import contextmanager
+from pathlib import Path
+
+from rzilcompiler.Helper import log
+
+
+class TaskStats:
+    """
+    Raw cProfile statistics (see: cProfile.Profile.create_stats()),
+    e.g. of a single task of a worker process.
+    It is accepted by pstats.Stats() like a profile.
+    """
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class StageProfiler:
+    """
+    Profiles the stages of the compiler with cProfile.
+    The statistics of each stage are written to <out_dir>/<stage>.pstats
+    and as collapsed stacks (flamegraph.pl, speedscope) to <out_dir>/<stage>.collapsed.
+    Stages can be nested. The time of a nested stage is only attributed to it,
+    not to the enclosing stage.
+    Tasks of forked worker processes are profiled separately (see: profile_task())
+    and added to the stage which receives their results (see: add_task_stats()).
+    """
+
+    def __init__(self, out_dir: Path):
+        self.out_dir = out_dir
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        # The process which profiles the stages. Other pids are worker processes.
+        self.pid = os.getpid()
+        # The active stages. Only the profile of the innermost one is enabled.
+        self.stack: list[tuple[str, cProfile.Profile]] = list()
+        # The raw statistics of all runs of a stage (see: merge_stats()).
+        self.stats: dict[str, dict] = dict()
+        # A task of this worker process is profiled.
+        self.in_task = False
+
+    @contextmanager
+    def stage(self, name: str):
+        """Context which is profiled as stage <name>."""
+        if self.stack:
+            self.stack[-1][1].disable()
+        profile = cProfile.Profile()
+        self.stack.append((name, profile))
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.stack.pop()
+            profile.create_stats()
+            merge_stats(self.stats.setdefault(name, dict()), profile.stats)
+            self.write_stage(name)
+            if self.stack:
+                self.stack[-1][1].enable()
+
+    def add_task_stats(self, stats: list[TaskStats]) -> None:
+        """Adds the statistics of worker tasks to the innermost active stage."""
+        if not self.stack:
+            return
+        name, profile = self.stack[-1]
+        # Merging is not part of the stage.
+        profile.disable()
+        for s in stats:
+            merge_stats(self.stats.setdefault(name, dict()), s.stats)
+        profile.enable()
+
+    @contextmanager
+    def task(self):
+        """
+        Context which profiles a task of a forked worker process.
+        The yielded list receives its statistics. Nested tasks are not profiled separately.
+        """
+        stats = list()
+        if os.getpid() == self.pid or self.in_task:
+            yield stats
+            return
+        if self.stack:
+            # The worker inherited the enabled profile of the parent.
+            # Only one profiler can be active at a time.
+            self.stack[-1][1].disable()
+            self.stack.clear()
+        profile = cProfile.Profile()
+        self.in_task = True
+        profile.enable()
+        try:
+            yield stats
+        finally:
+            profile.disable()
+            self.in_task = False
+            profile.create_stats()
+            stats.append(TaskStats(profile.stats))
+
+    def write_stage(self, name: str) -> None:
+        stats = pstats.Stats(TaskStats(get_final_stats(self.stats[name])))
+        stats.dump_stats(self.out_dir.joinpath(f"{name}.pstats"))
+        with open(self.out_dir.joinpath(f"{name}.collapsed"), "w") as f:
+            for stack, time in get_collapsed_stacks(stats).items():
+                f.write(f"{stack} {time}\n")
+
+
+def merge_stats(merged: dict, stats: dict) -> None:
+    """
+    Adds the raw cProfile statistics <stats> to <merged>.
+    Other than pstats.Stats.add() it doesn't copy the callers of each function,
+    so merging the statistics of thousands of tasks stays fast.
+    """
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        entry = merged.get(func)
+        if entry is None:
+            merged[func] = [cc, nc, tt, ct, {c: list(e) for c, e in callers.items()}]
+            continue
+        entry[0] += cc
+        entry[1] += nc
+        entry[2] += tt
+        entry[3] += ct
+        for caller, edge in callers.items():
+            merged_edge = entry[4].get(caller)
+            if merged_edge is None:
+                entry[4][caller] = list(edge)
+                continue
+            for i, v in enumerate(edge):
+                merged_edge[i] += v
+
+
+def get_final_stats(merged: dict) -> dict:
+    """Returns the statistics merged by merge_stats() in the format of cProfile."""
+    return {
+        func: (cc, nc, tt, ct, {c: tuple(e) for c, e in callers.items()})
+        for func, (cc, nc, tt, ct, callers) in merged.items()
+    }
+
+
+def get_func_label(func: tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == "~":
+        # Built-in function
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def get_collapsed_stacks(
+    stats: pstats.Stats, min_fraction: float = 0.0001, max_depth: int = 128
+) -> dict[str, int]:
+    """
+    Returns the self time (in µs) per call stack. The stacks are
+    the function labels from the root to the leaf, separated by ";".
+    cProfile records only caller -> callee edges, not whole stacks.
+    So the time of a function is split among its stacks in proportion
+    to the time of the calls along each stack.
+
+    :param min_fraction: Stacks with less than this fraction of the total time are dropped.
+    :param max_depth: Stacks are cut at this depth.
+    """
+    callees: dict[tuple, dict[tuple, float]] = dict()
+    roots = list()
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, edge in callers.items():
+            # Cumulative time of the calls from caller to func.
+            callees.setdefault(caller, dict())[func] = edge[3]
+    total = sum(stats.stats[r][3] for r in roots)
+    min_time = total * min_fraction
+    stacks: dict[str, float] = dict()
+
+    def walk(func: tuple, path: list[tuple], time: float) -> None:
+        _, _, tt, ct, _ = stats.stats[func]
+        scale = min(time / ct, 1.0) if ct else 0.0
+        path.append(func)
+        stack = ";".join(get_func_label(f) for f in path)
+        stacks[stack] = stacks.get(stack, 0.0) + tt * scale
+        if len(path) < max_depth:
+            for callee, edge_time in callees.get(func, dict()).items():
+                if callee in path or edge_time * scale < min_time:
+                    # Recursion or negligible
+                    continue
+                walk(callee, path, edge_time * scale)
+        path.pop()
+
+    for root in roots:
+        walk(root, list(), stats.stats[root][3])
+    return {s: round(t * 1e6) for s, t in stacks.items() if round(t * 1e6) > 0}
+
+
+# The profiler of this process. None if profiling is disabled.
+# Forked worker processes inherit it.
+profiler: StageProfiler | None = None
+
+
+@contextmanager
+def profiling(out_dir: Path | None):
+    """
+    Context in which stages are profiled (see: profile_stage()).
+    If out_dir is None, nothing is done.
+    """
+    global profiler
+    if out_dir is None:
+        yield
+        return
+    profiler = StageProfiler(out_dir)
+    try:
+        yield
+    finally:
+        log(f"Wrote profiles of {len(profiler.stats)} stages to {out_dir}")
+        profiler = None
+
+
+@contextmanager
+def profile_stage(name: str):
+    """Context which is profiled as stage <name>. Nothing is done if profiling is disabled."""
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+
+@contextmanager
+def profile_task():
+    """
+    Context which profiles a task of a worker process.
+    The yielded list receives the statistics of the task. It is empty
+    if profiling is disabled or the task runs in the profiling process itself.
+    The worker sends it back with the result. See: add_task_stats()
+    """
+    if profiler is None:
+        yield list()
+        return
+    with profiler.task() as stats:
+        yield stats
+
+
+def add_task_stats(stats: list[TaskStats] | None) -> None:
+    """Adds the statistics of worker tasks to the innermost active stage."""
+    if profiler is not None and stats:
+        profiler.add_task_stats(stats)
@@ -0,0 +1,38 @@
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import os
+import tempfile
+import unittest
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from unittest import mock
+
+from rzilcompiler.Cache import CACHE_DIR_ENV
+
+
+@contextmanager
+def temp_cache_dir() -> Iterator[Path]:
+    """
+    Context in which the cache directory is an empty temporary directory.
+    A cache directory set by the developer is restored afterwards.
+    """
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with mock.patch.dict(os.environ, {CACHE_DIR_ENV: cache_dir}):
+            yield Path(cache_dir)
+
+
+class TempCacheTestCase(unittest.TestCase):
+    """
+    Runs the tests of the class with a temporary cache directory.
+    So the tests never write into the cache of the working tree.
+    Subclasses which overwrite setUpClass() must call it.
+    """
+
+    cache_dir: Path
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_dir = cls.enterClassContext(temp_cache_dir())
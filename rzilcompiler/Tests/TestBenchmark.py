@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from rzilcompiler.ArchEnum import ArchEnum
+from rzilcompiler.Benchmark import (
+    Benchmark,
+    StageResult,
+    compare_results,
+    get_percentile,
+    load_results,
+    save_results,
+)
+from rzilcompiler.Parser import ParserMode
+from rzilcompiler.Preprocessor.Hexagon.PreprocessorHexagon import PreprocessorHexagon
+from rzilcompiler.Tests.TempCache import TempCacheTestCase
+
+
+class TestBenchmark(TempCacheTestCase):
+    def test_percentile(self):
+        values = [float(v) for v in range(100, 0, -1)]
+        self.assertEqual(get_percentile(values, 50), 50.0)
+        self.assertEqual(get_percentile(values, 95), 95.0)
+        self.assertEqual(get_percentile(values, 100), 100.0)
+        self.assertEqual(get_percentile([3.0], 95), 3.0)
+        self.assertEqual(get_percentile([], 50), 0.0)
+
+    def test_compare_results(self):
+        baseline = {
+            "parse": StageResult.from_latencies([0.001, 0.002, 0.003], 3),
+            "transform": StageResult.from_latencies([0.001, 0.001], 2),
+        }
+        results = {
+            "parse": StageResult.from_latencies([0.001, 0.002, 0.0031], 3),
+            "transform": StageResult.from_latencies([0.002, 0.002], 2),
+            "compiler": StageResult.from_latencies([0.1], 0),
+        }
+        table, regressed = compare_results(baseline, results, 0.1)
+        self.assertEqual(regressed, ["transform"])
+        self.assertIn("not in baseline", table)
+        _, regressed = compare_results(baseline, results, 1.5)
+        self.assertEqual(regressed, [])
+
+    def test_benchmark(self):
+        benchmark = Benchmark(ArchEnum.HEXAGON, ParserMode.LALR, repeat=1, limit=20)
+        results = benchmark.run(["load_behaviors", "parse", "transform"])
+        self.assertEqual(list(results.keys()), ["load_behaviors", "parse", "transform"])
+        self.assertEqual(results["parse"].count, 20)
+        self.assertEqual(results["parse"].insns, 20)
+        self.assertLessEqual(results["parse"].p50, results["parse"].p95)
+        self.assertGreater(results["load_behaviors"].get_throughput(), 0)
+        self.assertGreater(results["load_behaviors"].insns, 0)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir).joinpath("bench.json")
+            save_results(path, benchmark.get_config(), results)
+            config, loaded = load_results(path)
+        self.assertEqual(config, benchmark.get_config())
+        self.assertEqual(loaded["parse"].to_dict(), results["parse"].to_dict())
+
+    def test_benchmark_preprocess(self):
+        benchmark = Benchmark(ArchEnum.HEXAGON, ParserMode.LALR, repeat=1)
+        preprocessor = benchmark.get_compiler().preprocessor
+        # The behaviors are not loaded before this stage.
+        PreprocessorHexagon.behaviors.clear()
+        try:
+            result = benchmark.run(["preprocess"])["preprocess"]
+        finally:
+            preprocessor.load_insn_behavior()
+        self.assertEqual(result.count, 1)
+        self.assertGreater(result.insns, 0)
+        self.assertEqual(
+            result.insns, sum(1 for _ in PreprocessorHexagon.iter_insn_behavior())
+        )
+
+
+if __name__ == "__main__":
+    TestBenchmark().main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from rzilcompiler.Configuration import Conf, InputFile
+from rzilcompiler.Preprocessor.BuildGraph import BuildGraph
+from rzilcompiler.Preprocessor.Hexagon.PreprocessorHexagon import PreprocessorHexagon
+from rzilcompiler.Tests.TempCache import temp_cache_dir
+
+
+class TestBuildGraph(unittest.TestCase):
+    def setUp(self):
+        self.dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(temp_cache_dir())
+
+    def get_graph(self, recipe: str = "v1") -> BuildGraph:
+        """src -> upper (src in upper case) -> length (length of upper)"""
+        src = self.dir.joinpath("src.txt")
+        upper = self.dir.joinpath("upper.txt")
+        length = self.dir.joinpath("length.txt")
+        graph = BuildGraph("test", recipe)
+        graph.add_step(
+            "upper", [src], [upper], lambda: upper.write_text(src.read_text().upper())
+        )
+        graph.add_step(
+            "length",
+            [upper],
+            [length],
+            lambda: length.write_text(str(len(upper.read_text()))),
+        )
+        return graph
+
+    def test_run(self):
+        src = self.dir.joinpath("src.txt")
+        src.write_text("abc")
+        self.assertEqual(self.get_graph().run(), ["upper", "length"])
+        self.assertEqual(self.dir.joinpath("length.txt").read_text(), "3")
+        self.assertEqual(self.get_graph().run(), [])
+
+        # Same output of "upper", so "length" is not rerun.
+        src.write_text("ABC")
+        self.assertEqual(self.get_graph().run(), ["upper"])
+        src.write_text("abcd")
+        self.assertEqual(self.get_graph().run(), ["upper", "length"])
+        self.assertEqual(self.dir.joinpath("length.txt").read_text(), "4")
+
+        # Modified or removed outputs are rebuilt.
+        self.dir.joinpath("length.txt").write_text("0")
+        self.assertEqual(self.get_graph().run(), ["length"])
+        self.dir.joinpath("upper.txt").unlink()
+        self.assertEqual(self.get_graph().run(), ["upper"])
+
+        self.assertEqual(self.get_graph("v2").run(), ["upper", "length"])
+        self.assertEqual(self.get_graph("v2").run(force=True), ["upper", "length"])
+
+    def test_hexagon_graph(self):
+        shortcode = Conf.get_path(InputFile.HEXAGON_PP_SHORTCODE_H)
+        graph = PreprocessorHexagon(shortcode).get_build_graph()
+        self.assertEqual(
+            [s.name for s in graph.steps],
+            [
+                "preprocess_macros",
+                "combine_shortcode",
+                "resolve_shortcode_tmp",
+                "resolve_shortcode",
+            ],
+        )
+        # Every input is a resource or the output of an earlier step.
+        written = set()
+        for step in graph.steps:
+            for path in step.inputs:
+                self.assertTrue(path in written or path.exists(), path)
+            written.update(step.outputs)
+        self.assertIn(shortcode, graph.steps[1].inputs)
+        self.assertEqual(
+            graph.steps[-1].outputs,
+            [Conf.get_path(InputFile.HEXAGON_PP_SHORTCODE_RESOLVED_H)],
+        )
+
+
+if __name__ == "__main__":
+    TestBuildGraph().main()
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+import json
+import multiprocessing
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import rzilcompiler.Compiler
+from rzilcompiler.Cache import FileCache
+from rzilcompiler.CompactTree import CompactTree
+from rzilcompiler.Compiler import (
+    Compiler,
+    compile_insn_with,
+    get_transform_exception_bucket,
+    parse_args,
+    write_timings,
+)
+from rzilcompiler.Exceptions import RepeatedTransformException, WorkerException
+from rzilcompiler.Parser import ParsedInsn, Parser, get_lark_parser
+from rzilcompiler.Transformer.RZILTransformer import CodeFormat
+from rzilcompiler.ArchEnum import ArchEnum
+from rzilcompiler.Tests.TempCache import TempCacheTestCase, temp_cache_dir
+from rzilcompiler.Tests.TestTransformer import (
+    get_hexagon_insn_behavior,
+    get_hexagon_parser,
+)
+
+from lark import Tree
+from lark.exceptions import VisitError, UnexpectedCharacters, UnexpectedEOF
+
+
+def get_worker_compiler_id() -> int:
+    return id(rzilcompiler.Compiler.worker_compiler)
+
+class TestCompiler(TempCacheTestCase):
+    insn_behavior: dict[str:tuple] = dict()
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.insn_behavior = get_hexagon_insn_behavior()
+        cls.parser = get_hexagon_parser()
+        cls.compiler = Compiler(ArchEnum.HEXAGON, code_format=CodeFormat.EXEC_CLASSES)
+
+    def test_compile_all_parallel(self):
+        insn_behavior = {
+            "A2_add": self.insn_behavior["A2_add"],
+            "J2_call": self.insn_behavior["J2_call"],
+            "faulty_input": ["{"],
+            "J2_call_alias": self.insn_behavior["J2_call"],
+        }
+        results = self.compiler.compile_all_parallel(2, insn_behavior)
+        self.assertListEqual(list(results.keys()), list(insn_behavior.keys()))
+        self.assertEqual(results["faulty_input"].exception, "UnexpectedEOF")
+        for name in ["A2_add", "J2_call", "J2_call_alias"]:
+            self.assertIsNone(results[name].exception)
+            self.assertEqual(results[name].insn_name, name)
+            expected = self.compiler.transform_insn(
+                name,
+                ParsedInsn(
+                    name,
+                    [self.parser.parse(b) for b in insn_behavior[name]],
+                    insn_behavior[name],
+                ),
+            )
+            self.assertListEqual(results[name].rzil, expected.rzil)
+            self.assertListEqual(results[name].meta, expected.meta)
+            self.assertListEqual(results[name].parse_trees, expected.parse_trees)
+
+    def test_compile_incremental(self):
+        behaviors = self.compiler.preprocessor.behaviors
+        with temp_cache_dir() as cache_dir:
+            manifest = cache_dir.joinpath("manifest.json")
+            try:
+                with mock.patch(
+                    "rzilcompiler.Compiler.compile_insn_with", wraps=compile_insn_with
+                ) as compile_mock:
+
+                    def build(insn_behavior: dict) -> tuple[dict, list[str]]:
+                        compile_mock.reset_mock()
+                        self.compiler.preprocessor.behaviors = insn_behavior
+                        res = self.compiler.compile_incremental(manifest)
+                        return res, [c.args[2] for c in compile_mock.call_args_list]
+
+                    first, compiled = build(
+                        {
+                            "A2_add": self.insn_behavior["A2_add"],
+                            "J2_call": self.insn_behavior["J2_call"],
+                            "faulty_input": ["{"],
+                        }
+                    )
+                    self.assertListEqual(
+                        compiled, ["A2_add", "J2_call", "faulty_input"]
+                    )
+                    self.assertEqual(first["faulty_input"].exception, "UnexpectedEOF")
+
+                    # Changed, added and removed instructions.
+                    insn_behavior = {
+                        "A2_add": self.insn_behavior["A2_add"],
+                        "J2_call": self.insn_behavior["A2_sub"],
+                        "A2_sub": self.insn_behavior["A2_sub"],
+                    }
+                    second, compiled = build(insn_behavior)
+                    self.assertListEqual(compiled, ["J2_call", "A2_sub"])
+                    self.assertListEqual(
+                        list(second.keys()), list(insn_behavior.keys())
+                    )
+                    self.assertListEqual(second["A2_add"].rzil, first["A2_add"].rzil)
+                    self.assertListEqual(second["J2_call"].rzil, second["A2_sub"].rzil)
+                    with open(manifest) as f:
+                        entries = json.load(f)["instructions"]
+                    self.assertNotIn("faulty_input", entries)
+
+                    # Nothing changed.
+                    third, compiled = build(insn_behavior)
+                    self.assertListEqual(compiled, [])
+                    for name, res in third.items():
+                        self.assertEqual(res.insn_name, name)
+                        self.assertListEqual(res.rzil, second[name].rzil)
+                        self.assertListEqual(res.meta, second[name].meta)
+                        self.assertIn(name, self.compiler.compiled_insns)
+
+                    # Evicted outputs are compiled again, but are not changed.
+                    with mock.patch("rzilcompiler.Compiler.RESULT_CACHE_MAX_BYTES", 0):
+                        _, compiled = build(insn_behavior)
+                    self.assertListEqual(compiled, [])
+                    outputs = FileCache("outputs").dir
+                    self.assertListEqual(list(outputs.glob("*/*")), [])
+                    with mock.patch("rzilcompiler.Compiler.log") as log_mock:
+                        _, compiled = build(insn_behavior)
+                    self.assertListEqual(compiled, list(insn_behavior.keys()))
+                    self.assertIn(
+                        "0 changed, 0 removed, 0 unchanged, 3 evicted instructions.",
+                        log_mock.call_args_list[0].args[0],
+                    )
+
+                    # Changed compiler config.
+                    with mock.patch.object(
+                        Compiler, "get_config_digest", return_value="changed"
+                    ):
+                        _, compiled = build(insn_behavior)
+                    self.assertListEqual(compiled, list(insn_behavior.keys()))
+
+                # The outputs are kept in the cache.
+                with mock.patch.object(self.compiler, "use_cache", False):
+                    with self.assertRaises(ValueError):
+                        self.compiler.compile_incremental(manifest)
+                argv = ["Compiler.py", "-a", "Hexagon", "-t", "--incremental"]
+                with mock.patch("sys.argv", argv):
+                    self.assertTrue(parse_args().incremental)
+                with mock.patch("sys.argv", argv + ["--no-cache"]):
+                    with self.assertRaises(SystemExit), mock.patch("sys.stderr"):
+                        parse_args()
+            finally:
+                self.compiler.preprocessor.behaviors = behaviors
+
+    def test_insn_timings(self):
+        result_cache = self.compiler.result_cache
+        self.compiler.result_cache = None
+        try:
+            parser = Parser(use_cache=False)
+            results = {
+                name: compile_insn_with(self.compiler, parser, name, b, False)
+                for name, b in [
+                    ("faulty_input", ["{"]),
+                    ("A2_add", self.insn_behavior["A2_add"]),
+                ]
+            }
+        finally:
+            self.compiler.result_cache = result_cache
+        add = results["A2_add"]
+        self.assertFalse(add.cached)
+        self.assertGreater(add.parse_time, 0)
+        self.assertGreater(add.transform_time, 0)
+        self.assertEqual(add.get_code_size(), len("".join(add.rzil)))
+        faulty = results["faulty_input"]
+        self.assertGreater(faulty.parse_time, 0)
+        self.assertEqual(faulty.transform_time, 0)
+        self.assertEqual(faulty.get_code_size(), 0)
+        # Copies didn't do the work.
+        copy = add.copy_for("A2_add_copy", "A2_add_copy")
+        self.assertEqual(copy.parse_time + copy.transform_time, 0)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir).joinpath("timings.json")
+            write_timings(results, path, self.compiler.get_timings_config())
+            with open(path) as f:
+                timings = json.load(f)
+        self.assertEqual(timings["config"]["parser_mode"], "earley")
+        self.assertEqual(timings["code_size"], add.get_code_size())
+        # Slowest first.
+        slowest = sorted(
+            results.values(),
+            key=lambda r: r.parse_time + r.transform_time,
+            reverse=True,
+        )
+        self.assertEqual(
+            [i["name"] for i in timings["instructions"]], [r.name for r in slowest]
+        )
+        exceptions = {i["name"]: i["exception"] for i in timings["instructions"]}
+        self.assertEqual(exceptions, {"A2_add": None, "faulty_input": "UnexpectedEOF"})
+
+    def test_result_cache(self):
+        result_cache = self.compiler.result_cache
+        with temp_cache_dir():
+            try:
+                self.compiler.result_cache = FileCache("results")
+                parser = Parser(use_cache=False)
+                insn_behavior = {
+                    "A2_add": self.insn_behavior["A2_add"],
+                    "faulty_input": ["{"],
+                }
+                first = {
+                    name: compile_insn_with(self.compiler, parser, name, b, True)
+                    for name, b in insn_behavior.items()
+                }
+                self.assertEqual(first["faulty_input"].exception, "UnexpectedEOF")
+
+                # Successful and failed compilations are served from the cache.
+                with mock.patch.object(parser, "parse_insn") as parse_mock:
+                    for name, behavior in insn_behavior.items():
+                        res = compile_insn_with(
+                            self.compiler, parser, name, behavior, True
+                        )
+                        self.assertEqual(
+                            res.get_output_digest(), first[name].get_output_digest()
+                        )
+                        self.assertTrue(res.cached)
+                        self.assertEqual(res.parse_time + res.transform_time, 0)
+                    # Same behavior, other instruction.
+                    res = compile_insn_with(
+                        self.compiler,
+                        parser,
+                        "A2_add_copy",
+                        insn_behavior["A2_add"],
+                        True,
+                    )
+                    self.assertEqual(res.name, "A2_add_copy")
+                    self.assertListEqual(res.rzil, first["A2_add"].rzil)
+                    parse_mock.assert_not_called()
+
+                    self.compiler.rebuild_cache = True
+                    compile_insn_with(
+                        self.compiler, parser, "A2_add", insn_behavior["A2_add"], True
+                    )
+                    parse_mock.assert_called_once()
+                self.compiler.rebuild_cache = False
+
+                # Another compiler config has other keys.
+                key = self.compiler.get_result_cache_key("A2_add", ["{ RdV=RsV+RtV; }"])
+                digest = self.compiler.result_cache_digest
+                self.compiler.result_cache_digest = "changed"
+                self.assertNotEqual(
+                    key,
+                    self.compiler.get_result_cache_key("A2_add", ["{ RdV=RsV+RtV; }"]),
+                )
+                self.compiler.result_cache_digest = digest
+
+                self.assertEqual(self.compiler.result_cache.evict(1 << 30), 0)
+                self.assertEqual(self.compiler.result_cache.evict(0), 2)
+                self.assertIsNone(self.compiler.get_cached_result("A2_add", ["{"]))
+            finally:
+                self.compiler.result_cache = result_cache
+                self.compiler.rebuild_cache = False
+
+    def test_compile_c_stmts(self):
+        stmts = [
+            "{ RdV = RsV + RtV; }",
+            "{ RdV = ; }",
+            "{ RdV = sextract64(RsV, 0, 8); }",
+            "{ RdV = undefined_fcn(RsV); }",
+            "{ RdV = RsV - RtV; }",
+        ]
+        expected = [
+            self.compiler.compile_c_stmt(stmts[0]),
+            UnexpectedCharacters,
+            self.compiler.compile_c_stmt(stmts[2]),
+            VisitError,
+            self.compiler.compile_c_stmt(stmts[4]),
+        ]
+        for workers in [0, 2]:
+            results = self.compiler.compile_c_stmts(iter(stmts), workers=workers)
+            self.assertEqual(len(results), len(stmts))
+            for result, exp in zip(results, expected):
+                if isinstance(exp, str):
+                    self.assertEqual(result, exp)
+                elif workers:
+                    self.assertIsInstance(result, WorkerException)
+                    self.assertEqual(result.name, exp.__name__)
+                else:
+                    self.assertIsInstance(result, exp)
+
+    def test_compile_c_stmt_lark_parity(self):
+        parser = get_lark_parser(self.compiler.parser_mode)
+        for stmt in [
+            "{ RdV = RsV---RtV; }",
+            "{ RdV = RsV - -RtV; }",
+            "{ RdV = -RsV; }",
+            "{ RdV = ~RsV; }",
+            "{ RdV = !RsV; }",
+            "{ RdV = RsV; RdV++; }",
+            "{ RdV = RsV; RdV--; }",
+            "{ for (int i = 0; i < 2; i++) { RdV = RsV; } }",
+            "{ for (int i = 2; i > 0; i--) { RdV = RsV; } }",
+        ]:
+            try:
+                expected = self.compiler.transformer.transform(parser.parse(stmt))
+            finally:
+                self.compiler.transformer.reset()
+            self.assertEqual(self.compiler.compile_c_stmt(stmt), expected, stmt)
+
+    def test_compiler_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir).joinpath("compiler.snapshot")
+            self.compiler.save_snapshot(path)
+            compiler = Compiler.from_snapshot(
+                path, ArchEnum.HEXAGON, code_format=CodeFormat.EXEC_CLASSES
+            )
+            self.assertListEqual(compiler.noped_insns, self.compiler.noped_insns)
+            self.assertSetEqual(
+                set(compiler.transformer.macros.keys()),
+                set(self.compiler.transformer.macros.keys()),
+            )
+            self.assertTrue(compiler.sub_routines["fbrev"].is_compiled())
+            for stmt in [
+                "{ RdV = RsV + RtV; }",
+                "{ RdV = sextract64(RsV, 0, 8); }",
+                "{ RdV = clz32(RsV); }",
+            ]:
+                self.assertEqual(
+                    compiler.compile_c_stmt(stmt), self.compiler.compile_c_stmt(stmt)
+                )
+
+            # Other settings or inputs.
+            with self.assertRaises(ValueError):
+                Compiler.from_snapshot(path, ArchEnum.HEXAGON)
+            with mock.patch.object(
+                Compiler, "get_config_digest", return_value="changed"
+            ):
+                with self.assertRaises(ValueError):
+                    Compiler.from_snapshot(
+                        path, ArchEnum.HEXAGON, code_format=CodeFormat.EXEC_CLASSES
+                    )
+            path.write_bytes(b"broken")
+            with self.assertRaises(ValueError):
+                Compiler.from_snapshot(
+                    path, ArchEnum.HEXAGON, code_format=CodeFormat.EXEC_CLASSES
+                )
+
+    @unittest.skipIf(
+        multiprocessing.get_start_method() != "fork", "Workers are not forked."
+    )
+    def test_compile_pool_inherits_compiler(self):
+        with self.compiler.get_compile_pool(1) as pool:
+            # Forked workers have the same address space layout as the parent.
+            self.assertEqual(pool.apply(get_worker_compiler_id), id(self.compiler))
+
+    def test_iter_compile(self):
+        names = ["J2_call", "A2_add", "F2_dfmpyfix"]
+        for jobs in [0, 2]:
+            insns = list(self.compiler.iter_compile(names, jobs=jobs, window=1))
+            # Yielded in the order of the shortcode.
+            self.assertListEqual(
+                [i.name for i in insns], ["J2_call", "A2_add", "F2_dfmpyfix"]
+            )
+            self.assertTrue(insns[2].not_implemented)
+            for insn in insns[:2]:
+                behavior = self.insn_behavior[insn.name]
+                expected = self.compiler.transform_insn(
+                    insn.name,
+                    ParsedInsn(insn.name, [self.parser.parse(behavior[0])], behavior),
+                )
+                self.assertFalse(insn.not_implemented)
+                self.assertListEqual(insn.rzil, expected.rzil)
+
+    def test_compact_tree_transform(self):
+        for name in ["J2_call", "S2_storerinew_io", "A4_cround_ri", "F2_sfadd"]:
+            tree = self.parser.parse(self.insn_behavior[name][0])
+            transformer = self.compiler.transformer
+            transformer.reset()
+            expected = transformer.transform(tree)
+            transformer.reset()
+            result = transformer.transform(CompactTree.from_tree(tree))
+            transformer.reset()
+            self.assertEqual(expected, result, name)
+
+        tree = self.parser.parse(self.insn_behavior["M4_pmpyw"][0])
+        with self.assertRaises(VisitError) as expected:
+            self.compiler.transformer.transform(tree)
+        self.compiler.transformer.reset()
+        with self.assertRaises(VisitError) as result:
+            self.compiler.transformer.transform(CompactTree.from_tree(tree))
+        self.compiler.transformer.reset()
+        self.assertEqual(expected.exception.rule, result.exception.rule)
+        self.assertEqual(expected.exception.obj, result.exception.obj)
+
+    def test_parse_shortcode_trees(self):
+        insn_behavior = {"A2_add": self.insn_behavior["A2_add"]}
+        parsed_insns = self.compiler.parsed_insns
+        try:
+            # Second round reads the trees from the parse tree cache.
+            for _ in range(2):
+                self.compiler.parse_shortcode(insn_behavior=insn_behavior)
+                asts = self.compiler.parsed_insns["A2_add"].asts
+                self.assertIsInstance(asts[0], Tree)
+                self.assertEqual(asts[0], self.parser.parse(insn_behavior["A2_add"][0]))
+        finally:
+            self.compiler.parsed_insns = parsed_insns
+
+    def test_dedup_transform(self):
+        behavior = self.insn_behavior["J2_call"][0]
+        aliases = {"J2_call": [behavior], "J2_call_alias": [f"  {behavior}\n"]}
+        self.compiler.transformed_behaviors.clear()
+        hits = self.compiler.dedup_hits
+        compiled = [
+            self.compiler.transform_insn(
+                name, ParsedInsn(name, [self.parser.parse(b[0])], b)
+            )
+            for name, b in aliases.items()
+        ]
+        self.assertEqual(self.compiler.dedup_hits, hits + 1)
+        self.assertEqual(compiled[0].name, "J2_call")
+        self.assertEqual(compiled[1].name, "J2_call_alias")
+        self.assertListEqual(compiled[0].rzil, compiled[1].rzil)
+        self.assertListEqual(compiled[0].meta, compiled[1].meta)
+        # Hybrid temporaries are numbered per instruction.
+        self.assertIn('"h_tmp0"', compiled[0].rzil[0])
+
+        # Failures are raised again for every instruction, with its own name.
+        tree = self.parser.parse(self.insn_behavior["M4_pmpyw"][0])
+        behavior = ["{ failing }"]
+        with self.assertRaises(VisitError) as first:
+            self.compiler.transform_insn("I1", ParsedInsn("I1", [tree], behavior))
+        repeated = list()
+        for name in ["I2", "I3"]:
+            with self.assertRaises(RepeatedTransformException) as e:
+                self.compiler.transform_insn(name, ParsedInsn(name, [tree], behavior))
+            repeated.append(e.exception)
+        self.assertIsNot(repeated[0], repeated[1])
+        self.assertEqual(repeated[1].insn_name, "I3")
+        self.assertIs(repeated[1].exc_type, VisitError)
+        self.assertEqual(repeated[1].message, str(first.exception))
+        self.assertEqual(get_transform_exception_bucket(repeated[1]), "VisitError")
+        self.compiler.transformed_behaviors.clear()
+
+        # The memo is dropped after a compilation of all instructions.
+        behaviors = self.compiler.preprocessor.behaviors
+        self.compiler.preprocessor.behaviors = aliases
+        hits = self.compiler.dedup_hits
+        try:
+            with mock.patch.object(self.compiler, "result_cache", None):
+                self.compiler.test_compile_all(top=0)
+        finally:
+            self.compiler.preprocessor.behaviors = behaviors
+        self.assertEqual(self.compiler.dedup_hits, hits + 1)
+        self.assertDictEqual(self.compiler.transformed_behaviors, dict())
+        self.assertIn("J2_call_alias", self.compiler.compiled_insns)
@@ -9,11 +9,13 @@ from rzilcompiler.Transformer.ValueType import (
 )
 from rzilcompiler.ArchEnum import ArchEnum
 from rzilcompiler.Compiler import Compiler
+from rzilcompiler.Tests.TempCache import TempCacheTestCase
 
 
-class TestHybrids(unittest.TestCase):
+class TestHybrids(TempCacheTestCase):
     @classmethod
     def setUpClass(cls):
+        super().setUpClass()
         cls.maxDiff = 1000
         cls.compiler = Compiler(ArchEnum.HEXAGON)
 
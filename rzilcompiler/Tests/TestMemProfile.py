@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import sys
+import tracemalloc
+import unittest
+
+from rzilcompiler.ArchEnum import ArchEnum
+from rzilcompiler.Cache import FileCache
+from rzilcompiler.Compiler import Compiler
+from rzilcompiler.MemProfile import MemoryProfile, get_deep_size, profile_memory
+from rzilcompiler.Parser import ParserMode
+from rzilcompiler.Tests.TempCache import temp_cache_dir
+
+
+class Node:
+    __slots__ = ("children",)
+
+    def __init__(self, children: list):
+        self.children = children
+
+
+class TestMemProfile(unittest.TestCase):
+    def tearDown(self):
+        tracemalloc.stop()
+
+    def test_stages(self):
+        profile = MemoryProfile(top=2)
+        kept = list()
+        with profile_memory(profile, "retain"):
+            kept.append(bytearray(1 << 20))
+        with profile_memory(profile, "release"):
+            tmp = bytearray(1 << 20)
+            del tmp
+        with profile_memory(None, "ignored"):
+            pass
+
+        retain, release = profile.stages
+        self.assertEqual(retain.name, "retain")
+        self.assertGreaterEqual(retain.retained, 1 << 20)
+        self.assertGreaterEqual(retain.peak, retain.retained)
+        self.assertLessEqual(len(retain.sites), 2)
+        self.assertTrue(retain.sites[0].traceback[0].filename.endswith(__file__))
+        self.assertLess(release.retained, 1 << 10)
+        self.assertGreaterEqual(release.peak, (1 << 20) - (1 << 10))
+
+        profile.add_insn_sizes("kept", {"I1": kept})
+        self.assertIn("kept: 1 instructions", profile.format_report())
+
+    def test_deep_size(self):
+        shared = "x" * 1000
+        node = Node([shared, shared, {"a": shared}])
+        size = get_deep_size(node)
+        # The string is counted once.
+        self.assertGreater(size, sys.getsizeof(shared))
+        self.assertLess(size, 2 * sys.getsizeof(shared))
+        self.assertEqual(get_deep_size(Node), 0)
+
+    def test_compiler_profile(self):
+        with temp_cache_dir():
+            compiler = Compiler(ArchEnum.HEXAGON, parser_mode=ParserMode.LALR)
+            compiler.preprocessor.behaviors = {
+                "A2_add": ["{ RdV=RsV+RtV; }"],
+                "A2_sub": ["{ RdV=RtV-RsV; }"],
+            }
+            profile = MemoryProfile()
+            compiler.profile_memory(profile)
+            trees = FileCache("parse_trees").dir
+            # The parse trees are not cached.
+            self.assertListEqual(list(trees.glob("*/*")), [])
+        self.assertListEqual(
+            [s.name for s in profile.stages], ["parse_shortcode", "transform"]
+        )
+        self.assertIn("A2_add", compiler.compiled_insns)
+
+
+if __name__ == "__main__":
+    TestMemProfile().main()
@@ -2,15 +2,40 @@
 # SPDX-FileCopyrightText: 2022 Rot127 <rot127@posteo.com>
 # SPDX-License-Identifier: LGPL-3.0-only
 
+import csv
+import json
+import os
+import pickle
 import re
+import tempfile
 import unittest
+from unittest import mock
 
-from lark import Lark
+from lark import Lark, Tree
+from lark.parsers import earley, earley_common
 
-from rzilcompiler.ArchEnum import ArchEnum
-from rzilcompiler.Parser import Parser, ParserException
+import rzilcompiler.Parser
+from rzilcompiler.Parser import (
+    Parser,
+    ParserException,
+    ParserMode,
+    get_grammar,
+    get_lark_parser,
+    get_parser_cache_file,
+    group_by_behavior,
+    init_worker,
+    lark_parsers,
+    load_lark_parser,
+    normalize_behavior,
+    save_lark_parser,
+    write_parse_report,
+)
+from rzilcompiler.CompactTree import CompactTree
 from rzilcompiler.Configuration import Conf, InputFile
+from rzilcompiler.FastPath import parse_fast
+from rzilcompiler.RuleProfile import ProfiledItem, profile_rules
 from rzilcompiler.Preprocessor.Hexagon.PreprocessorHexagon import PreprocessorHexagon
+from rzilcompiler.Tests.TempCache import TempCacheTestCase, temp_cache_dir
 
 
 def get_hexagon_insn_behavior() -> dict[str:tuple]:
@@ -33,18 +58,16 @@ def get_hexagon_insn_behavior() -> dict[str:tuple]:
 
 
 def get_hexagon_parser() -> Lark:
-    # Setup parser
-    with open(Conf.get_path(InputFile.GRAMMAR, ArchEnum.HEXAGON)) as f:
-        grammar = "".join(f.readlines())
-    return Lark(grammar, start="fbody", parser="earley")
+    return get_lark_parser(ParserMode.EARLEY)
 
 
-class TestParser(unittest.TestCase):
+class TestParser(TempCacheTestCase):
     debug = False
     insn_behavior: dict[str:tuple] = dict()
 
     @classmethod
     def setUpClass(cls):
+        super().setUpClass()
         cls.insn_behavior = get_hexagon_insn_behavior()
 
     def test_threading_exception(self):
@@ -54,6 +77,323 @@ class TestParser(unittest.TestCase):
         exc = Parser.parse(shortcodes)
         self.assertTrue(isinstance(exc["faulty_input"].exception, ParserException))
 
+    def test_parse_pool(self):
+        shortcodes = {
+            "A2_add": self.insn_behavior["A2_add"],
+            "A2_sub": self.insn_behavior["A2_sub"],
+        }
+        parser = get_hexagon_parser()
+        res = Parser.parse(shortcodes)
+        self.assertListEqual(list(res.keys()), ["A2_add", "A2_sub"])
+        for name, behaviors in shortcodes.items():
+            self.assertIsNone(res[name].exception)
+            self.assertEqual(res[name].asts, [parser.parse(b) for b in behaviors])
+
+    def test_lalr_parse_trees(self):
+        # Instructions with registers, register pairs, immediates, .new registers,
+        # register aliases, C types, floats and memory accesses.
+        insns = [
+            "A2_add",
+            "A2_addp",
+            "A2_addi",
+            "A2_tfrcrr",
+            "A4_ext",
+            "C2_cmpeqp",
+            "F2_sfadd",
+            "F2_conv_df2sf",
+            "J2_jumptnew",
+            "L2_loadrub_io",
+            "S2_storerinew_io",
+            "S2_asl_r_r_sat",
+            "SA1_addi",
+        ]
+        shortcodes = {name: self.insn_behavior[name] for name in insns}
+        # Without the fast path. Otherwise trivial behaviors wouldn't be parsed by Lark.
+        earley = Parser(ParserMode.EARLEY, fast_path=False).parse(shortcodes)
+        lalr = Parser(ParserMode.LALR, fast_path=False).parse(shortcodes)
+        for name in insns:
+            self.assertIsNone(lalr[name].exception, name)
+            self.assertEqual(earley[name].asts, lalr[name].asts, name)
+
+    def test_lalr_conformance_report(self):
+        shortcodes = {
+            "A2_add": self.insn_behavior["A2_add"],
+            "S2_parityp": self.insn_behavior["S2_parityp"],
+            "faulty_input": ["{"],
+        }
+        report = Parser.check_conformance(shortcodes)
+        self.assertListEqual(report.insns["equal"], ["A2_add"])
+        self.assertListEqual(report.insns["differ"], ["S2_parityp"])
+        self.assertListEqual(report.insns["both_failed"], ["faulty_input"])
+        self.assertFalse(report.conforms())
+
+    def test_fast_path(self):
+        parser = get_lark_parser(ParserMode.EARLEY)
+        for behavior in [
+            "{ RdV=RsV+RtV; }",
+            "{ RddV = RssV; ; P0 = 0xffLL; }",
+            "{ RxV = (P0 && !PuN) ? -RsV : ~(uiV << 2) * 3; }",
+            "{ RdV = a | b ^ c & d == e != f < g >= h >> i - j / k % l || m; }",
+            "{}",
+        ]:
+            self.assertEqual(parse_fast(behavior), parser.parse(behavior), behavior)
+        for behavior in [
+            "{ RdV = (int32_t) RsV; }",
+            "{ RdV = fabs(RsV); }",
+            "{ if (P0) RdV = 0; }",
+            "{ RdV = RsV + ; }",
+            "{ RdV = RsV; } ;",
+        ]:
+            self.assertIsNone(parse_fast(behavior), behavior)
+        # Increment, decrement and member access are left to Lark.
+        # "--" must not be read as two unary minus.
+        for mode in ParserMode:
+            lark_parser = get_lark_parser(mode)
+            for behavior in [
+                "{ RdV = RsV---RtV; }",
+                "{ RdV = --RsV; }",
+                "{ RdV = ++RsV; }",
+                "{ RdV = RsV+++RtV; }",
+                "{ RdV = RsV--; }",
+                "{ RdV = a->b; }",
+            ]:
+                self.assertIsNone(parse_fast(behavior), behavior)
+                parsed = Parser(mode, use_cache=False).parse_insn("I", [behavior])
+                self.assertEqual(
+                    parsed.asts, [lark_parser.parse(behavior)], (mode, behavior)
+                )
+        # Separated minus are two unary operators for Lark as well.
+        behavior = "{ RdV = RsV - -RtV; }"
+        self.assertEqual(parse_fast(behavior), parser.parse(behavior))
+        # Earley resolves this one differently. So only LALR uses the fast path by default.
+        behavior = "{ RdV = RsV==1&~RtV; }"
+        self.assertNotEqual(parse_fast(behavior), parser.parse(behavior))
+        self.assertEqual(
+            parse_fast(behavior), get_lark_parser(ParserMode.LALR).parse(behavior)
+        )
+        self.assertFalse(Parser(ParserMode.EARLEY, use_cache=False).fast_path)
+        self.assertFalse(
+            Parser(ParserMode.EARLEY, use_cache=False)
+            .parse_insn("I", [behavior])
+            .fast_path_hits
+        )
+        report = Parser.check_fast_path({"I": [behavior]}, ParserMode.EARLEY)
+        self.assertFalse(report.conforms())
+
+        shortcodes = {
+            "A2_add": self.insn_behavior["A2_add"],
+            "A2_addsat": self.insn_behavior["A2_addsat"],
+            "faulty_input": ["{"],
+        }
+        parser = Parser(ParserMode.LALR, use_cache=False)
+        self.assertTrue(parser.fast_path)
+        res = parser.parse(shortcodes)
+        self.assertEqual(res["A2_add"].fast_path_hits, 1)
+        self.assertEqual(res["A2_addsat"].fast_path_hits, 0)
+        self.assertIsNotNone(res["faulty_input"].exception)
+        self.assertEqual(parser.fast_path_hits, 1)
+        self.assertAlmostEqual(parser.get_fast_path_hit_rate(), 1 / 3)
+        lark_only = Parser(ParserMode.LALR, use_cache=False, fast_path=False).parse(
+            shortcodes
+        )
+        for name in shortcodes:
+            self.assertEqual(res[name].asts, lark_only[name].asts)
+
+        report = Parser.check_fast_path(shortcodes)
+        self.assertEqual(report.counts["equal"], 1)
+        self.assertEqual(report.counts["fallback"], 2)
+        self.assertAlmostEqual(report.get_hit_rate(), 1 / 3)
+        self.assertTrue(report.conforms())
+
+    def test_lalr_reg_normalization(self):
+        parser = get_lark_parser(ParserMode.LALR)
+        tree = parser.parse("{ RddV = RssV + HEX_REG_ALIAS_PC_NEW + uiV + P0; }")
+        regs = {(t.children[0].type, t.children[1].type) for t in tree.find_data("reg")}
+        self.assertSetEqual(
+            regs, {("REG_TYPE", "DEST_REG_PAIR"), ("REG_TYPE", "SRC_REG_PAIR")}
+        )
+        alias = next(tree.find_data("reg_alias")).children
+        self.assertEqual(alias[0], "PC")
+        self.assertEqual(alias[1].data, "reg_alias_new_postfix")
+        self.assertEqual(next(tree.find_data("imm")).children[0].type, "IMMEDIATE")
+        self.assertEqual(
+            next(tree.find_data("explicit_reg")).children[0].type, "EXPLICIT_REG"
+        )
+
+    def test_parser_cache(self):
+        grammar = get_grammar(ParserMode.LALR)
+        cache_file = get_parser_cache_file(grammar, ParserMode.LALR)
+        # Not named like the temporary files of interrupted cache writes.
+        self.assertEqual(cache_file.suffix, ".lark")
+        self.assertEqual(cache_file, get_parser_cache_file(grammar, ParserMode.LALR))
+        self.assertNotEqual(
+            cache_file, get_parser_cache_file(grammar + "\n", ParserMode.LALR)
+        )
+        # Built by another test with another cache directory.
+        lark_parsers.pop(ParserMode.LALR, None)
+        parser = get_lark_parser(ParserMode.LALR)
+        self.assertTrue(cache_file.exists())
+        self.assertIs(parser, get_lark_parser(ParserMode.LALR))
+
+    def test_save_lark_parser(self):
+        self.assertIsNone(save_lark_parser(ParserMode.EARLEY))
+        behavior = self.insn_behavior["S2_storerinew_io"][0]
+        expected = get_lark_parser(ParserMode.LALR).parse(behavior)
+        loaded = load_lark_parser(ParserMode.LALR, save_lark_parser(ParserMode.LALR))
+        self.assertIs(loaded, get_lark_parser(ParserMode.LALR))
+        self.assertEqual(loaded.parse(behavior), expected)
+
+    def test_parse_tree_cache(self):
+        shortcodes = {
+            "A2_add": self.insn_behavior["A2_add"],
+            "faulty_input": ["{"],
+        }
+        with temp_cache_dir():
+            parser = Parser(ParserMode.LALR)
+            self.assertIsNone(parser.get_cached("A2_add", shortcodes["A2_add"]))
+            res = parser.parse(shortcodes)
+            cached = parser.get_cached("A2_add", shortcodes["A2_add"])
+            self.assertEqual(res["A2_add"].asts, cached.asts)
+            self.assertEqual(
+                parser.get_cached("faulty_input", ["{"]).exception.name,
+                res["faulty_input"].exception.name,
+            )
+
+            # Hits are not parsed again.
+            key = parser.get_cache_key(shortcodes["A2_add"][0])
+            parser.tree_cache.put(key, Tree("dummy", []))
+            res = parser.parse(shortcodes)
+            self.assertEqual(res["A2_add"].asts, [Tree("dummy", [])])
+            self.assertIsNone(Parser(use_cache=False).tree_cache)
+
+    def test_normalize_behavior(self):
+        self.assertEqual(normalize_behavior(" {  a =\tb;\n} "), "{ a = b; }")
+        self.assertEqual(normalize_behavior('{ f("a  b"); }'), '{ f("a  b"); }')
+
+    def test_parse_dedup(self):
+        shortcodes = {
+            "A2_add": self.insn_behavior["A2_add"],
+            "A2_sub": self.insn_behavior["A2_sub"],
+            "A2_add_alias": [f"  {b}\n" for b in self.insn_behavior["A2_add"]],
+        }
+        groups = group_by_behavior(shortcodes)
+        self.assertListEqual(
+            list(groups.values()), [["A2_add", "A2_add_alias"], ["A2_sub"]]
+        )
+        res = Parser(use_cache=False).parse(shortcodes)
+        self.assertListEqual(list(res.keys()), ["A2_add", "A2_sub", "A2_add_alias"])
+        self.assertEqual(res["A2_add_alias"].name, "A2_add_alias")
+        self.assertEqual(res["A2_add_alias"].behaviors, shortcodes["A2_add_alias"])
+        self.assertEqual(res["A2_add_alias"].asts, res["A2_add"].asts)
+
+    def test_compact_tree(self):
+        parser = get_hexagon_parser()
+        for name in ["A2_add", "J2_jumptnew", "S2_asl_r_r_sat", "SA1_addi"]:
+            tree = parser.parse(self.insn_behavior[name][0])
+            compact = CompactTree.from_tree(tree)
+            self.assertEqual(compact.to_tree(), tree)
+            self.assertEqual(pickle.loads(pickle.dumps(compact)).to_tree(), tree)
+            self.assertEqual(compact.pretty(), tree.pretty())
+        # None children of optional rules
+        tree = get_lark_parser(ParserMode.LALR).parse("{ HEX_REG_ALIAS_PC = 0; }")
+        self.assertEqual(CompactTree.from_tree(tree).to_tree(), tree)
+
+    def test_parse_compact(self):
+        shortcodes = {"A2_add": self.insn_behavior["A2_add"]}
+        trees = Parser(use_cache=False).parse(shortcodes)["A2_add"].asts
+        self.assertIsInstance(trees[0], Tree)
+        for use_cache in [False, True]:
+            res = Parser(use_cache=use_cache, compact=True).parse(shortcodes)
+            self.assertIsInstance(res["A2_add"].asts[0], CompactTree)
+            self.assertEqual([t.to_tree() for t in res["A2_add"].asts], trees)
+
+    def test_parse_instrumentation(self):
+        shortcodes = {
+            "A2_add": self.insn_behavior["A2_add"],
+            "F2_dfmpyfix": self.insn_behavior["F2_dfmpyfix"],
+        }
+        res = Parser(instrument=True).parse(shortcodes)
+        stats = res["A2_add"].stats
+        self.assertGreater(stats.parse_time, 0)
+        self.assertEqual(stats.length, len(self.insn_behavior["A2_add"][0]))
+        self.assertGreater(stats.tokens, 0)
+        self.assertGreaterEqual(stats.ambiguities, 1)
+        self.assertIn("identifier|op", stats.ambiguous_rules)
+        # Failed parses are still timed.
+        self.assertIsNotNone(res["F2_dfmpyfix"].exception)
+        self.assertGreater(res["F2_dfmpyfix"].stats.parse_time, 0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            write_parse_report(res, os.path.join(tmp, "report.csv"))
+            with open(os.path.join(tmp, "report.csv")) as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual(len(rows), 2)
+            self.assertEqual({r["name"] for r in rows}, set(shortcodes))
+
+            write_parse_report(res, os.path.join(tmp, "report.json"))
+            with open(os.path.join(tmp, "report.json")) as f:
+                report = json.load(f)
+            self.assertEqual(len(report["instructions"]), 2)
+            self.assertEqual(report["parser"], "earley")
+            self.assertIn("identifier|op", report["ambiguous_rules"])
+
+            # The LALR parser has no ambiguities. They are labeled as Earley ones.
+            path = os.path.join(tmp, "report_lalr.csv")
+            write_parse_report(res, path, ParserMode.LALR)
+            with open(path) as f:
+                rows = list(csv.DictReader(f))
+            self.assertIn("earley_ambiguities", rows[0])
+            self.assertNotIn("ambiguities", rows[0])
+            path = os.path.join(tmp, "report_lalr.json")
+            write_parse_report(res, path, ParserMode.LALR)
+            with open(path) as f:
+                report = json.load(f)
+            self.assertEqual(report["parser"], "lalr")
+            self.assertIn("identifier|op", report["earley_ambiguous_rules"])
+            self.assertIn("earley_ambiguities", report["instructions"][0])
+
+            with self.assertRaises(ValueError):
+                write_parse_report(res, os.path.join(tmp, "report.txt"))
+
+    def test_init_instrumented_worker(self):
+        with mock.patch("rzilcompiler.Parser.ambiguity_parser", None):
+            init_worker(ParserMode.LALR)
+            self.assertIsNone(rzilcompiler.Parser.ambiguity_parser)
+            init_worker(ParserMode.LALR, instrument=True)
+            self.assertIsNotNone(rzilcompiler.Parser.ambiguity_parser)
+
+    def test_rule_profile(self):
+        shortcodes = {
+            "A2_add": self.insn_behavior["A2_add"],
+            "J2_call": self.insn_behavior["J2_call"],
+        }
+        parser = Parser(profile=True)
+        res = parser.parse(shortcodes)
+        self.assertIs(earley_common.Item, earley.Item)
+        self.assertNotEqual(earley_common.Item, ProfiledItem)
+        # Profiling doesn't change the trees.
+        unprofiled = Parser(use_cache=False).parse(shortcodes)
+        for name in shortcodes:
+            self.assertEqual(res[name].asts, unprofiled[name].asts)
+
+        profile = parser.rule_profile
+        self.assertEqual(profile.parses, 2)
+        self.assertGreaterEqual(profile.rules["additive_expr"].completions, 1)
+        for stats in profile.rules.values():
+            self.assertGreaterEqual(stats.items, stats.completions)
+        self.assertLessEqual(
+            sum(s.time for s in profile.rules.values()) + profile.tree_time,
+            profile.parse_time + 1e-6,
+        )
+        ranked = profile.get_ranked()
+        self.assertGreaterEqual(ranked[0][1].time, ranked[-1][1].time)
+        table = profile.format_table(5).splitlines()
+        self.assertEqual(len(table), 7)
+        self.assertTrue(table[1].startswith(ranked[0][0]))
+
+        with profile_rules(None):
+            self.assertNotEqual(earley_common.Item, ProfiledItem)
+
 
 if __name__ == "__main__":
     TestParser().main()
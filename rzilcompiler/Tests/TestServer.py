@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from rzilcompiler.ArchEnum import ArchEnum
+from rzilcompiler.Compiler import Compiler, compile_insn_with
+from rzilcompiler.Parser import Parser, ParserMode
+from rzilcompiler.Preprocessor.Hexagon.PreprocessorHexagon import PreprocessorHexagon
+from rzilcompiler.Server import CompileServer, request
+from rzilcompiler.Tests.TempCache import TempCacheTestCase
+
+
+def get_lalr_compiler() -> Compiler:
+    return Compiler(ArchEnum.HEXAGON, parser_mode=ParserMode.LALR, use_cache=False)
+
+
+class TestServer(TempCacheTestCase):
+    def run_server(self, jobs: int) -> None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir).joinpath("rzil.sock")
+            server = CompileServer(path, get_lalr_compiler, jobs)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                self.check_requests(server, path)
+            finally:
+                server.shutdown()
+                thread.join()
+                server.server_close()
+            self.assertFalse(path.exists())
+
+    def check_requests(self, server: CompileServer, path: Path) -> None:
+        instructions = len(server.behaviors)
+        self.assertGreater(instructions, 0)
+        self.assertEqual(request(path, "ping")["instructions"], instructions)
+
+        expected = compile_insn_with(
+            server.compiler,
+            Parser(ParserMode.LALR, compact=True),
+            "A2_add",
+            server.behaviors["A2_add"],
+            keep=False,
+        )
+        result = request(path, "compile_insn", name="A2_add")
+        self.assertIsNone(result["exception"])
+        self.assertEqual(result["rzil"], expected.rzil)
+        self.assertEqual(
+            request(path, "get_meta", name="A2_add")["meta"], expected.meta
+        )
+
+        rzil = request(path, "compile_stmt", code="{ RdV = RsV + RtV; }")["rzil"]
+        self.assertEqual(rzil, server.compiler.compile_c_stmt("{ RdV = RsV + RtV; }"))
+
+        with self.assertRaisesRegex(RuntimeError, "RequestError: Instruction"):
+            request(path, "compile_insn", name="not_an_insn")
+        with self.assertRaisesRegex(RuntimeError, "RequestError: Unknown method"):
+            request(path, "not_a_method")
+        with self.assertRaisesRegex(RuntimeError, "TypeError"):
+            request(path, "compile_insn", insn="A2_add")
+
+        self.assertEqual(request(path, "reload")["instructions"], instructions)
+        result = request(path, "compile_insn", name="A2_add")
+        self.assertEqual(result["rzil"], expected.rzil)
+
+        # Instructions removed from the resources are gone after a reload.
+        insns = [
+            i for i in PreprocessorHexagon.iter_insn_behavior() if i[0] != "A2_add"
+        ]
+        with mock.patch.object(
+            PreprocessorHexagon, "iter_insn_behavior", return_value=iter(insns)
+        ):
+            self.assertEqual(request(path, "reload")["instructions"], instructions - 1)
+        with self.assertRaisesRegex(RuntimeError, "Instruction A2_add not found"):
+            request(path, "compile_insn", name="A2_add")
+        self.assertEqual(request(path, "reload")["instructions"], instructions)
+
+    def test_server(self):
+        self.run_server(jobs=0)
+
+    def test_server_workers(self):
+        with mock.patch.object(
+            Compiler, "get_compile_pool", autospec=True, wraps=Compiler.get_compile_pool
+        ) as pool_mock:
+            self.run_server(jobs=1)
+        # Initial load and the reloads. The handler threads must not be forked.
+        self.assertGreater(pool_mock.call_count, 1)
+        for call in pool_mock.call_args_list:
+            self.assertEqual(call.kwargs["start_method"], "spawn")
+
+
+if __name__ == "__main__":
+    TestServer().main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import multiprocessing
+import pstats
+import tempfile
+import unittest
+from multiprocessing import Pool
+from pathlib import Path
+
+import rzilcompiler.StageProfile as StageProfile
+from rzilcompiler.StageProfile import (
+    TaskStats,
+    add_task_stats,
+    get_collapsed_stacks,
+    get_final_stats,
+    merge_stats,
+    profile_stage,
+    profile_task,
+    profiling,
+)
+
+
+def busy_outer() -> int:
+    return busy_inner() + busy_inner()
+
+
+def busy_inner() -> int:
+    return sum(i * i for i in range(20000))
+
+
+def profiled_task(i: int) -> list[TaskStats]:
+    with profile_task() as stats:
+        busy_inner()
+    return stats
+
+
+def get_funcs(path: Path) -> set[str]:
+    return {func[2] for func in pstats.Stats(str(path)).stats.keys()}
+
+
+class TestStageProfile(unittest.TestCase):
+    def test_disabled(self):
+        with profile_stage("a"):
+            with profile_task() as stats:
+                busy_inner()
+        self.assertEqual(stats, [])
+
+    def test_stages(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_dir = Path(tmp_dir)
+            with profiling(out_dir):
+                with profile_stage("outer"):
+                    busy_outer()
+                    with profile_stage("inner"):
+                        busy_inner()
+                    # Tasks of this process are part of the stage itself.
+                    with profile_task() as stats:
+                        busy_inner()
+                    self.assertEqual(stats, [])
+            self.assertIsNone(StageProfile.profiler)
+
+            outer = get_funcs(out_dir.joinpath("outer.pstats"))
+            inner = get_funcs(out_dir.joinpath("inner.pstats"))
+            self.assertIn("busy_outer", outer)
+            self.assertIn("busy_inner", inner)
+            self.assertNotIn("busy_outer", inner)
+            with open(out_dir.joinpath("outer.collapsed")) as f:
+                stacks = f.read().splitlines()
+        self.assertTrue(any("busy_outer" in s and "busy_inner" in s for s in stacks))
+        self.assertTrue(all(int(s.rsplit(" ", 1)[1]) > 0 for s in stacks))
+
+    def test_merge_stats(self):
+        a = ("a.py", 1, "a")
+        b = ("b.py", 2, "b")
+        merged = dict()
+        merge_stats(
+            merged,
+            {a: (1, 1, 0.5, 2.0, {}), b: (2, 2, 0.5, 0.5, {a: (2, 2, 0.5, 0.5)})},
+        )
+        merge_stats(merged, {b: (1, 1, 1.0, 1.0, {a: (1, 1, 1.0, 1.0)})})
+        final = get_final_stats(merged)
+        self.assertEqual(final[b], (3, 3, 1.5, 1.5, {a: (3, 3, 1.5, 1.5)}))
+
+        stacks = get_collapsed_stacks(pstats.Stats(TaskStats(final)))
+        self.assertEqual(
+            stacks, {"a (a.py:1)": 500000, "a (a.py:1);b (b.py:2)": 1500000}
+        )
+
+    @unittest.skipIf(
+        multiprocessing.get_start_method() != "fork", "Workers are not forked."
+    )
+    def test_workers(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_dir = Path(tmp_dir)
+            with profiling(out_dir):
+                with profile_stage("pool"):
+                    with Pool(2) as pool:
+                        for stats in pool.imap(profiled_task, range(4)):
+                            self.assertEqual(len(stats), 1)
+                            add_task_stats(stats)
+            stats = pstats.Stats(str(out_dir.joinpath("pool.pstats")))
+        calls = [s[1] for f, s in stats.stats.items() if f[2] == "busy_inner"]
+        self.assertEqual(calls, [4])
+
+
+if __name__ == "__main__":
+    TestStageProfile().main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import json
+import multiprocessing
+import os
+import tempfile
+import unittest
+from multiprocessing import Pool
+from pathlib import Path
+
+import rzilcompiler.Trace as Trace
+from rzilcompiler.Trace import (
+    NO_SPAN,
+    add_events,
+    collect_events,
+    span,
+    tracing,
+)
+
+
+def traced_task(i: int) -> list[dict]:
+    with collect_events() as events:
+        with span("task", "test", i=i):
+            pass
+    return events
+
+
+class TestTrace(unittest.TestCase):
+    def tearDown(self):
+        Trace.stop_tracing()
+
+    def test_disabled(self):
+        self.assertIs(span("a"), NO_SPAN)
+        with collect_events() as events:
+            with span("a"):
+                pass
+        self.assertEqual(events, [])
+
+    def test_spans(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir).joinpath("trace.json")
+            with tracing(path):
+                with span("outer", insn="A2_add"):
+                    with span("inner", "transformer"):
+                        pass
+                with collect_events() as events:
+                    with span("collected"):
+                        pass
+                self.assertEqual(
+                    [e["name"] for e in Trace.tracer.events], ["inner", "outer"]
+                )
+                add_events(events)
+            self.assertIsNone(Trace.tracer)
+            with open(path) as f:
+                trace = json.load(f)
+
+        meta, inner, outer, collected = trace["traceEvents"]
+        self.assertEqual(meta["ph"], "M")
+        self.assertEqual(meta["args"]["name"], "rzilcompiler")
+        self.assertEqual(outer["args"], {"insn": "A2_add"})
+        self.assertEqual(inner["cat"], "transformer")
+        self.assertEqual(collected["name"], "collected")
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(
+            outer["ts"] + outer["dur"], inner["ts"] + inner["dur"]
+        )
+
+    @unittest.skipIf(
+        multiprocessing.get_start_method() != "fork", "Workers are not forked."
+    )
+    def test_workers(self):
+        tracer = Trace.start_tracing()
+        with Pool(2) as pool:
+            for events in pool.imap(traced_task, range(4)):
+                add_events(events)
+        self.assertEqual(sorted(e["args"]["i"] for e in tracer.events), [0, 1, 2, 3])
+        self.assertNotIn(os.getpid(), {e["pid"] for e in tracer.events})
+        names = [m["args"]["name"] for m in tracer.get_metadata()]
+        self.assertIn("rzilcompiler", names)
+        self.assertTrue(any(n.startswith("worker ") for n in names))
+
+
+if __name__ == "__main__":
+    TestTrace().main()
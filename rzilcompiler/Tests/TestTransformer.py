@@ -7,6 +7,7 @@ import unittest
 from time import sleep
 
 from rzilcompiler.Compiler import RZILInstruction, Compiler
+from rzilcompiler.Parser import ParserMode, get_lark_parser
 from rzilcompiler.Transformer.Hybrids.SubRoutine import SubRoutine, SubRoutineInitType
 from rzilcompiler.Transformer.Pures.Parameter import get_parameter_by_decl, Parameter
 from rzilcompiler.Transformer.ValueType import (
@@ -21,6 +22,7 @@ from rzilcompiler.Configuration import Conf, InputFile
 from rzilcompiler.Preprocessor.Hexagon.PreprocessorHexagon import PreprocessorHexagon
 from rzilcompiler.Transformer.RZILTransformer import RZILTransformer, CodeFormat
 from rzilcompiler.ArchEnum import ArchEnum
+from rzilcompiler.Tests.TempCache import TempCacheTestCase
 
 from lark import Lark, logger
 from lark.exceptions import (
@@ -51,10 +53,7 @@ def get_hexagon_insn_behavior() -> dict[str:tuple]:
 
 
 def get_hexagon_parser() -> Lark:
-    # Setup parser
-    with open(Conf.get_path(InputFile.GRAMMAR, ArchEnum.HEXAGON)) as f:
-        grammar = "".join(f.readlines())
-    return Lark(grammar, start="fbody", parser="earley")
+    return get_lark_parser(ParserMode.EARLEY)
 
 
 class TestTransformedInstr(unittest.TestCase):
@@ -120,12 +119,13 @@ class TestTransformedInstr(unittest.TestCase):
         self.assertFalse(instr["needs_pkt"][3])
 
 
-class TestTransforming(unittest.TestCase):
+class TestTransforming(TempCacheTestCase):
     debug = False
     insn_behavior: dict[str:tuple] = dict()
 
     @classmethod
     def setUpClass(cls):
+        super().setUpClass()
         cls.maxDiff = 1300
         cls.insn_behavior = get_hexagon_insn_behavior()
         cls.parser = get_hexagon_parser()
@@ -542,11 +542,12 @@ class TestTransforming(unittest.TestCase):
         )
 
 
-class TestStmtEmitting(unittest.TestCase):
+class TestStmtEmitting(TempCacheTestCase):
     insn_behavior: dict[str:tuple] = dict()
 
     @classmethod
     def setUpClass(cls):
+        super().setUpClass()
         cls.maxDiff = 2500
         cls.insn_behavior = get_hexagon_insn_behavior()
         cls.parser = get_hexagon_parser()
@@ -778,12 +779,13 @@ class TestStmtEmitting(unittest.TestCase):
         )
 
 
-class TestTransformerMeta(unittest.TestCase):
+class TestTransformerMeta(TempCacheTestCase):
     debug = False
     insn_behavior: dict[str:tuple] = dict()
 
     @classmethod
     def setUpClass(cls):
+        super().setUpClass()
         cls.insn_behavior = get_hexagon_insn_behavior()
         cls.parser = get_hexagon_parser()
         cls.compiler = Compiler(ArchEnum.HEXAGON)
@@ -899,12 +901,13 @@ class TestTransformerMeta(unittest.TestCase):
         self.assertListEqual(meta, ["HEX_IL_INSN_ATTR_NONE"])
 
 
-class TestTransformerOutput(unittest.TestCase):
+class TestTransformerOutput(TempCacheTestCase):
     debug = False
     insn_behavior: dict[str:tuple] = dict()
 
     @classmethod
     def setUpClass(cls):
+        super().setUpClass()
         cls.insn_behavior = get_hexagon_insn_behavior()
         cls.parser = get_hexagon_parser()
         cls.compiler = Compiler(ArchEnum.HEXAGON, code_format=CodeFormat.EXEC_CLASSES)
@@ -1080,6 +1083,42 @@ class TestTransformerOutput(unittest.TestCase):
             result,
         )
 
+    def test_lazy_sub_routine(self):
+        name = "sextract64_sub_routine"
+        parameters = ["uint64_t value", "int start", "int length"]
+        code = (
+            "{ return ((int32_t)(value << (32 - length - start))) >> (32 - length); }"
+        )
+        eager = self.compiler.compile_sub_routine(name, "int64_t", parameters, code)
+        lazy = self.compiler.compile_sub_routine(
+            name, "int64_t", parameters, code, lazy=True
+        )
+        self.assertTrue(eager.is_compiled())
+        self.assertFalse(lazy.is_compiled())
+
+        # Calls only need the signature.
+        ast_body = self.parser.parse("{ RdV = sextract64_sub_routine(0, 0, 0); }")
+        results = list()
+        for sub_routine in [eager, lazy]:
+            transformer = RZILTransformer(
+                ArchEnum.HEXAGON,
+                sub_routines={name: sub_routine},
+                code_format=CodeFormat.EXEC_CLASSES,
+            )
+            results.append(transformer.transform(ast_body))
+        self.assertEqual(results[0], results[1])
+        self.assertFalse(lazy.is_compiled())
+
+        self.assertEqual(lazy.body, eager.body)
+        self.assertTrue(lazy.is_compiled())
+        self.assertEqual(
+            lazy.il_init(SubRoutineInitType.DEF), eager.il_init(SubRoutineInitType.DEF)
+        )
+
+        self.compiler.compile_sub_routines()
+        for sub_routine in self.compiler.sub_routines.values():
+            self.assertTrue(sub_routine.is_compiled(), sub_routine.routine_name)
+
     def test_sub_routines(self):
         ret_val = get_value_type_by_c_type("uint64_t")
         params = [
@@ -1855,10 +1894,9 @@ class TestGrammar(unittest.TestCase):
             exc = e
         self.assertIsNone(exc)
 
-    @unittest.skip("LALR test: Grammar not yet LALR compatible.")
     def test_lalr_compatibility(self):
         # Setup parser
-        with open(Conf.get_path(InputFile.GRAMMAR, ArchEnum.HEXAGON)) as f:
+        with open(Conf.get_path(InputFile.GRAMMAR_LALR, ArchEnum.HEXAGON)) as f:
             grammar = "".join(f.readlines())
         exc = None
         logger.setLevel(logging.DEBUG)
@@ -1892,6 +1930,14 @@ class TestGrammar(unittest.TestCase):
         ).transform(ast)
         self.assertNotIn("&", result)
 
+    def test_gcc_extensions_lalr(self):
+        behavior = (
+            "{ uint32_t a = (0 == 0) ? 1 : ({" "   int32_t x = 1;" "   5; " "}); " "}"
+        )
+        earley = get_lark_parser(ParserMode.EARLEY).parse(behavior)
+        lalr = get_lark_parser(ParserMode.LALR).parse(behavior)
+        self.assertEqual(earley, lalr)
+
 
 if __name__ == "__main__":
     TestTransforming().main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from rzilcompiler.Parser import ParserMode
+from rzilcompiler.Watch import (
+    ResourceWatcher,
+    Stage,
+    format_delta,
+    get_changed_entries,
+    get_dependent_insns,
+    get_dependent_sub_routines,
+    get_watched_resources,
+)
+
+
+class TestWatch(unittest.TestCase):
+    def test_resource_watcher(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            a = Path(tmp_dir).joinpath("a.json")
+            b = Path(tmp_dir).joinpath("b.h")
+            a.write_text("{}")
+            watcher = ResourceWatcher([a, b])
+            self.assertEqual(watcher.poll(), set())
+
+            b.write_text("#define A 1")
+            self.assertEqual(watcher.poll(), {b})
+            self.assertEqual(watcher.poll(), set())
+
+            # Same size, but a new modification time.
+            a.write_text("[]")
+            stat = a.stat()
+            os.utime(a, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+            b.unlink()
+            self.assertEqual(watcher.poll(), {a, b})
+
+    def test_watched_resources(self):
+        resources = get_watched_resources(ParserMode.LALR)
+        self.assertIn(Stage.PREPROCESSOR, resources.values())
+        parser = [p.name for p, s in resources.items() if s == Stage.PARSER]
+        self.assertEqual(parser, ["grammar_lalr.lark"])
+        # Written by the preprocessor itself.
+        self.assertNotIn("shortcode_resolved.h", [p.name for p in resources])
+
+    def test_dependents(self):
+        old = {"a": {"code": "{ x = 1; }"}, "b": {"code": "{ a(); }"}}
+        new = {
+            "a": {"code": "{ x = 2; }"},
+            "b": {"code": "{ a(); }"},
+            "c": {"code": "{ b(); }"},
+        }
+        self.assertEqual(get_changed_entries(old, new), {"a", "c"})
+        self.assertEqual(get_changed_entries(new, old), {"a", "c"})
+        self.assertEqual(get_dependent_sub_routines({"a"}, new), {"a", "b", "c"})
+        self.assertEqual(get_dependent_sub_routines({"c"}, new), {"c"})
+        self.assertEqual(get_dependent_sub_routines(set(), new), set())
+
+        behaviors = {
+            "I1": ["{ RdV = b(RsV); }"],
+            "I2": ["{ RdV = ab(RsV); }"],
+            "I3": ["{ RdV = 1; }", "{ c(RdV); }"],
+        }
+        self.assertEqual(get_dependent_insns({"b", "c"}, behaviors), {"I1", "I3"})
+        self.assertEqual(get_dependent_insns(set(), behaviors), set())
+
+    def test_format_delta(self):
+        previous = {"I1": "Successful", "I2": "VisitError", "I3": "VisitError"}
+        previous.update({"I4": "Successful", "I5": "Successful"})
+        current = {"I1": "Successful", "I2": "Successful", "I3": "UnexpectedToken"}
+        current.update({"I4": "VisitError", "I6": "Successful"})
+        lines = format_delta(
+            previous, current, {"r": "Successful"}, {"r": "VisitError"}
+        )
+        self.assertEqual(
+            lines,
+            [
+                "- sub-routine r: Successful -> VisitError",
+                "+ I2: VisitError -> Successful",
+                "~ I3: VisitError -> UnexpectedToken",
+                "- I4: Successful -> VisitError",
+                "x I5: removed",
+                "+ I6: new -> Successful",
+                "Passed: 3 (+2/-2), failed: 2, failed sub-routines: 1",
+            ],
+        )
+        lines = format_delta(previous, current, {}, {}, limit=2)
+        self.assertEqual(lines[2], "... and 3 more.")
+
+
+if __name__ == "__main__":
+    TestWatch().main()
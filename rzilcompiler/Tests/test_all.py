@@ -10,8 +10,16 @@ from rzilcompiler.Tests.TestTransformer import (
     TestTransformerOutput,
     TestTransformedInstr,
 )
+from rzilcompiler.Tests.TestCompiler import TestCompiler
 from rzilcompiler.Tests.TestHelper import TestHelper
 from rzilcompiler.Tests.TestParser import TestParser
+from rzilcompiler.Tests.TestServer import TestServer
+from rzilcompiler.Tests.TestWatch import TestWatch
+from rzilcompiler.Tests.TestBenchmark import TestBenchmark
+from rzilcompiler.Tests.TestMemProfile import TestMemProfile
+from rzilcompiler.Tests.TestTrace import TestTrace
+from rzilcompiler.Tests.TestStageProfile import TestStageProfile
+from rzilcompiler.Tests.TestBuildGraph import TestBuildGraph
 
 if __name__ == "__main__":
     TestHybrids().main()
@@ -20,5 +28,13 @@ if __name__ == "__main__":
     TestGrammar().main()
     TestTransformerOutput().main()
     TestTransformedInstr().main()
+    TestCompiler().main()
     TestHelper().main()
     TestParser().main()
+    TestServer().main()
+    TestWatch().main()
+    TestBenchmark().main()
+    TestMemProfile().main()
+    TestTrace().main()
+    TestStageProfile().main()
+    TestBuildGraph().main()
@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class Tracer:
+    """
+    Records spans as complete events of the Chrome trace event format.
+    The files can be opened in chrome://tracing or https://ui.perfetto.dev
+    See: start_tracing()
+    """
+
+    def __init__(self):
+        self.events: list[dict] = list()
+        # The process which started the tracing. Other pids are worker processes.
+        self.pid = os.getpid()
+
+    def add_event(
+        self, name: str, cat: str, start: int, end: int, args: dict
+    ) -> None:
+        """Adds a span from <start> to <end> (perf_counter_ns())."""
+        self.events.append(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                # perf_counter() is a system wide monotonic clock on Linux.
+                # So the times of forked workers are comparable.
+                "ts": start / 1000,
+                "dur": (end - start) / 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+                "args": args,
+            }
+        )
+
+    def get_metadata(self) -> list[dict]:
+        """Returns the events which name the processes."""
+        pids = sorted({e["pid"] for e in self.events} | {self.pid})
+        return [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {
+                    "name": "rzilcompiler" if pid == self.pid else f"worker {pid}"
+                },
+            }
+            for pid in pids
+        ]
+
+    def write(self, path: Path) -> None:
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "traceEvents": self.get_metadata() + self.events,
+                    "displayTimeUnit": "ms",
+                },
+                f,
+            )
+
+
+class Span:
+    """A traced section of code. Use it as context manager."""
+
+    __slots__ = ("name", "cat", "args", "start")
+
+    def __init__(self, name: str, cat: str, args: dict):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if tracer is not None:
+            tracer.add_event(
+                self.name, self.cat, self.start, time.perf_counter_ns(), self.args
+            )
+        return False
+
+
+class NoSpan:
+    """The span returned if tracing is disabled. It does nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+# The tracer of this process. None if tracing is disabled.
+# Forked worker processes inherit it.
+tracer: Tracer | None = None
+
+
+def span(name: str, cat: str = "compiler", **args) -> Span | NoSpan:
+    """
+    Returns a span over the code of a with statement.
+    The keyword arguments are shown with the span in the trace viewer.
+    If tracing is disabled, a shared span which does nothing is returned.
+    """
+    if tracer is None:
+        return NO_SPAN
+    return Span(name, cat, args)
+
+
+def start_tracing() -> Tracer:
+    global tracer
+    tracer = Tracer()
+    return tracer
+
+
+def stop_tracing() -> Tracer | None:
+    global tracer
+    stopped = tracer
+    tracer = None
+    return stopped
+
+
+@contextmanager
+def collect_events():
+    """
+    Context which moves the events recorded in it from the tracer to the yielded list.
+    Worker processes send them back with their results and the parent process
+    adds them to its tracer (see: add_events()).
+    """
+    events = list()
+    if tracer is None:
+        yield events
+        return
+    n = len(tracer.events)
+    try:
+        yield events
+    finally:
+        events.extend(tracer.events[n:])
+        del tracer.events[n:]
+
+
+def add_events(events: list[dict] | None) -> None:
+    """Adds the events collected in a worker process to the tracer."""
+    if tracer is not None and events:
+        tracer.events.extend(events)
+
+
+@contextmanager
+def tracing(path: Path | None):
+    """
+    Context in which all spans are traced. The trace is written to <path> at the end.
+    If path is None, nothing is done.
+    """
+    if path is None:
+        yield
+        return
+    start_tracing()
+    try:
+        yield
+    finally:
+        stop_tracing().write(path)
@@ -1,6 +1,7 @@
 # SPDX-FileCopyrightText: 2022 Rot127 <rot127@posteo.com>
 # SPDX-License-Identifier: LGPL-3.0-only
 import re
+from collections.abc import Callable
 from enum import Enum
 
 from rzilcompiler.Exceptions import OverloadException
@@ -20,14 +21,25 @@ class SubRoutineInitType(Enum):
 class SubRoutine(Hybrid):
     """
     Represents a sub routine.
+    The body is either given precompiled or as function which compiles it.
+    In the latter case it is compiled on first access of body.
     """
 
     def __init__(
-        self, name: str, ret_type: ValueType, params: list[Parameter], body: str
+        self,
+        name: str,
+        ret_type: ValueType,
+        params: list[Parameter],
+        body: str | Callable[[], str],
     ):
         self.routine_name = name
-        # Precompiled subroutine's body.
-        self.body = self.check_for_bundle_usage(body)
+        # Precompiled subroutine's body. None until compile_body() was called.
+        self.compiled_body: str | None = None
+        self.compile_body: Callable[[], str] | None = None
+        if callable(body):
+            self.compile_body = body
+        else:
+            self.compiled_body = self.check_for_bundle_usage(body)
         self.op_type = HybridType.SUB_ROUTINE
         if ret_type.group & VTGroup.VOID:
             self.seq_order = HybridSeqOrder.EXEC_ONLY
@@ -36,6 +48,16 @@ class SubRoutine(Hybrid):
 
         Hybrid.__init__(self, name, params, ret_type)
 
+    @property
+    def body(self) -> str:
+        if self.compiled_body is None:
+            self.compiled_body = self.check_for_bundle_usage(self.compile_body())
+            self.compile_body = None
+        return self.compiled_body
+
+    def is_compiled(self) -> bool:
+        return self.compiled_body is not None
+
     def check_for_bundle_usage(self, code: str) -> str:
         if re.search(r"\Wpkt\W", code):
             code = "HexPkt *pkt = bundle->pkt;\n" + code
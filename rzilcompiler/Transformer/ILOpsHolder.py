@@ -116,6 +116,7 @@ class ILOpsHolder:
         self.write_ops.clear()
         self.let_ops.clear()
         self.op_count = 0
+        self.hybrid_op_count = 0
 
     def is_empty(self) -> bool:
         return (
@@ -4,6 +4,8 @@ from enum import Enum, auto
 
 from lark import Transformer, Token
 
+from rzilcompiler.CompactTree import CompactTree
+from rzilcompiler.Trace import span
 from rzilcompiler.Transformer.Hybrids.GCCStmtDeclExpr import GCCStmtDeclExpr
 from rzilcompiler.Transformer.Pures.Macro import Macro, MacroInvocation
 from rzilcompiler.Transformer.Pures.Bool import Bool
@@ -109,6 +111,13 @@ class RZILTransformer(Transformer):
             )
         super().__init__()
 
+    def transform(self, tree):
+        """Transforms a Lark tree or a CompactTree."""
+        with span("transform", "transformer"):
+            if isinstance(tree, CompactTree):
+                return tree.transform(self)
+            return super().transform(tree)
+
     def reset(self):
         self.ext.reset_flags()
         self.il_ops_holder.hybrid_effect_dict.clear()
@@ -161,7 +170,8 @@ class RZILTransformer(Transformer):
         res = ""
 
         if self.code_format in [CodeFormat.EXEC_CLASSES, CodeFormat.READ_STATEMENTS]:
-            res = self.emit_read_block(holder, res)
+            with span("emit_read_block", "transformer"):
+                res = self.emit_read_block(holder, res)
 
         if self.code_format in [CodeFormat.EXEC_CLASSES]:
             res = self.emit_exec_block(holder, res)
@@ -170,9 +180,11 @@ class RZILTransformer(Transformer):
             res = self.emit_write_block(holder, res)
 
         if self.code_format == CodeFormat.READ_STATEMENTS:
-            res = self.emit_stmt_blocks(holder, res)
+            with span("emit_stmt_blocks", "transformer"):
+                res = self.emit_stmt_blocks(holder, res)
 
-        res = self.emit_final_seq_return(items, res)
+        with span("emit_final_seq_return", "transformer"):
+            res = self.emit_final_seq_return(items, res)
         return res
 
     def emit_final_seq_return(self, items, res):
@@ -0,0 +1,373 @@
+# SPDX-FileCopyrightText: 2024 Rot127 <rot127@posteo.com>
+# SPDX-License-Identifier: LGPL-3.0-only
+
+import json
+import re
+import time
+
+from collections.abc import Iterable
+from enum import StrEnum
+from pathlib import Path
+
+from rzilcompiler.Configuration import Conf, InputFile
+from rzilcompiler.Helper import log, LogLevel
+from rzilcompiler.Parser import ParserMode, lark_parsers
+
+
+class Stage(StrEnum):
+    """The compile stages which are rerun if a resource file changes."""
+
+    PREPROCESSOR = "preprocessor"
+    PARSER = "parser"
+    NOPED = "noped"
+    MACROS = "macros"
+    SUB_ROUTINES = "sub_routines"
+
+
+# The stage each watched resource is an input of.
+# Files written by the preprocessor (e.g. shortcode_resolved.h) are not watched.
+WATCHED_RESOURCES = {
+    InputFile.HEXAGON_PP_MACROS_H: Stage.PREPROCESSOR,
+    InputFile.HEXAGON_PP_MACROS_MMVEC_H: Stage.PREPROCESSOR,
+    InputFile.HEXAGON_PP_MACROS_INC: Stage.PREPROCESSOR,
+    InputFile.HEXAGON_PP_PATCHES_MACROS_H: Stage.PREPROCESSOR,
+    InputFile.HEXAGON_PP_SHORTCODE_H: Stage.PREPROCESSOR,
+    InputFile.HEXAGON_NOPED_INSNS_JSON: Stage.NOPED,
+    InputFile.HEXAGON_QEMU_RZIL_MACROS_JSON: Stage.MACROS,
+    InputFile.HEXAGON_SUB_ROUTINES_JSON: Stage.SUB_ROUTINES,
+}
+
+
+def get_watched_resources(parser_mode: ParserMode) -> dict[Path, Stage]:
+    """Returns the paths of the watched resource files and their stages."""
+    resources = {Conf.get_path(f): stage for f, stage in WATCHED_RESOURCES.items()}
+    grammar = (
+        InputFile.GRAMMAR_LALR if parser_mode == ParserMode.LALR else InputFile.GRAMMAR
+    )
+    resources[Conf.get_path(grammar, "Hexagon")] = Stage.PARSER
+    return resources
+
+
+class ResourceWatcher:
+    """
+    Detects changed files by polling their modification time and size.
+    It needs no file system notifications, so it works on every platform.
+    """
+
+    def __init__(self, paths: Iterable[Path]):
+        self.paths = list(paths)
+        self.stamps = self.get_stamps()
+
+    def get_stamps(self) -> dict[Path, tuple[int, int] | None]:
+        stamps = dict()
+        for path in self.paths:
+            try:
+                stat = path.stat()
+                stamps[path] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                stamps[path] = None
+        return stamps
+
+    def poll(self) -> set[Path]:
+        """Returns the files which were modified, created or removed since the last poll."""
+        stamps = self.get_stamps()
+        changed = {p for p in self.paths if stamps[p] != self.stamps[p]}
+        self.stamps = stamps
+        return changed
+
+
+def load_json_entries(file: InputFile, key: str) -> dict[str, dict]:
+    with open(Conf.get_path(file)) as f:
+        return json.load(f)[key]
+
+
+def get_changed_entries(old: dict[str, dict], new: dict[str, dict]) -> set[str]:
+    """Returns the names of the entries which were added, removed or changed."""
+    return {n for n in old.keys() | new.keys() if old.get(n) != new.get(n)}
+
+
+def get_name_pattern(names: Iterable[str]) -> re.Pattern:
+    """Returns a pattern which matches any of the names as identifier."""
+    return re.compile(r"\b(" + "|".join(re.escape(n) for n in sorted(names)) + r")\b")
+
+
+def get_dependent_sub_routines(
+    names: set[str], sub_routines: dict[str, dict]
+) -> set[str]:
+    """
+    Returns the names and the names of all sub-routines which use one of them,
+    directly or via other sub-routines.
+    """
+    dependent = set(names)
+    while dependent:
+        pattern = get_name_pattern(dependent)
+        users = {
+            n
+            for n, routine in sub_routines.items()
+            if n not in dependent and pattern.search(routine["code"])
+        }
+        if not users:
+            break
+        dependent |= users
+    return dependent
+
+
+def get_dependent_insns(names: set[str], behaviors: dict[str, list]) -> set[str]:
+    """Returns the instructions whose behavior uses one of the names."""
+    if not names:
+        return set()
+    pattern = get_name_pattern(names)
+    return {n for n, b in behaviors.items() if any(pattern.search(x) for x in b)}
+
+
+def get_status(result) -> str:
+    return result.exception or "Successful"
+
+
+def get_changes(
+    previous: dict[str, str], current: dict[str, str], kind: str = ""
+) -> list[str]:
+    """
+    Returns a line for each entry which was added, removed or whose status changed:
+    "+" passes now, "-" fails now, "~" fails differently, "x" was removed.
+    :param previous: The status of each entry in the previous run ("Successful" or the exception).
+    :param current: The status of each entry in this run.
+    :param kind: Prefix of the entry names.
+    """
+    changes = list()
+    for name in sorted(previous.keys() | current.keys()):
+        if name not in current:
+            changes.append(f"x {kind}{name}: removed")
+            continue
+        now = current[name]
+        before = previous.get(name, "new")
+        if now == before:
+            continue
+        if now == "Successful":
+            mark = "+"
+        elif before in ["Successful", "new"]:
+            mark = "-"
+        else:
+            mark = "~"
+        changes.append(f"{mark} {kind}{name}: {before} -> {now}")
+    return changes
+
+
+def format_delta(
+    previous: dict[str, str],
+    current: dict[str, str],
+    previous_routines: dict[str, str],
+    current_routines: dict[str, str],
+    limit: int = 20,
+) -> list[str]:
+    """
+    Returns the lines of the pass/fail delta between two runs (see: get_changes()).
+    The status dicts map the instructions and sub-routines to "Successful" or their exception.
+    :param limit: Maximum number of listed changes.
+    """
+    changes = get_changes(previous_routines, current_routines, "sub-routine ")
+    changes += get_changes(previous, current)
+    lines = changes[:limit]
+    if len(changes) > limit:
+        lines.append(f"... and {len(changes) - limit} more.")
+    passed = {n for n, s in current.items() if s == "Successful"}
+    fixed = sum(1 for n in passed if previous.get(n) != "Successful")
+    broken = sum(
+        1 for n, s in previous.items() if s == "Successful" and n not in passed
+    )
+    failed_routines = sum(1 for s in current_routines.values() if s != "Successful")
+    lines.append(
+        f"Passed: {len(passed)} (+{fixed}/-{broken}), failed: {len(current) - len(passed)}, "
+        f"failed sub-routines: {failed_routines}"
+    )
+    return lines
+
+
+class WatchSession:
+    """
+    Keeps the results of all instructions and recompiles only the ones
+    affected by changed resource files. See: watch()
+    """
+
+    def __init__(self, compiler, jobs: int = 0):
+        """
+        :param compiler: The set up compiler with loaded instruction behaviors.
+        :param jobs: Number of worker processes. If 0, the instructions are compiled
+                     in this process.
+        """
+        self.compiler = compiler
+        self.jobs = jobs
+        self.resources = get_watched_resources(compiler.parser_mode)
+        self.watcher = ResourceWatcher(self.resources.keys())
+        # The results of the last run (name -> CompiledInsnResult).
+        self.results: dict = dict()
+        # "Successful" or the exception of each sub-routine body.
+        self.routine_status: dict[str, str] = dict()
+        # The JSON entries the compiler was set up with. To detect what changed.
+        self.macros = load_json_entries(
+            InputFile.HEXAGON_QEMU_RZIL_MACROS_JSON, "macros"
+        )
+        self.sub_routines = load_json_entries(
+            InputFile.HEXAGON_SUB_ROUTINES_JSON, "sub_routines"
+        )
+        self.runs = 0
+
+    def compile_all(self) -> None:
+        start = time.perf_counter()
+        behaviors = self.compiler.preprocessor.behaviors
+        self.results = self.compiler.compile_insns(behaviors, self.jobs)
+        self.compiler.evict_result_cache()
+        self.compile_sub_routines(self.sub_routines.keys())
+        passed = sum(1 for r in self.results.values() if not r.exception)
+        log(
+            f"Compiled {len(self.results)} instructions in {time.perf_counter() - start:.2f}s. "
+            f"Passed: {passed}, failed: {len(self.results) - passed}"
+        )
+
+    def compile_sub_routines(self, names: Iterable[str]) -> None:
+        """Compiles the bodies of the sub-routines and updates their status."""
+        for name in sorted(names):
+            try:
+                self.compiler.get_sub_routine(name).body
+                self.routine_status[name] = "Successful"
+            except Exception as e:
+                log(
+                    f"Sub-routine {name} failed to compile: {type(e).__name__}: {e}",
+                    LogLevel.ERROR,
+                )
+                self.routine_status[name] = type(e).__name__
+
+    def rerun_stages(self, changed: set[Path]) -> set[str]:
+        """
+        Reruns the stages of the changed resource files:
+        The preprocessor for headers, the parser for the grammar,
+        the macros, sub-routines and noped instructions for the JSON files.
+        Returns the instructions which are affected by the changes.
+        """
+        stages = {self.resources[p] for p in changed}
+        compiler = self.compiler
+        behaviors = compiler.preprocessor.behaviors
+        # Load the JSON files first, so a broken file leaves the compiler untouched.
+        macros = self.macros
+        if Stage.MACROS in stages:
+            macros = load_json_entries(
+                InputFile.HEXAGON_QEMU_RZIL_MACROS_JSON, "macros"
+            )
+        sub_routines = self.sub_routines
+        if Stage.SUB_ROUTINES in stages:
+            sub_routines = load_json_entries(
+                InputFile.HEXAGON_SUB_ROUTINES_JSON, "sub_routines"
+            )
+
+        affected = set()
+        if Stage.PREPROCESSOR in stages:
+            previous = dict(behaviors)
+            compiler.run_preprocessor()
+            behaviors.clear()
+            compiler.preprocessor.load_insn_behavior()
+            affected |= {n for n, b in behaviors.items() if previous.get(n) != b}
+        if Stage.PARSER in stages:
+            lark_parsers.pop(compiler.parser_mode, None)
+            compiler.set_lark_parser()
+            affected |= behaviors.keys()
+        if Stage.NOPED in stages:
+            previous = set(compiler.noped_insns)
+            compiler.add_noped_insns()
+            toggled = previous ^ set(compiler.noped_insns)
+            affected |= {
+                n for n in behaviors if compiler.ext.transform_insn_name(n) in toggled
+            }
+        if Stage.MACROS in stages:
+            compiler.transformer.macros.clear()
+            compiler.add_macros()
+        if Stage.MACROS in stages or Stage.SUB_ROUTINES in stages:
+            names = get_changed_entries(self.macros, macros)
+            names |= get_changed_entries(self.sub_routines, sub_routines)
+            names = get_dependent_sub_routines(names, sub_routines)
+            compiler.sub_routines.clear()
+            compiler.transformer.sub_routines.clear()
+            compiler.add_sub_routines()
+            self.routine_status = {
+                n: s for n, s in self.routine_status.items() if n in sub_routines
+            }
+            self.compile_sub_routines(names & sub_routines.keys())
+            affected |= get_dependent_insns(names, behaviors)
+        self.macros = macros
+        self.sub_routines = sub_routines
+
+        # The keys of the compiled output cache include the JSON resources.
+        compiler.result_cache_digest = ""
+        compiler.transformed_behaviors.clear()
+        return affected
+
+    def run(self, changed: set[Path]) -> None:
+        """Recompiles the instructions affected by the changed files and prints the delta."""
+        self.runs += 1
+        start = time.perf_counter()
+        previous_routines = dict(self.routine_status)
+        affected = self.rerun_stages(changed)
+        behaviors = self.compiler.preprocessor.behaviors
+        previous = self.results
+        to_compile = {
+            n: b for n, b in behaviors.items() if n in affected or n not in previous
+        }
+        results = (
+            self.compiler.compile_insns(to_compile, self.jobs) if to_compile else {}
+        )
+        self.results = {
+            n: results[n] if n in results else previous[n] for n in behaviors.keys()
+        }
+        for name in previous.keys() - behaviors.keys():
+            self.compiler.compiled_insns.pop(
+                self.compiler.ext.transform_insn_name(name), None
+            )
+
+        files = ", ".join(sorted(p.name for p in changed))
+        log(
+            f"Run {self.runs} ({files}): {len(to_compile)} instructions recompiled "
+            f"in {time.perf_counter() - start:.2f}s."
+        )
+        delta = format_delta(
+            {n: get_status(r) for n, r in previous.items()},
+            {n: get_status(r) for n, r in self.results.items()},
+            previous_routines,
+            self.routine_status,
+        )
+        for line in delta:
+            print(f"\t{line}")
+
+
+def watch(compiler, interval: float = 1.0, jobs: int = 0) -> None:
+    """
+    Compiles all instructions. Then polls the resource files and reruns only the
+    stages affected by a change, until interrupted.
+    After each run the pass/fail delta to the previous run is printed.
+
+    :param compiler: The set up compiler with loaded instruction behaviors.
+    :param interval: Seconds between two polls.
+    :param jobs: Number of worker processes. If 0, the instructions are compiled
+                 in this process.
+    """
+    session = WatchSession(compiler, jobs)
+    session.compile_all()
+    log(
+        f"Watch {len(session.resources)} resource files (poll every {interval}s). "
+        "Stop with Ctrl+C."
+    )
+    # Files of failed runs. Their stages are rerun with the next change.
+    pending: set[Path] = set()
+    try:
+        while True:
+            time.sleep(interval)
+            changed = session.watcher.poll()
+            if not changed:
+                continue
+            pending |= changed
+            try:
+                session.run(pending)
+                pending = set()
+            except Exception as e:
+                # E.g. a half written file.
+                log(f"Run failed: {type(e).__name__}: {e}", LogLevel.ERROR)
+    except KeyboardInterrupt:
+        log("Stop watching.")